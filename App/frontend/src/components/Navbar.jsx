@@ -1,6 +1,6 @@
 import { Link, useLocation } from 'react-router-dom';
 import { useState, useEffect } from 'react';
-import sessionManager from '../utils/sessionManager';
+import sessionManager, { CART_EVENT } from '../utils/sessionManager';
 
 export default function Navbar() {
   const location = useLocation();
@@ -15,12 +15,15 @@ export default function Navbar() {
     };
 
     updateCartCount();
-    const interval = setInterval(updateCartCount, 1000);
+    // Cart page pushes updates through sessionManager.setCart; 'storage' covers other tabs
+    window.addEventListener(CART_EVENT, updateCartCount);
+    window.addEventListener('storage', updateCartCount);
 
     const handleScroll = () => setIsScrolled(window.scrollY > 4);
     window.addEventListener('scroll', handleScroll);
     return () => {
-      clearInterval(interval);
+      window.removeEventListener(CART_EVENT, updateCartCount);
+      window.removeEventListener('storage', updateCartCount);
       window.removeEventListener('scroll', handleScroll);
     };
   }, []);
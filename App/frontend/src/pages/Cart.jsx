@@ -5,11 +5,24 @@ import heartbeatManager from '../utils/heartbeatManager';
 import api from '../utils/api';
 import { getProductImage } from '../utils/productImageMap';
 
+const toCartItem = (item) => ({
+  id: item.product.barcode, // Use barcode as unique ID
+  ...item.product,
+  // Attach image URL via util
+  image: getProductImage(item.product),
+  quantity: item.quantity,
+  subtotal: item.subtotal,
+});
+
+// Two server keepalives (15s each) plus some slack
+const STREAM_SILENCE_MS = 35000;
+
+const parseTotal = (total) => (typeof total === 'string' ? parseFloat(total) : (total || 0));
+
 export default function Cart() {
   const navigate = useNavigate();
   const [cart, setCart] = useState({ items: [], total: 0 });
   const [loading, setLoading] = useState(true);
-  const [pollingActive, setPollingActive] = useState(true);
   const [hasSession, setHasSession] = useState(false);
 
   useEffect(() => {
@@ -30,17 +43,88 @@ export default function Cart() {
     
     fetchCart();
 
-    const pollInterval = setInterval(() => {
-      if (pollingActive) {
-        checkForNewProducts();
-      }
-    }, 2000);
+    // Push cart changes from the server. Poll instead while there is no
+    // stream: no EventSource, a failed or refused connection, or no event
+    // (not even a keepalive) for STREAM_SILENCE_MS
+    let pollInterval = null;
+    let silenceTimer = null;
+    const startPolling = () => {
+      if (!pollInterval) pollInterval = setInterval(checkForNewProducts, 2000);
+    };
+    const stopPolling = () => {
+      clearInterval(pollInterval);
+      pollInterval = null;
+    };
+    const streamAlive = () => {
+      stopPolling();
+      clearTimeout(silenceTimer);
+      silenceTimer = setTimeout(startPolling, STREAM_SILENCE_MS);
+    };
+
+    const stream = api.subscribeToCart(session.id, {
+      onSnapshot: (cartData) => {
+        streamAlive();
+        applyCart(cartData);
+      },
+      onItem: (change) => {
+        streamAlive();
+        applyItemChange(change);
+      },
+      onKeepalive: streamAlive,
+      onEnded: () => {
+        stopPolling();
+        clearTimeout(silenceTimer);
+        disconnect();
+      },
+      onError: startPolling,
+    });
+    if (stream) {
+      silenceTimer = setTimeout(startPolling, STREAM_SILENCE_MS);
+    } else {
+      startPolling();
+    }
 
     return () => {
-      clearInterval(pollInterval);
+      stream?.close();
+      stopPolling();
+      clearTimeout(silenceTimer);
       // Don't stop heartbeat here - let it run as long as user is in the app
     };
-  }, [pollingActive]);
+  }, []);
+
+  const disconnect = () => {
+    sessionManager.clearSession();
+    setHasSession(false);
+    heartbeatManager.stop();
+  };
+
+  const applyCart = (cartData) => {
+    if (!cartData || !cartData.items) return;
+    // Flatten the items structure to include product details at item level
+    const updatedCart = {
+      items: cartData.items.map(toCartItem),
+      total: parseTotal(cartData.total),
+    };
+    setCart(updatedCart);
+    // Update local storage
+    sessionManager.setCart(updatedCart);
+  };
+
+  const applyItemChange = ({ item, total }) => {
+    setCart((previous) => {
+      const changed = toCartItem(item);
+      const others = previous.items.filter((existing) => existing.id !== changed.id);
+      const index = previous.items.findIndex((existing) => existing.id === changed.id);
+      let items = others;
+      if (changed.quantity > 0) {
+        items = [...others];
+        items.splice(index === -1 ? items.length : index, 0, changed);
+      }
+      const updatedCart = { items, total: parseTotal(total) };
+      sessionManager.setCart(updatedCart);
+      return updatedCart;
+    });
+  };
 
   const fetchCart = async () => {
     try {
@@ -55,35 +139,12 @@ export default function Cart() {
       }
       
       try {
-        const cartData = await api.getCart(sessionId);
-        if (cartData && cartData.items) {
-          // Flatten the items structure to include product details at item level
-          const flattenedItems = cartData.items.map((item) => ({
-            id: item.product.barcode, // Use barcode as unique ID
-            ...item.product,
-            // Attach image URL via util
-            image: getProductImage(item.product),
-            quantity: item.quantity,
-            subtotal: item.subtotal,
-          }));
-          
-          const cart = {
-            items: flattenedItems,
-            total: typeof cartData.total === 'string' ? parseFloat(cartData.total) : (cartData.total || 0),
-          };
-          
-          setCart(cart);
-          // Update local storage
-          sessionManager.getCart().items = flattenedItems;
-          sessionManager.getCart().total = cart.total;
-        }
+        applyCart(await api.getCart(sessionId));
       } catch (err) {
         console.warn('Failed to fetch from API:', err);
         // If session invalid or expired, clear and mark as disconnected
         if (err?.status === 404 || err?.status === 400) {
-          sessionManager.clearSession();
-          setHasSession(false);
-          heartbeatManager.stop();
+          disconnect();
         } else {
           // fallback to local cart
           const localCart = sessionManager.getCart();
@@ -105,33 +166,11 @@ export default function Cart() {
       }
       
       // Fetch latest cart from backend
-      const cartData = await api.getCart(sessionId);
-      if (cartData && cartData.items) {
-        // Flatten the items structure
-        const flattenedItems = cartData.items.map((item) => ({
-          id: item.product.barcode,
-          ...item.product,
-          image: getProductImage(item.product),
-          quantity: item.quantity,
-          subtotal: item.subtotal,
-        }));
-        
-        const updatedCart = {
-          items: flattenedItems,
-          total: typeof cartData.total === 'string' ? parseFloat(cartData.total) : (cartData.total || 0),
-        };
-        
-        setCart(updatedCart);
-        // Update local storage
-        sessionManager.getCart().items = flattenedItems;
-        sessionManager.getCart().total = updatedCart.total;
-      }
+      applyCart(await api.getCart(sessionId));
     } catch (err) {
       console.debug('Failed to fetch updated cart:', err);
       if (err?.status === 404 || err?.status === 400) {
-        sessionManager.clearSession();
-        setHasSession(false);
-        heartbeatManager.stop();
+        disconnect();
       }
       // Silent otherwise
     }
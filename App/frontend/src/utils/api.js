@@ -12,15 +12,19 @@ class APIError extends Error {
   }
 }
 
+const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
 export const api = {
   async request(endpoint, options = {}) {
     const url = `${API_BASE_URL}${endpoint}`;
     const defaultOptions = {
       method: 'GET',
+      ...options,
       headers: {
         'Content-Type': 'application/json',
+        ...options.headers,
       },
-      ...options,
     };
 
     try {
@@ -63,6 +67,27 @@ export const api = {
     }
   },
 
+  // POST that is safe to retry: every attempt carries the same Idempotency-Key,
+  // so the backend replays the first response instead of applying it twice.
+  async idempotentRequest(endpoint, options = {}, retries = 2) {
+    const key = newIdempotencyKey();
+    for (let attempt = 0; ; attempt += 1) {
+      try {
+        return await this.request(endpoint, {
+          ...options,
+          method: 'POST',
+          headers: { ...options.headers, 'Idempotency-Key': key },
+        });
+      } catch (error) {
+        // Only network failures are retried; the server answered anything else.
+        if (error.status !== null || attempt >= retries) {
+          throw error;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 500 * (attempt + 1)));
+      }
+    }
+  },
+
   // User Management
   async signupUser(name, phoneNumber, email = '') {
     return this.request('/user/signup', {
@@ -106,8 +131,7 @@ export const api = {
 
   // Cart Management
   async scanProduct(sessionId, barcode) {
-    return this.request('/cart/scan', {
-      method: 'POST',
+    return this.idempotentRequest('/cart/scan', {
       body: JSON.stringify({
         session_id: sessionId,
         barcode,
@@ -116,8 +140,7 @@ export const api = {
   },
 
   async removeFromCart(sessionId, barcode) {
-    return this.request('/cart/remove', {
-      method: 'POST',
+    return this.idempotentRequest('/cart/remove', {
       body: JSON.stringify({
         session_id: sessionId,
         barcode,
@@ -129,6 +152,36 @@ export const api = {
     return this.request(`/cart/view?session_id=${sessionId}`);
   },
 
+  // Live cart updates over Server-Sent Events. Returns the EventSource (call
+  // .close() to stop) or null when the browser has no EventSource support.
+  // The browser reconnects on its own and resumes from the last cart version,
+  // unless the server refused the stream; onError fires either way. The server
+  // sends a keepalive event every CART_EVENTS_KEEPALIVE_SECONDS.
+  subscribeToCart(sessionId, { onSnapshot, onItem, onPayment, onKeepalive, onEnded, onError } = {}) {
+    if (typeof window === 'undefined' || !window.EventSource) {
+      return null;
+    }
+
+    const source = new EventSource(`${API_BASE_URL}/cart/events?session_id=${sessionId}`);
+    const listen = (type, handler) => {
+      if (!handler) return;
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    };
+
+    listen('cart', onSnapshot);
+    listen('cart_item', onItem);
+    listen('payment', onPayment);
+    listen('keepalive', onKeepalive);
+    listen('session', (data) => {
+      source.close();
+      onEnded?.(data);
+    });
+    if (onError) {
+      source.onerror = onError;
+    }
+    return source;
+  },
+
   // Alias for viewCart to match Cart.jsx usage
   async getCart(sessionId) {
     return this.viewCart(sessionId);
@@ -143,8 +196,7 @@ export const api = {
 
   // Payment Management
   async createPayment(sessionId) {
-    return this.request('/payment/create', {
-      method: 'POST',
+    return this.idempotentRequest('/payment/create', {
       body: JSON.stringify({
         session_id: sessionId,
       }),
@@ -4,6 +4,7 @@
 const SESSION_KEY = 'smart_trolley_session';
 const CART_KEY = 'smart_trolley_cart';
 const SESSION_TIMEOUT = 24 * 60 * 60 * 1000; // 24 hours
+export const CART_EVENT = 'smarttrolley:cart';
 
 export const sessionManager = {
   // Session creation - called when user scans QR code
@@ -68,6 +69,13 @@ export const sessionManager = {
     return cart ? JSON.parse(cart) : { items: [], total: 0 };
   },
 
+  // Replace the stored cart (e.g. with the server's copy) and notify listeners such as the Navbar
+  setCart(cart) {
+    localStorage.setItem(CART_KEY, JSON.stringify(cart));
+    window.dispatchEvent(new CustomEvent(CART_EVENT, { detail: cart }));
+    return cart;
+  },
+
   // Add product scanned by ESP32
   addScannedProduct(product) {
     const cart = this.getCart();
@@ -122,6 +130,7 @@ export const sessionManager = {
 
   clearCart() {
     localStorage.removeItem(CART_KEY);
+    window.dispatchEvent(new CustomEvent(CART_EVENT, { detail: { items: [], total: 0 } }));
   },
 
   // Clear entire session (called after checkout is complete)
@@ -0,0 +1,181 @@
+"""Coalesced writes of ``Session.last_activity`` and ``Trolley.last_seen``.
+
+Heartbeats, scans and removes used to issue two UPDATEs each. The tracker
+keeps the newest touch per session in memory and a background thread writes
+them every ``ACTIVITY_FLUSH_INTERVAL_SECONDS`` with a handful of bulk UPDATEs.
+Timestamps are floored to ``ACTIVITY_WRITE_GRANULARITY_SECONDS`` so touches
+that land in the same window share one statement, and a touch is dropped when
+the stored value is already within one window of it.
+
+Timeout checks in this process go through ``latest()``, so they always see
+pending touches. Other processes only see them once flushed, so keep the
+flush interval plus granularity well below ``SESSION_TIMEOUT_SECONDS``. Set the
+interval to 0 to write through on every touch instead.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .fleet import get_fleet
+from .models import Session, Trolley
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    def __init__(self, flush_interval: float, granularity: float):
+        self.flush_interval = flush_interval
+        self.granularity = granularity
+        self._lock = threading.Lock()
+        # session_id -> (trolley pk, floored touch time)
+        self._pending = {}
+        # Taken out of _pending by a flush that is still writing them
+        self._flushing = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._counters = {'touches': 0, 'coalesced': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+        self._last_flush_ms = 0.0
+
+    def _floor(self, moment: datetime) -> datetime:
+        if self.granularity <= 0:
+            return moment
+        step = timedelta(seconds=self.granularity)
+        return moment - (moment - datetime.min.replace(tzinfo=moment.tzinfo)) % step
+
+    def touch(self, session: Session, at: datetime = None) -> datetime:
+        """Record activity on ``session`` and its trolley; returns the time recorded."""
+        at = self._floor(at or timezone.now())
+        if session.last_activity and at - session.last_activity < timedelta(seconds=self.granularity):
+            with self._lock:
+                self._counters['touches'] += 1
+                self._counters['coalesced'] += 1
+            return session.last_activity
+
+        get_fleet().seen(session.trolley_id, at)
+        if self.flush_interval <= 0:
+            self._write({session.session_id: (session.trolley_id, at)})
+            with self._lock:
+                self._counters['touches'] += 1
+            return at
+
+        with self._lock:
+            self._counters['touches'] += 1
+            previous = self._pending.get(session.session_id)
+            if previous is not None:
+                self._counters['coalesced'] += 1
+                if previous[1] >= at:
+                    return previous[1]
+            self._pending[session.session_id] = (session.trolley_id, at)
+        self._ensure_thread()
+        return at
+
+    def latest(self, session_id, stored: datetime) -> datetime:
+        """The newer of ``stored`` and any touch not yet written for ``session_id``."""
+        with self._lock:
+            candidates = [entry[1] for entry in (self._pending.get(session_id), self._flushing.get(session_id)) if entry]
+        return max([stored, *candidates]) if candidates else stored
+
+    def discard(self, session_id) -> None:
+        """Forget pending touches, e.g. once the session has ended."""
+        with self._lock:
+            self._pending.pop(session_id, None)
+
+    def flush(self) -> int:
+        """Write all pending touches now; returns the number of touches written."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception:
+            logger.exception('Activity flush failed; keeping %d touches for the next one', len(batch))
+            with self._lock:
+                self._counters['errors'] += 1
+                for session_id, entry in batch.items():
+                    newer = self._pending.get(session_id)
+                    if newer is None or newer[1] < entry[1]:
+                        self._pending[session_id] = entry
+                self._flushing = {}
+            return 0
+        with self._lock:
+            self._flushing = {}
+            self._counters['flushes'] += 1
+            self._counters['rows_written'] += len(batch)
+            self._last_flush_ms = (time.perf_counter() - started) * 1000
+        return len(batch)
+
+    def _write(self, batch: dict) -> None:
+        sessions_by_time = defaultdict(list)
+        trolleys_by_time = defaultdict(set)
+        for session_id, (trolley_pk, at) in batch.items():
+            sessions_by_time[at].append(session_id)
+            trolleys_by_time[at].add(trolley_pk)
+        # One UPDATE per time window; the lt filter keeps a late flush from
+        # moving a timestamp backwards, and sessions that ended in the meantime
+        # keep the time they ended at.
+        for at, session_ids in sessions_by_time.items():
+            Session.objects.filter(session_id__in=session_ids, is_active=True, last_activity__lt=at).update(last_activity=at)
+        for at, trolley_pks in trolleys_by_time.items():
+            Trolley.objects.filter(pk__in=trolley_pks).exclude(last_seen__gte=at).update(last_seen=at)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            close_old_connections()
+            self.flush()
+        connection.close()
+
+    def shutdown(self) -> None:
+        """Stop the flush thread and write whatever is still pending."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'flush_interval_seconds': self.flush_interval,
+                'granularity_seconds': self.granularity,
+                'pending': len(self._pending),
+                'last_flush_ms': round(self._last_flush_ms, 3),
+                **self._counters,
+            }
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_activity_tracker() -> ActivityTracker:
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = ActivityTracker(
+                    flush_interval=settings.ACTIVITY_FLUSH_INTERVAL_SECONDS,
+                    granularity=settings.ACTIVITY_WRITE_GRANULARITY_SECONDS,
+                )
+                atexit.register(_tracker.shutdown)
+    return _tracker
@@ -1,6 +1,10 @@
 from django.contrib import admin
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
-from .models import CartItem, Payment, Product, Session, Trolley, User
+from .models import CartItem, Payment, PaymentLine, Product, Session, Trolley, User
+from .provisioning import provision
+from .sales_export import csv_lines, sales_rows
 
 
 @admin.register(User)
@@ -21,6 +25,17 @@ class TrolleyAdmin(admin.ModelAdmin):
 	list_display = ('trolley_id', 'is_assigned', 'is_active', 'last_seen')
 	list_filter = ('is_assigned', 'is_active')
 	search_fields = ('trolley_id',)
+	actions = ('activate_trolleys', 'deactivate_trolleys')
+
+	@admin.action(description='Activate selected trolleys')
+	def activate_trolleys(self, request, queryset):
+		result = provision('activate', list(queryset.values_list('trolley_id', flat=True)))
+		self.message_user(request, f'Activated {result.changed} trolleys.')
+
+	@admin.action(description='Deactivate selected trolleys and end their sessions')
+	def deactivate_trolleys(self, request, queryset):
+		result = provision('deactivate', list(queryset.values_list('trolley_id', flat=True)))
+		self.message_user(request, f'Deactivated {result.changed} trolleys, ended {result.sessions_ended} sessions.')
 
 
 @admin.register(Session)
@@ -36,8 +51,25 @@ class CartItemAdmin(admin.ModelAdmin):
 	search_fields = ('session__session_id', 'product__name', 'product__barcode')
 
 
+class PaymentLineInline(admin.TabularInline):
+	model = PaymentLine
+	fields = ('barcode', 'name', 'category', 'quantity', 'subtotal')
+	readonly_fields = fields
+	extra = 0
+	can_delete = False
+
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
 	list_display = ('id', 'session', 'user', 'total_amount', 'payment_status', 'created_at')
 	list_filter = ('payment_status',)
 	search_fields = ('session__session_id', 'user__phone_number')
+	inlines = (PaymentLineInline,)
+	actions = ('export_sales',)
+
+	@admin.action(description='Export selected payments with cart lines (CSV)')
+	def export_sales(self, request, queryset):
+		# Streamed a page of payments at a time, so "select all" works on large tables
+		response = StreamingHttpResponse(csv_lines(sales_rows(queryset)), content_type='text/csv')
+		response['Content-Disposition'] = f'attachment; filename="sales-{timezone.now():%Y%m%d-%H%M%S}.csv"'
+		return response
@@ -0,0 +1,193 @@
+"""Async variants of the endpoints trolleys call most: image scans, cart polls and heartbeats.
+
+Under ASGI Django reads the request body on the event loop for every view, and
+runs each request's synchronous view on a thread of its own (one
+``ThreadSensitiveContext`` per request), so slow uploads don't hold threads
+and sync views don't queue behind each other. What a sync view does hold is
+its thread for the whole request, including the wait for the decoder pool.
+These views hold none while they wait:
+
+- barcode decoding is awaited from the decoder pool (``DecodeEngine.adecode``);
+- ORM work runs in short hops on the loop's thread pool through
+  ``sync_to_async(thread_sensitive=False)``, with connections recycled around
+  each hop as the request cycle would.
+
+``python manage.py bench_slow_clients`` compares both kinds; the difference
+shows in cart-poll latency while many scans wait on the decoder.
+
+Responses, errors and ``Idempotency-Key`` handling match the ``APIView``
+versions. They are always served under ``/api/async/``; with
+``API_ASYNC_VIEWS = True`` they also replace the regular routes.
+"""
+import asyncio
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+
+from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
+
+from .decoding import ImageDecodeError, adecode_barcode
+from .frame_cache import dhash, get_frame_cache
+from .idempotency import aidempotent
+from .instrumentation import span
+from .serializers import BarcodeScanQuerySerializer, CartViewSerializer, SessionIdSerializer
+from .utils import calculate_cart_total, get_cart_version, get_session, refresh_activity
+from .views import _cart_etag, _cart_payload, _frame_cache_key, _remember_scan, _scan_into_cart
+
+
+def _in_thread(func, *args, **kwargs):
+	close_old_connections()
+	try:
+		return func(*args, **kwargs)
+	finally:
+		close_old_connections()
+
+
+async def _db(func, *args, **kwargs):
+	"""Run ``func`` in a pool thread instead of the shared sync thread."""
+	return await sync_to_async(_in_thread, thread_sensitive=False)(func, *args, **kwargs)
+
+
+def api_errors(view):
+	"""Turn DRF exceptions into the same JSON responses DRF's handler produces."""
+	@functools.wraps(view)
+	async def wrapper(request, *args, **kwargs):
+		try:
+			return await view(request, *args, **kwargs)
+		except APIException as exc:
+			data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+			response = JsonResponse(data, status=exc.status_code, safe=False)
+			if getattr(exc, 'wait', None):
+				response['Retry-After'] = '%d' % exc.wait
+			return response
+
+	return wrapper
+
+
+def _json_body(request) -> dict:
+	try:
+		data = json.loads(request.body or b'{}')
+	except ValueError as exc:
+		raise ParseError(f'JSON parse error - {exc}') from exc
+	if not isinstance(data, dict):
+		raise ParseError('JSON body must be an object')
+	return data
+
+
+async def _adecode_frame(image_bytes, cache_key=None):
+	"""``views._decode_frame`` without blocking the event loop."""
+	if cache_key is None:
+		with span('decode'):
+			return await adecode_barcode(image_bytes), False, None
+	frame_cache = get_frame_cache()
+	with span('frame_hash'):
+		fingerprint = await asyncio.get_running_loop().run_in_executor(None, dhash, image_bytes)
+	if fingerprint is not None:
+		cached = frame_cache.lookup(cache_key, fingerprint)
+		if cached is not None:
+			return cached, True, fingerprint
+	with span('decode'):
+		result = await adecode_barcode(image_bytes)
+	if fingerprint is not None and not result.barcode:
+		frame_cache.remember(cache_key, fingerprint, result)
+	return result, False, fingerprint
+
+
+@csrf_exempt
+@require_POST
+@api_errors
+@aidempotent
+async def barcode_scan(request):
+	"""Async ``BarcodeScanView``: raw ``image/jpeg`` body, optional cart target in the query string."""
+	if not request.content_type.startswith(('image/', 'application/octet-stream')):
+		return JsonResponse({'detail': 'Expected a raw image/jpeg body'}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+	image_bytes = request.body
+	if not image_bytes:
+		return JsonResponse({'detail': 'Image body is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+	params = BarcodeScanQuerySerializer(data=request.GET)
+	params.is_valid(raise_exception=True)
+	session_id = params.validated_data.get('session_id')
+	trolley_id = params.validated_data.get('trolley_id')
+	if session_id or not trolley_id:
+		cache_key = _frame_cache_key(session_id)
+	else:
+		# Looks up the trolley's active session
+		cache_key = await _db(_frame_cache_key, trolley_id=trolley_id)
+	try:
+		result, duplicate, fingerprint = await _adecode_frame(image_bytes, cache_key)
+	except ImageDecodeError as e:
+		return JsonResponse({'detail': f'Error decoding barcode: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+	if result.barcode and cache_key and not duplicate and get_frame_cache().recently_added(cache_key, result.barcode):
+		_remember_scan(cache_key, fingerprint, result, added=False)
+		duplicate = True
+	payload = {
+		'found': result.barcode is not None,
+		'barcode': result.barcode,
+		'symbology': result.symbology,
+		'decode_ms': result.decode_ms,
+		'duplicate': duplicate,
+	}
+	if result.barcode and cache_key and not duplicate:
+		payload['cart'] = await _db(
+			_scan_into_cart,
+			result.barcode,
+			session_id=session_id,
+			trolley_id=trolley_id,
+			response_format=params.validated_data['response_format'],
+		)
+		_remember_scan(cache_key, fingerprint, result)
+	return JsonResponse(payload)
+
+
+def _cart(session_id, response_format):
+	session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
+	return _cart_payload(session, calculate_cart_total(session), response_format=response_format), session.cart_version
+
+
+@require_GET
+@api_errors
+async def cart_view(request):
+	"""Async ``CartView``, including the ``If-None-Match`` short cut."""
+	serializer = CartViewSerializer(data=request.GET)
+	serializer.is_valid(raise_exception=True)
+	query = serializer.validated_data
+	session_id = query['session_id']
+
+	if_none_match = request.headers.get('If-None-Match')
+	if if_none_match:
+		cart_version = await _db(get_cart_version, session_id, SESSION_TIMEOUT_SECONDS)
+		if cart_version is not None:
+			etag = _cart_etag(cart_version)
+			if etag in parse_etags(if_none_match) or if_none_match.strip() == '*':
+				response = HttpResponseNotModified()
+				response['ETag'] = etag
+				response['Cache-Control'] = 'no-cache'
+				return response
+
+	payload, cart_version = await _db(_cart, session_id, query['response_format'])
+	return JsonResponse(payload, headers={'ETag': _cart_etag(cart_version), 'Cache-Control': 'no-cache'})
+
+
+def _heartbeat(session_id):
+	refresh_activity(get_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+@csrf_exempt
+@require_POST
+@api_errors
+async def session_heartbeat(request):
+	"""Async ``SessionHeartbeatView``."""
+	serializer = SessionIdSerializer(data=_json_body(request))
+	serializer.is_valid(raise_exception=True)
+	await _db(_heartbeat, serializer.validated_data['session_id'])
+	return JsonResponse({'status': 'ok'})
@@ -0,0 +1,220 @@
+"""Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run against whatever database ``DATABASES`` points at, create their
+own ``BENCH-`` prefixed trolleys and products, and remove them afterwards.
+"""
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import CartItem, Payment, Product, Session, Trolley
+
+BENCH_PREFIX = 'BENCH-'
+# In-store EAN-13 range (prefix 20-29), so generated codes can't collide with real products
+BENCH_EAN_PREFIX = '2990'
+
+_EAN_L = ['0001101', '0011001', '0010011', '0111101', '0100011', '0110001', '0101111', '0111011', '0110111', '0001011']
+_EAN_R = [''.join('1' if bit == '0' else '0' for bit in code) for code in _EAN_L]
+_EAN_G = [code[::-1] for code in _EAN_R]
+_EAN_PARITY = ['LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG', 'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL']
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    """Thread-safe latency samples grouped by operation name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+        self._errors = defaultdict(int)
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._errors[name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._samples[name].append(elapsed)
+
+    def record(self, name: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self._samples[name].append(seconds)
+            if error:
+                self._errors[name] += 1
+
+    def stop(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def summary(self) -> dict:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            errors = dict(self._errors)
+        result = {}
+        for name, values in sorted(samples.items()):
+            result[name] = {
+                'count': len(values),
+                'errors': errors.get(name, 0),
+                'per_second': round(len(values) / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+            }
+        return result
+
+
+def run_threads(count: int, target, duration: float, *args) -> None:
+    """Run ``target(index, deadline, *args)`` on ``count`` threads until ``deadline``.
+
+    Each thread closes its own database connection when done.
+    """
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        try:
+            target(index, deadline, *args)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def create_bench_products(count: int) -> list:
+    Product.objects.bulk_create(
+        [
+            Product(
+                barcode=f'{BENCH_PREFIX}{index:06d}',
+                name=f'Bench product {index}',
+                price=Decimal('10.00') + index,
+                category='Bench',
+            )
+            for index in range(count)
+        ],
+        ignore_conflicts=True,
+    )
+    return list(Product.objects.filter(barcode__startswith=BENCH_PREFIX).order_by('barcode')[:count])
+
+
+def ean13_check_digit(digits: str) -> str:
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def ean13_modules(code: str) -> str:
+    """The 95 bar/space modules of an EAN-13 code, '1' for a bar."""
+    first, left, right = int(code[0]), code[1:7], code[7:]
+    left_codes = [
+        (_EAN_L if parity == 'L' else _EAN_G)[int(digit)]
+        for parity, digit in zip(_EAN_PARITY[first], left)
+    ]
+    return '101' + ''.join(left_codes) + '01010' + ''.join(_EAN_R[int(digit)] for digit in right) + '101'
+
+
+def render_ean13_jpeg(code: str, size=(320, 240), module_px: int = 2, rng=None) -> bytes:
+    """A camera-like JPEG of ``code``: dark bars on a light label, slightly noisy."""
+    import numpy as np
+    from PIL import Image
+
+    rng = rng or np.random.default_rng()
+    width, height = size
+    frame = np.full((height, width), 200, dtype=np.int16)
+    bars = np.repeat(np.array([int(bit) for bit in ean13_modules(code)], dtype=bool), module_px)
+    left = (width - bars.size) // 2 + int(rng.integers(-8, 9))
+    top = height // 4 + int(rng.integers(-8, 9))
+    label_left, label_right = max(0, left - 11 * module_px), min(width, left + bars.size + 11 * module_px)
+    frame[top:top + height // 2, label_left:label_right] = 235
+    frame[top:top + height // 2, left:left + bars.size][:, bars] = 30
+    frame += rng.normal(0, 6, frame.shape).astype(np.int16)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8), 'L').convert('RGB').save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def render_blank_jpeg(size=(320, 240), rng=None) -> bytes:
+    """A frame with no barcode in it, like the camera sees between items."""
+    import numpy as np
+    from PIL import Image
+
+    rng = rng or np.random.default_rng()
+    width, height = size
+    frame = rng.normal(120, 25, (height // 8, width // 8)).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(frame, 'L').resize(size).convert('RGB').save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def bench_ean13_barcodes(count: int) -> list:
+    """The EAN-13 codes ``create_bench_ean13_products`` uses, in order."""
+    barcodes = []
+    for index in range(count):
+        digits = f'{BENCH_EAN_PREFIX}{index:08d}'
+        barcodes.append(digits + ean13_check_digit(digits))
+    return barcodes
+
+
+def create_bench_ean13_products(count: int) -> list:
+    """Bench products whose barcodes are valid EAN-13 codes, for image scans."""
+    barcodes = bench_ean13_barcodes(count)
+    Product.objects.bulk_create(
+        [
+            Product(barcode=barcode, name=f'Bench EAN product {index}', price=Decimal('5.00') + index, category='Bench')
+            for index, barcode in enumerate(barcodes)
+        ],
+        ignore_conflicts=True,
+    )
+    return list(Product.objects.filter(barcode__in=barcodes).order_by('barcode'))
+
+
+def lock_wait_counters() -> dict:
+    """Server-side lock wait counters, where the database exposes them (MySQL/InnoDB)."""
+    if connection.vendor != 'mysql':
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+        rows = cursor.fetchall()
+    return {name: int(value) for name, value in rows}
+
+
+def cleanup_bench_data() -> None:
+    """Remove everything the benchmarks created, children first."""
+    sessions = Session.objects.filter(trolley__trolley_id__startswith=BENCH_PREFIX)
+    CartItem.objects.filter(session__in=sessions).delete()
+    Payment.objects.filter(session__in=sessions).delete()
+    sessions.delete()
+    Trolley.objects.filter(trolley_id__startswith=BENCH_PREFIX).delete()
+    bench_products = Product.objects.filter(
+        Q(barcode__startswith=BENCH_PREFIX) | Q(barcode__startswith=BENCH_EAN_PREFIX, category='Bench')
+    )
+    CartItem.objects.filter(product__in=bench_products).delete()
+    bench_products.delete()
+
+
+def write_report(path: str, report: dict) -> None:
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2, sort_keys=True, default=str)
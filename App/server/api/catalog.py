@@ -0,0 +1,224 @@
+"""In-process product catalog keyed by barcode.
+
+Scans and removes resolve products here instead of querying MySQL. With
+``CATALOG_CACHE_WARMUP = 'full'`` the whole catalog is loaded on first use;
+with ``'lazy'`` products are loaded one barcode at a time into a bounded LRU.
+Either way a barcode that isn't cached is looked up in the database, and one
+that isn't there either is remembered as unknown for
+``CATALOG_CACHE_NEGATIVE_TTL_SECONDS``. Server processes load the full catalog
+when they start (see ``warm_catalog``).
+
+Product saves and deletes bump a version number kept in Django's cache. Every
+process compares it with its own at most every
+``CATALOG_CACHE_VERSION_CHECK_SECONDS`` and drops its copy when it is behind, so
+``CACHES['default']`` must be a shared backend when running several workers.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+
+# Backends that keep their data inside one process
+_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_MISSING = object()
+
+
+class CatalogCache:
+    def __init__(self, warmup: str, max_size: int, version_check_interval: float, negative_ttl: float = 30.0):
+        if warmup not in ('full', 'lazy'):
+            raise ValueError(f"CATALOG_CACHE_WARMUP must be 'full' or 'lazy', not {warmup!r}")
+        self.warmup = warmup
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._products = OrderedDict()
+        self._unknown = OrderedDict()
+        self._fragments = {}
+        self._generation = 0
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+        self._counters = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+    def get(self, barcode: str, active_only: bool = True) -> Optional[Product]:
+        self._check_version()
+        now = time.monotonic()
+        with self._lock:
+            if self.warmup == 'full' and not self._loaded:
+                self._load_all()
+            product = self._products.get(barcode, _MISSING)
+            if product is not _MISSING:
+                self._counters['hits'] += 1
+                if self.warmup == 'lazy':
+                    self._products.move_to_end(barcode)
+            elif self._unknown.get(barcode, 0.0) > now:
+                # A stray scan of a shelf label doesn't hit the database every frame
+                product = None
+                self._counters['hits'] += 1
+            else:
+                self._counters['misses'] += 1
+            generation = self._generation
+
+        if product is _MISSING:
+            # Also in full mode: a product created since the load, whose
+            # invalidation this process hasn't picked up yet, is still found
+            product = Product.objects.filter(barcode=barcode).first()
+            with self._lock:
+                # Don't keep a row read before the catalog was dropped
+                if generation == self._generation:
+                    self._remember(barcode, product, now)
+
+        if product is None or (active_only and not product.is_active):
+            return None
+        return product
+
+    def _remember(self, barcode: str, product: Optional[Product], now: float) -> None:
+        if product is None:
+            self._unknown[barcode] = now + self.negative_ttl
+            self._unknown.move_to_end(barcode)
+            while len(self._unknown) > self.max_size:
+                self._unknown.popitem(last=False)
+            return
+        self._unknown.pop(barcode, None)
+        self._products[barcode] = product
+        if self.warmup == 'lazy':
+            while len(self._products) > self.max_size:
+                self._products.popitem(last=False)
+
+    def warm(self) -> None:
+        """Load the whole catalog now in full mode, so the first scan doesn't pay for it."""
+        self._check_version()
+        with self._lock:
+            if self.warmup == 'full' and not self._loaded:
+                self._load_all()
+
+    def fragment(self, barcode: str, render: Callable[[Product], dict]) -> Optional[dict]:
+        """``render(product)`` for ``barcode``, cached until the catalog is next dropped.
+
+        Inactive products are rendered too, since they can still sit in a cart.
+        The returned dict is shared; callers must not modify it.
+        """
+        self._check_version()
+        with self._lock:
+            fragment = self._fragments.get(barcode)
+            generation = self._generation
+        if fragment is not None:
+            return fragment
+        product = self.get(barcode, active_only=False)
+        if product is None:
+            return None
+        fragment = render(product)
+        with self._lock:
+            # Don't keep a fragment of a product that changed while rendering it
+            if generation == self._generation:
+                if len(self._fragments) >= self.max_size:
+                    self._fragments.clear()
+                self._fragments[barcode] = fragment
+        return fragment
+
+    def invalidate(self) -> None:
+        """Drop this process's copy and tell the other processes to drop theirs."""
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY)
+        with self._lock:
+            self._reset()
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check_interval:
+            return
+        version = cache.get(VERSION_KEY)
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                self._reset()
+                self._version = version
+
+    def _reset(self) -> None:
+        self._products.clear()
+        self._unknown.clear()
+        self._fragments.clear()
+        self._generation += 1
+        self._loaded = False
+
+    def _load_all(self) -> None:
+        self._products = OrderedDict((product.barcode, product) for product in Product.objects.all())
+        self._loaded = True
+        self._counters['reloads'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._products)
+            fragments = len(self._fragments)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'warmup': self.warmup,
+            'size': size,
+            'fragments': fragments,
+            'version': self._version,
+            'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            **counters,
+        }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> CatalogCache:
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = CatalogCache(
+                    warmup=settings.CATALOG_CACHE_WARMUP,
+                    max_size=settings.CATALOG_CACHE_MAX_SIZE,
+                    version_check_interval=settings.CATALOG_CACHE_VERSION_CHECK_SECONDS,
+                    negative_ttl=settings.CATALOG_CACHE_NEGATIVE_TTL_SECONDS,
+                )
+    return _catalog
+
+
+def warm_catalog() -> None:
+    """Load the catalog as a server process starts; a scan loads it later if this fails."""
+    try:
+        get_catalog().warm()
+    except DatabaseError:
+        logger.exception('Could not warm the product catalog')
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.DEBUG or settings.CACHES['default']['BACKEND'] not in _LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        checks.Warning(
+            'The product catalog is invalidated through the default cache, which is local to each process.',
+            hint='With several workers, point CACHE_BACKEND/CACHE_LOCATION at a shared cache such as Redis or '
+                 'Memcached, or other workers keep serving old products and prices.',
+            id='api.W001',
+        )
+    ]
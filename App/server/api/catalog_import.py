@@ -0,0 +1,216 @@
+"""Streaming product import from CSV or JSON Lines files.
+
+Rows are read lazily and written ``chunk_size`` at a time with one
+``bulk_create(update_conflicts=True)`` per chunk, so memory stays flat however
+large the file is. Each chunk is compared with the stored products first:
+unchanged rows are not written, and columns missing from the file (e.g. a
+daily price file with only ``barcode,price``) keep their stored values.
+
+``bulk_create`` sends no ``post_save`` signals, so the catalog cache is
+invalidated once at the end of an import rather than once per product.
+"""
+import csv
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .catalog import get_catalog
+from .models import Product
+
+FIELDS = ('name', 'price', 'category', 'is_active')
+MAX_ERRORS = 100
+
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f'}
+_CENT = Decimal('0.01')
+_MAX_PRICE = Decimal('99999999.99')
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    chunks: int = 0
+    duration_s: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return round(self.rows / self.duration_s, 1) if self.duration_s else 0.0
+
+    def as_dict(self) -> dict:
+        result = asdict(self)
+        result['duration_s'] = round(self.duration_s, 3)
+        result['rows_per_second'] = self.rows_per_second
+        return result
+
+
+def read_rows(path: str, file_format: str = None):
+    """Yield ``(line number, raw dict)`` from a CSV (with header) or JSON Lines file."""
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, encoding='utf-8-sig', newline='') as handle:
+        if file_format == 'csv':
+            reader = csv.DictReader(handle)
+            for raw in reader:
+                yield reader.line_num, raw
+        elif file_format == 'jsonl':
+            for line_number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    raw = json.loads(line)
+                except ValueError as exc:
+                    yield line_number, RowError(f'invalid JSON: {exc}')
+                    continue
+                yield line_number, raw
+        else:
+            raise ValueError(f"Unknown format {file_format!r}; use 'csv' or 'jsonl'")
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def parse_row(raw) -> dict:
+    """Normalise one row; only the columns present in it are returned besides ``barcode``."""
+    if isinstance(raw, RowError):
+        raise raw
+    if not isinstance(raw, dict):
+        raise RowError('expected an object')
+    barcode = _clean(raw.get('barcode'))
+    if not barcode:
+        raise RowError('barcode is required')
+    if len(barcode) > 64:
+        raise RowError('barcode is longer than 64 characters')
+    row = {'barcode': barcode}
+
+    name = _clean(raw.get('name'))
+    if name is not None:
+        if len(name) > 255:
+            raise RowError('name is longer than 255 characters')
+        row['name'] = name
+    category = _clean(raw.get('category'))
+    if category is not None:
+        if len(category) > 100:
+            raise RowError('category is longer than 100 characters')
+        row['category'] = category
+    price = _clean(raw.get('price'))
+    if price is not None:
+        try:
+            amount = Decimal(price)
+        except InvalidOperation:
+            raise RowError(f'price {price!r} is not a number') from None
+        if not amount.is_finite() or amount < 0 or amount > _MAX_PRICE or amount != amount.quantize(_CENT):
+            raise RowError(f'price {price!r} must be between 0 and {_MAX_PRICE} with at most 2 decimals')
+        row['price'] = amount.quantize(_CENT)
+    is_active = raw.get('is_active')
+    if isinstance(is_active, bool):
+        row['is_active'] = is_active
+    elif _clean(is_active) is not None:
+        flag = _clean(is_active).lower()
+        if flag not in _TRUE | _FALSE:
+            raise RowError(f'is_active {is_active!r} is not a boolean')
+        row['is_active'] = flag in _TRUE
+    return row
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _merge(row: dict, existing: dict = None) -> dict:
+    """The full product a row results in; ``None`` if a new product lacks a name or price."""
+    if existing is None:
+        if 'name' not in row or 'price' not in row:
+            return None
+        return {'category': '', 'is_active': True, **row}
+    return {**existing, **row}
+
+
+def import_products(
+    rows, chunk_size: int = 1000, dry_run: bool = False, on_change=None, create_only: bool = False,
+) -> ImportResult:
+    """Upsert ``rows`` of ``(line number, raw dict)`` into ``Product`` by barcode.
+
+    ``on_change(line, barcode, before, after)`` is called for every created
+    (``before`` is ``None``) or updated product, e.g. to print a dry-run diff.
+    With ``create_only`` products that already exist are counted as
+    ``skipped`` and left as they are.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    # MySQL upserts with ON DUPLICATE KEY UPDATE and rejects an explicit conflict target
+    unique_fields = ['barcode'] if connection.features.supports_update_conflicts_with_target else None
+
+    for chunk in _chunks(rows, chunk_size):
+        result.chunks += 1
+        parsed = {}
+        for line, raw in chunk:
+            result.rows += 1
+            try:
+                row = parse_row(raw)
+            except RowError as exc:
+                result.invalid += 1
+                if len(result.errors) < MAX_ERRORS:
+                    result.errors.append({'line': line, 'error': str(exc)})
+                continue
+            # A barcode repeated in the file: the last row wins
+            parsed[row['barcode']] = (line, row)
+
+        existing = {
+            values['barcode']: values
+            for values in Product.objects.filter(barcode__in=parsed).values('barcode', *FIELDS)
+        }
+        changed = []
+        for barcode, (line, row) in parsed.items():
+            before = existing.get(barcode)
+            if before is not None and create_only:
+                result.skipped += 1
+                continue
+            after = _merge(row, before)
+            if after is None:
+                result.invalid += 1
+                if len(result.errors) < MAX_ERRORS:
+                    result.errors.append({'line': line, 'error': 'new product needs name and price'})
+                continue
+            if after == before:
+                result.unchanged += 1
+                continue
+            if before is None:
+                result.created += 1
+            else:
+                result.updated += 1
+            if on_change is not None:
+                on_change(line, barcode, before, after)
+            changed.append(Product(**after))
+
+        if changed and not dry_run:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=unique_fields,
+                    update_fields=list(FIELDS),
+                )
+
+    if not dry_run and (result.created or result.updated):
+        get_catalog().invalidate()
+    result.duration_s = time.perf_counter() - started
+    return result
@@ -0,0 +1,282 @@
+"""Barcode decode engine.
+
+Decoding is CPU bound, so it runs in a process pool whose workers import PIL
+and pyzbar once at start-up. Request threads only hand over the raw image bytes
+and wait for the result, bounded by a deadline. When too many frames are already
+waiting the engine refuses new work instead of queueing it without limit.
+"""
+import asyncio
+import atexit
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .preprocessing import validate_ladder
+
+
+class DecoderUnavailable(APIException):
+    """Decoder cannot take the frame right now; the client should retry later.
+
+    DRF's exception handler turns ``wait`` into a ``Retry-After`` header.
+    """
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Barcode decoder is busy, retry later'
+    default_code = 'decoder_busy'
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        self.wait = wait
+
+
+class DecodeTimeout(DecoderUnavailable):
+    default_detail = 'Barcode decoding timed out, retry later'
+    default_code = 'decoder_timeout'
+
+
+class ImageDecodeError(Exception):
+    """The uploaded bytes could not be read as an image."""
+
+
+@dataclass(frozen=True)
+class DecodeResult:
+    barcode: Optional[str]
+    symbology: Optional[str]
+    decode_ms: float
+
+
+# Populated once per worker process by _init_worker().
+_Image = None
+_zbar_decode = None
+_preprocessing = None
+
+
+def _init_worker() -> None:
+    global _Image, _zbar_decode, _preprocessing
+    from PIL import Image
+    from pyzbar.pyzbar import decode
+
+    from . import preprocessing
+
+    Image.preinit()
+    _Image = Image
+    _zbar_decode = decode
+    _preprocessing = preprocessing
+
+
+def decode_image_bytes(data: bytes, ladder: tuple = ('gray',)) -> tuple:
+    """Decode the first barcode in ``data``. Runs inside a worker process.
+
+    Walks the preprocessing ``ladder`` until a rung yields a barcode. Returns
+    ``(barcode, symbology, decode_ms, steps)`` where ``steps`` lists the
+    ``(rung, ms)`` pairs that were tried; barcode and symbology are ``None``
+    when no rung found a readable code.
+    """
+    if _zbar_decode is None:
+        _init_worker()
+    start = time.perf_counter()
+    try:
+        img = _Image.open(BytesIO(data))
+        pixels = _preprocessing.to_grayscale(img)
+    except Exception as exc:
+        raise ImageDecodeError(str(exc)) from None
+
+    steps = []
+    decoded = None
+    for step in ladder:
+        step_start = time.perf_counter()
+        pixels = _preprocessing.STEPS[step](pixels)
+        decoded = _zbar_decode(pixels)
+        steps.append((step, (time.perf_counter() - step_start) * 1000))
+        if decoded:
+            break
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not decoded:
+        return None, None, elapsed_ms, steps
+    return decoded[0].data.decode('utf-8'), decoded[0].type, elapsed_ms, steps
+
+
+class DecodeEngine:
+    """Process pool front-end with a bounded number of outstanding frames."""
+
+    def __init__(self, workers: int, max_pending: int, timeout: float, retry_after: int, ladder=('gray',)):
+        self.ladder = validate_ladder(ladder)
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._latencies = deque(maxlen=1024)
+        self._counters = {'decoded': 0, 'empty': 0, 'errors': 0, 'rejected': 0, 'timeouts': 0}
+        self._steps = {step: {'attempts': 0, 'hits': 0, 'total_ms': 0.0} for step in self.ladder}
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise DecoderUnavailable(wait=self.retry_after)
+            self._pending += 1
+
+    def decode(self, data: bytes, timeout: Optional[float] = None) -> DecodeResult:
+        self._acquire()
+        start = time.perf_counter()
+        if self._executor is None:
+            try:
+                outcome = decode_image_bytes(data, self.ladder)
+            except Exception:
+                self._count('errors')
+                raise
+            finally:
+                self._release()
+        else:
+            future = self._executor.submit(decode_image_bytes, data, self.ladder)
+            # The slot is freed when the worker finishes, not when we stop waiting,
+            # so abandoned frames still count against the queue.
+            future.add_done_callback(lambda _future: self._release())
+            try:
+                outcome = future.result(timeout=self.timeout if timeout is None else timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                self._count('timeouts')
+                raise DecodeTimeout(wait=self.retry_after) from None
+            except Exception:
+                self._count('errors')
+                raise
+        return self._result(outcome, start)
+
+    async def adecode(self, data: bytes, timeout: Optional[float] = None) -> DecodeResult:
+        """``decode`` for async views: waits for the worker without blocking the event loop.
+
+        Without a process pool the frame is decoded in the loop's default thread pool.
+        """
+        self._acquire()
+        start = time.perf_counter()
+        if self._executor is None:
+            future = asyncio.get_running_loop().run_in_executor(None, self._decode_in_thread, data)
+        else:
+            submitted = self._executor.submit(decode_image_bytes, data, self.ladder)
+            # As in decode(), the slot is held until the worker is done with the frame
+            submitted.add_done_callback(lambda _future: self._release())
+            future = asyncio.wrap_future(submitted)
+        try:
+            outcome = await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._count('timeouts')
+            raise DecodeTimeout(wait=self.retry_after) from None
+        except Exception:
+            self._count('errors')
+            raise
+        return self._result(outcome, start)
+
+    def _decode_in_thread(self, data: bytes) -> tuple:
+        try:
+            return decode_image_bytes(data, self.ladder)
+        finally:
+            self._release()
+
+    def _result(self, outcome: tuple, start: float) -> DecodeResult:
+        barcode, symbology, decode_ms, steps = outcome
+        with self._lock:
+            self._counters['decoded' if barcode else 'empty'] += 1
+            for step, step_ms in steps:
+                self._steps[step]['attempts'] += 1
+                self._steps[step]['total_ms'] += step_ms
+            if barcode:
+                self._steps[steps[-1][0]]['hits'] += 1
+            self._latencies.append((time.perf_counter() - start) * 1000)
+        return DecodeResult(barcode=barcode, symbology=symbology, decode_ms=round(decode_ms, 2))
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            pending = self._pending
+            counters = dict(self._counters)
+            steps = {
+                step: {
+                    'attempts': row['attempts'],
+                    'hits': row['hits'],
+                    'hit_rate': round(row['hits'] / row['attempts'], 4) if row['attempts'] else 0.0,
+                    'avg_ms': round(row['total_ms'] / row['attempts'], 2) if row['attempts'] else 0.0,
+                }
+                for step, row in self._steps.items()
+            }
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': pending,
+            'queue_depth': max(0, pending - max(self.workers, 1)),
+            'latency_ms': {
+                'p50': _percentile(latencies, 50),
+                'p95': _percentile(latencies, 95),
+                'p99': _percentile(latencies, 99),
+                'max': round(latencies[-1], 2) if latencies else 0.0,
+            },
+            'preprocessing': steps,
+            **counters,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_decode_engine() -> DecodeEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DecodeEngine(
+                    workers=settings.BARCODE_DECODER_WORKERS,
+                    max_pending=settings.BARCODE_DECODER_MAX_PENDING,
+                    timeout=settings.BARCODE_DECODER_TIMEOUT_SECONDS,
+                    retry_after=settings.BARCODE_DECODER_RETRY_AFTER_SECONDS,
+                    ladder=settings.BARCODE_PREPROCESS_LADDER,
+                )
+                atexit.register(_engine.shutdown)
+    return _engine
+
+
+def decode_barcode(data: bytes) -> DecodeResult:
+    return get_decode_engine().decode(data)
+
+
+async def adecode_barcode(data: bytes) -> DecodeResult:
+    return await get_decode_engine().adecode(data)
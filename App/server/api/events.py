@@ -0,0 +1,130 @@
+"""Cart change events pushed to phones over Server-Sent Events.
+
+Views publish after their transaction commits; ``/api/cart/events`` subscribers
+receive them on the ASGI event loop. Every cart event carries the session's
+``cart_version`` as its SSE id, so a reconnecting client sends ``Last-Event-ID``
+and gets a fresh snapshot if it missed anything.
+
+``InMemoryBroker`` only reaches subscribers in the same process. To fan out
+across processes, implement ``CartEventBroker`` on top of a shared pub/sub (a
+Redis channel per session, for instance) and point ``CART_EVENT_BROKER`` at it.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+@dataclass(frozen=True)
+class CartEvent:
+    type: str
+    data: dict
+    version: Optional[int] = None
+
+    def encode(self) -> str:
+        lines = []
+        if self.version is not None:
+            lines.append(f'id: {self.version}')
+        lines.append(f'event: {self.type}')
+        lines.append(f'data: {json.dumps(self.data, separators=(",", ":"))}')
+        return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """Events for one session, consumed by one streaming response."""
+
+    def __init__(self, broker: 'CartEventBroker', session_id: str):
+        self.broker = broker
+        self.session_id = session_id
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def deliver(self, event: CartEvent) -> None:
+        # publish() runs on a request thread; hand the event to the subscriber's loop.
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # Loop already closed; the stream is gone and will unsubscribe itself.
+            pass
+
+    async def get(self) -> CartEvent:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class CartEventBroker:
+    def publish(self, session_id: str, event: CartEvent) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, session_id: str) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryBroker(CartEventBroker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._published = 0
+
+    def publish(self, session_id: str, event: CartEvent) -> None:
+        with self._lock:
+            self._published += 1
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, session_id: str) -> Subscription:
+        subscription = Subscription(self, session_id)
+        with self._lock:
+            self._subscribers[session_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.session_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sessions': len(self._subscribers),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'published': self._published,
+            }
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> CartEventBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.CART_EVENT_BROKER)()
+    return _broker
+
+
+def publish_on_commit(session_id, event_type: str, data: dict, version: Optional[int] = None) -> None:
+    """Publish once the surrounding transaction commits (immediately outside one)."""
+    event = CartEvent(event_type, data, version)
+    transaction.on_commit(lambda: get_broker().publish(str(session_id), event))
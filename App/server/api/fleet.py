@@ -0,0 +1,263 @@
+"""In-process registry of trolley state, sharded by trolley_id.
+
+Every worker keeps the whole fleet (``is_active``, ``is_assigned``,
+``last_seen``) in memory, split over ``FLEET_SHARDS`` dicts with a lock each,
+so "is this trolley free?" and the fleet-status endpoint need no query.
+
+Writes go through the registry: ``assign`` and ``release`` update the database
+and then, once the transaction commits, the in-memory state. ``seen`` records
+activity in memory only; the activity tracker writes ``last_seen`` to the
+database in batches.
+
+Other workers' changes are picked up every ``FLEET_REFRESH_SECONDS`` by
+re-reading the trolleys whose ``last_seen`` moved since the previous refresh
+(assigning and releasing always move it). Edits that don't, such as
+deactivating a trolley in the admin, bump a version number in Django's cache
+and make every worker reload the fleet, as with the product catalog. The
+database stays authoritative: session start still claims the trolley with a
+conditional UPDATE and only uses the registry to skip work.
+"""
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Trolley
+
+VERSION_KEY = 'fleet:version'
+
+STATES = ('in_use', 'free', 'stale', 'inactive')
+
+
+class TrolleyState(NamedTuple):
+    pk: int
+    trolley_id: str
+    is_active: bool
+    is_assigned: bool
+    last_seen: Optional[datetime]
+
+
+_FIELDS = ('pk', 'trolley_id', 'is_active', 'is_assigned', 'last_seen')
+
+
+class FleetRegistry:
+    def __init__(self, shards: int, stale_after: float, refresh_interval: float):
+        self.shard_count = max(1, shards)
+        self.stale_after = stale_after
+        self.refresh_interval = refresh_interval
+        self._shards = [({}, threading.Lock()) for _ in range(self.shard_count)]
+        # pk -> trolley_id, for writes that only know the foreign key
+        self._ids = {}
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._version = None
+        self._refreshed_at = 0.0
+        # Rows with last_seen at or after this are re-read by the next refresh
+        self._watermark = None
+        self._counters = {'reloads': 0, 'refreshes': 0, 'refreshed_rows': 0}
+
+    def _shard_index(self, trolley_id: str) -> int:
+        return zlib.crc32(trolley_id.encode()) % self.shard_count
+
+    def _shard(self, trolley_id: str):
+        return self._shards[self._shard_index(trolley_id)]
+
+    def _put(self, state: TrolleyState) -> None:
+        states, lock = self._shard(state.trolley_id)
+        with lock:
+            states[state.trolley_id] = state
+        self._ids[state.pk] = state.trolley_id
+
+    def _update(self, pk: int, **changes) -> None:
+        trolley_id = self._ids.get(pk)
+        if trolley_id is None:
+            # Created by another worker; the next refresh brings it in
+            return
+        states, lock = self._shard(trolley_id)
+        with lock:
+            current = states.get(trolley_id)
+            if current is None:
+                return
+            if 'last_seen' in changes and current.last_seen and changes['last_seen'] < current.last_seen:
+                changes['last_seen'] = current.last_seen
+            states[trolley_id] = current._replace(**changes)
+
+    def _sync(self) -> None:
+        """Load the fleet on first use, reload it after an invalidation, pick up other workers' writes."""
+        now = time.monotonic()
+        if self._loaded and now - self._refreshed_at < self.refresh_interval:
+            return
+        with self._load_lock:
+            if self._loaded and now - self._refreshed_at < self.refresh_interval:
+                return
+            version = cache.get(VERSION_KEY)
+            # Activity is written up to a flush interval late, with floored timestamps
+            lag = timedelta(seconds=settings.ACTIVITY_FLUSH_INTERVAL_SECONDS + settings.ACTIVITY_WRITE_GRANULARITY_SECONDS + 1)
+            started = timezone.now()
+            if not self._loaded or version != self._version:
+                # Build the new fleet aside so lookups never see it half loaded
+                fresh = [{} for _ in self._shards]
+                ids = {}
+                for row in Trolley.objects.values_list(*_FIELDS):
+                    state = TrolleyState(*row)
+                    fresh[self._shard_index(state.trolley_id)][state.trolley_id] = state
+                    ids[state.pk] = state.trolley_id
+                for (states, lock), loaded in zip(self._shards, fresh):
+                    with lock:
+                        states.clear()
+                        states.update(loaded)
+                self._ids = ids
+                self._counters['reloads'] += 1
+            else:
+                rows = Trolley.objects.filter(last_seen__gte=self._watermark).values_list(*_FIELDS)
+                count = 0
+                for row in rows:
+                    self._put(TrolleyState(*row))
+                    count += 1
+                self._counters['refreshes'] += 1
+                self._counters['refreshed_rows'] += count
+            self._version = version
+            self._watermark = started - lag
+            self._refreshed_at = now
+            self._loaded = True
+
+    def get(self, trolley_id: str) -> Optional[TrolleyState]:
+        self._sync()
+        states, lock = self._shard(trolley_id)
+        with lock:
+            return states.get(trolley_id)
+
+    def is_free(self, trolley_id: str) -> Optional[bool]:
+        """Whether the trolley can start a session; ``None`` when it is unknown."""
+        state = self.get(trolley_id)
+        if state is None:
+            return None
+        return state.is_active and not state.is_assigned
+
+    def ensure(self, trolley_id: str) -> TrolleyState:
+        """The trolley's state, registering the trolley first if it is new."""
+        state = self.get(trolley_id)
+        if state is not None:
+            return state
+        trolley, _ = Trolley.objects.get_or_create(trolley_id=trolley_id, defaults={'last_seen': timezone.now()})
+        state = TrolleyState(trolley.pk, trolley.trolley_id, trolley.is_active, trolley.is_assigned, trolley.last_seen)
+        self._put(state)
+        return state
+
+    def record(self, trolley: Trolley) -> None:
+        """Replace the in-memory state with ``trolley`` as just read from the database."""
+        self._put(TrolleyState(trolley.pk, trolley.trolley_id, trolley.is_active, trolley.is_assigned, trolley.last_seen))
+
+    def forget(self, trolley_id: str) -> None:
+        states, lock = self._shard(trolley_id)
+        with lock:
+            state = states.pop(trolley_id, None)
+        if state is not None:
+            self._ids.pop(state.pk, None)
+
+    def assign(self, trolley_pk: int, at: datetime) -> None:
+        Trolley.objects.filter(pk=trolley_pk).update(is_assigned=True, last_seen=at)
+        transaction.on_commit(lambda: self._update(trolley_pk, is_assigned=True, last_seen=at))
+
+    def claim(self, trolley_pk: int, at: datetime) -> bool:
+        """Assign the trolley only if it is active and free, in one conditional UPDATE.
+
+        The UPDATE locks the row until the transaction ends, so of two claims
+        on the same trolley exactly one succeeds.
+        """
+        claimed = Trolley.objects.filter(pk=trolley_pk, is_active=True, is_assigned=False).update(
+            is_assigned=True, last_seen=at,
+        )
+        if claimed:
+            transaction.on_commit(lambda: self._update(trolley_pk, is_assigned=True, last_seen=at))
+        return bool(claimed)
+
+    def release(self, trolley_pks, at: datetime) -> int:
+        trolley_pks = list(trolley_pks)
+        released = Trolley.objects.filter(pk__in=trolley_pks).update(is_assigned=False, last_seen=at)
+
+        def apply():
+            for pk in trolley_pks:
+                self._update(pk, is_assigned=False, last_seen=at)
+
+        transaction.on_commit(apply)
+        return released
+
+    def seen(self, trolley_pk: int, at: datetime) -> None:
+        self._update(trolley_pk, last_seen=at)
+
+    def invalidate(self) -> None:
+        """Make every worker reload the fleet, e.g. after an admin edit."""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+        with self._load_lock:
+            self._loaded = False
+
+    def _classify(self, state: TrolleyState, stale_before: datetime) -> str:
+        if not state.is_active:
+            return 'inactive'
+        if not state.is_assigned:
+            return 'free'
+        if state.last_seen is None or state.last_seen < stale_before:
+            return 'stale'
+        return 'in_use'
+
+    def _snapshot(self) -> list:
+        self._sync()
+        snapshot = []
+        for states, lock in self._shards:
+            with lock:
+                snapshot.extend(states.values())
+        return snapshot
+
+    def status(self) -> dict:
+        """Counts per state; ``stale`` trolleys are in use but not seen for ``stale_after`` seconds."""
+        stale_before = timezone.now() - timedelta(seconds=self.stale_after)
+        counts = dict.fromkeys(STATES, 0)
+        snapshot = self._snapshot()
+        for state in snapshot:
+            counts[self._classify(state, stale_before)] += 1
+        return {'total': len(snapshot), **counts, 'stale_after_seconds': self.stale_after}
+
+    def trolleys(self, state: str) -> list:
+        """Trolleys in ``state`` (one of ``STATES``), ordered by trolley_id."""
+        stale_before = timezone.now() - timedelta(seconds=self.stale_after)
+        return sorted(
+            (trolley for trolley in self._snapshot() if self._classify(trolley, stale_before) == state),
+            key=lambda trolley: trolley.trolley_id,
+        )
+
+    def stats(self) -> dict:
+        sizes = [len(states) for states, _ in self._shards]
+        return {
+            'size': sum(sizes),
+            'shards': self.shard_count,
+            'largest_shard': max(sizes),
+            'version': self._version,
+            **self._counters,
+        }
+
+
+_fleet = None
+_fleet_lock = threading.Lock()
+
+
+def get_fleet() -> FleetRegistry:
+    global _fleet
+    if _fleet is None:
+        with _fleet_lock:
+            if _fleet is None:
+                _fleet = FleetRegistry(
+                    shards=settings.FLEET_SHARDS,
+                    stale_after=settings.FLEET_STALE_SECONDS,
+                    refresh_interval=settings.FLEET_REFRESH_SECONDS,
+                )
+    return _fleet
@@ -0,0 +1,141 @@
+"""Per-session cache of recently decoded camera frames.
+
+The ESP32-CAM posts a frame every few seconds whether or not anything moved, so
+most frames are near-identical to one the server has already decoded. Frames are
+fingerprinted with a 64-bit difference hash (dHash); a frame within
+``FRAME_CACHE_MAX_DISTANCE`` bits of a recent one reuses that decode result.
+A frame showing a barcode is only remembered once its item is in the cart, so
+a scan whose add failed is decoded and added again when the trolley retries.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+
+from django.conf import settings
+from PIL import Image
+
+from .decoding import DecodeResult
+
+
+def dhash(data: bytes) -> Optional[int]:
+    """64-bit difference hash of an encoded image, or ``None`` if it can't be read."""
+    try:
+        img = Image.open(BytesIO(data))
+        # JPEG can scale down by 1/8 while decoding, which makes this far cheaper
+        # than a full decode.
+        img.draft('L', (72, 64))
+        small = img.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    except Exception:
+        return None
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+@dataclass
+class _Frame:
+    fingerprint: int
+    seen_at: float
+    result: DecodeResult
+
+
+class FrameCache:
+    def __init__(self, max_trolleys: int, frames_per_trolley: int, ttl: float, max_distance: int, debounce: float):
+        self.max_trolleys = max_trolleys
+        self.frames_per_trolley = frames_per_trolley
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()
+        self._last_added = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0, 'debounced': 0, 'saved_decode_ms': 0.0}
+
+    def lookup(self, key: str, fingerprint: int) -> Optional[DecodeResult]:
+        now = time.monotonic()
+        with self._lock:
+            frames = self._frames.get(key)
+            if frames is not None:
+                self._frames.move_to_end(key)
+                while frames and now - frames[0].seen_at > self.ttl:
+                    frames.popleft()
+                for frame in frames:
+                    if bin(frame.fingerprint ^ fingerprint).count('1') <= self.max_distance:
+                        # A frame still in view stays cached, so an item left in
+                        # front of the camera isn't added again when the TTL runs out
+                        frame.seen_at = now
+                        frames.remove(frame)
+                        frames.append(frame)
+                        self._counters['hits'] += 1
+                        self._counters['saved_decode_ms'] += frame.result.decode_ms
+                        return frame.result
+            self._counters['misses'] += 1
+        return None
+
+    def remember(self, key: str, fingerprint: int, result: DecodeResult) -> None:
+        with self._lock:
+            frames = self._frames.get(key)
+            if frames is None:
+                frames = self._frames[key] = deque(maxlen=self.frames_per_trolley)
+            self._frames.move_to_end(key)
+            frames.append(_Frame(fingerprint, time.monotonic(), result))
+            while len(self._frames) > self.max_trolleys:
+                self._frames.popitem(last=False)
+
+    def recently_added(self, key: str, barcode: str) -> bool:
+        """Whether ``barcode`` was added to this cart within the debounce window."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_added.get(key)
+            if last and last[0] == barcode and now - last[1] < self.debounce:
+                self._counters['debounced'] += 1
+                return True
+        return False
+
+    def record_add(self, key: str, barcode: str) -> None:
+        """Start the debounce window for ``barcode``; call once the cart add succeeded."""
+        with self._lock:
+            self._last_added[key] = (barcode, time.monotonic())
+            self._last_added.move_to_end(key)
+            while len(self._last_added) > self.max_trolleys:
+                self._last_added.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            trolleys = len(self._frames)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'trolleys': trolleys,
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            'saved_decode_ms': round(counters['saved_decode_ms'], 2),
+            'debounced': counters['debounced'],
+        }
+
+
+_frame_cache = None
+_frame_cache_lock = threading.Lock()
+
+
+def get_frame_cache() -> FrameCache:
+    global _frame_cache
+    if _frame_cache is None:
+        with _frame_cache_lock:
+            if _frame_cache is None:
+                _frame_cache = FrameCache(
+                    max_trolleys=settings.FRAME_CACHE_MAX_TROLLEYS,
+                    frames_per_trolley=settings.FRAME_CACHE_FRAMES_PER_TROLLEY,
+                    ttl=settings.FRAME_CACHE_TTL_SECONDS,
+                    max_distance=settings.FRAME_CACHE_MAX_DISTANCE,
+                    debounce=settings.SCAN_DEBOUNCE_SECONDS,
+                )
+    return _frame_cache
@@ -0,0 +1,253 @@
+"""Replay of POST responses for requests retried with the same ``Idempotency-Key``.
+
+The first request with a key runs normally and its successful response is
+stored in the ``idempotency`` cache for ``IDEMPOTENCY_TTL_SECONDS``; retries
+get the stored response back, marked with ``Idempotent-Replayed: true``,
+without touching the database. A retry that arrives while the first request
+is still running waits for it, up to ``IDEMPOTENCY_LOCK_TIMEOUT_SECONDS``.
+
+The cache backend bounds the store (``MAX_ENTRIES``) and expires entries.
+Point ``IDEMPOTENCY_CACHE_BACKEND``/``IDEMPOTENCY_CACHE_LOCATION`` at a shared
+cache when running several workers, so a retry that lands on another worker
+is still recognised.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.http.request import RawPostDataException
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed.'
+    default_code = 'idempotency_in_progress'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyStore:
+    def __init__(self, cache_alias: str, ttl: float, lock_timeout: float, poll_interval: float = 0.05):
+        self.cache = caches[cache_alias]
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._counters = {'executed': 0, 'replayed': 0, 'waited': 0, 'in_progress': 0, 'mismatched': 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str):
+        return self.cache.get(f'idem:{key}')
+
+    def save(self, key: str, snapshot: dict) -> None:
+        self.cache.set(f'idem:{key}', snapshot, timeout=self.ttl)
+
+    def acquire(self, key: str) -> bool:
+        return self.cache.add(f'idem:{key}:lock', 1, timeout=self.lock_timeout)
+
+    def release(self, key: str) -> None:
+        self.cache.delete(f'idem:{key}:lock')
+
+    def wait(self, key: str):
+        """Wait for the request holding ``key`` to store its response or give up."""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            snapshot = self.get(key)
+            if snapshot is not None:
+                return snapshot
+            if self.acquire(key):
+                # The first request failed without storing anything; run this one.
+                return None
+        self.count('in_progress')
+        raise IdempotencyInProgress()
+
+    async def aget(self, key: str):
+        return await self.cache.aget(f'idem:{key}')
+
+    async def asave(self, key: str, snapshot: dict) -> None:
+        await self.cache.aset(f'idem:{key}', snapshot, timeout=self.ttl)
+
+    async def aacquire(self, key: str) -> bool:
+        return await self.cache.aadd(f'idem:{key}:lock', 1, timeout=self.lock_timeout)
+
+    async def arelease(self, key: str) -> None:
+        await self.cache.adelete(f'idem:{key}:lock')
+
+    async def wait_async(self, key: str):
+        """``wait`` for async views, sleeping on the event loop."""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            snapshot = await self.aget(key)
+            if snapshot is not None:
+                return snapshot
+            if await self.aacquire(key):
+                return None
+        self.count('in_progress')
+        raise IdempotencyInProgress()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'ttl_seconds': self.ttl, **self._counters}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = IdempotencyStore(
+                    cache_alias='idempotency',
+                    ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+                    lock_timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT_SECONDS,
+                )
+    return _store
+
+
+def _fingerprint(request) -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # Form data was parsed already (e.g. for a CSRF check); hash what it parsed to.
+        digest.update(repr(sorted(request.POST.lists())).encode())
+        digest.update(repr(sorted((name, upload.size) for name, upload in request.FILES.items())).encode())
+    return digest.hexdigest()
+
+
+def _check_replay(store: IdempotencyStore, snapshot: dict, fingerprint: str) -> None:
+    if snapshot['fingerprint'] != fingerprint:
+        store.count('mismatched')
+        raise IdempotencyKeyReused()
+    store.count('replayed')
+
+
+def _replay(store: IdempotencyStore, snapshot: dict, fingerprint: str) -> Response:
+    _check_replay(store, snapshot, fingerprint)
+    return Response(snapshot['data'], status=snapshot['status'], headers={REPLAYED_HEADER: 'true'})
+
+
+def _areplay(store: IdempotencyStore, snapshot: dict, fingerprint: str) -> JsonResponse:
+    _check_replay(store, snapshot, fingerprint)
+    return JsonResponse(snapshot['data'], status=snapshot['status'], headers={REPLAYED_HEADER: 'true'})
+
+
+def _scoped_key(request, key: str) -> str:
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValidationError({IDEMPOTENCY_HEADER: f'Must be at most {MAX_KEY_LENGTH} characters.'})
+    return f'{request.path}:{key}'
+
+
+def idempotent(handler):
+    """Make an ``APIView`` handler replay its response for a repeated ``Idempotency-Key``.
+
+    Requests without the header run as before. Only 2xx responses are stored,
+    so a retry after an error runs the request again.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+
+        store = get_idempotency_store()
+        scoped_key = _scoped_key(request, key)
+        # Read the raw body before the view parses it, while it is still available.
+        fingerprint = _fingerprint(request._request)
+        snapshot = store.get(scoped_key)
+        if snapshot is not None:
+            return _replay(store, snapshot, fingerprint)
+
+        if not store.acquire(scoped_key):
+            store.count('waited')
+            snapshot = store.wait(scoped_key)
+            if snapshot is not None:
+                return _replay(store, snapshot, fingerprint)
+        try:
+            # The holder we waited for may have finished between get() and acquire().
+            snapshot = store.get(scoped_key)
+            if snapshot is not None:
+                return _replay(store, snapshot, fingerprint)
+            store.count('executed')
+            response = handler(self, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                store.save(scoped_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                })
+            return response
+        finally:
+            store.release(scoped_key)
+
+    return wrapper
+
+
+def aidempotent(view):
+    """``idempotent`` for plain async views that return a ``JsonResponse``.
+
+    Shares the store and the stored responses with ``idempotent``, so the sync
+    and async variants of an endpoint recognise each other's retries.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await view(request, *args, **kwargs)
+
+        store = get_idempotency_store()
+        scoped_key = _scoped_key(request, key)
+        fingerprint = _fingerprint(request)
+        snapshot = await store.aget(scoped_key)
+        if snapshot is not None:
+            return _areplay(store, snapshot, fingerprint)
+
+        if not await store.aacquire(scoped_key):
+            store.count('waited')
+            snapshot = await store.wait_async(scoped_key)
+            if snapshot is not None:
+                return _areplay(store, snapshot, fingerprint)
+        try:
+            snapshot = await store.aget(scoped_key)
+            if snapshot is not None:
+                return _areplay(store, snapshot, fingerprint)
+            store.count('executed')
+            response = await view(request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                await store.asave(scoped_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': json.loads(response.content),
+                })
+            return response
+        finally:
+            await store.arelease(scoped_key)
+
+    return wrapper
@@ -0,0 +1,243 @@
+"""Per-request timing: wall time per endpoint, SQL and named spans.
+
+``InstrumentationMiddleware`` counts every request and its wall time per URL
+name. A share of requests (``INSTRUMENTATION_SAMPLE_RATE``) is also traced in
+detail: SQL statements are counted and timed through
+``connection.execute_wrapper``, and code wrapped in ``span('name')`` adds a
+named sub-timing. Traced responses carry a ``Server-Timing`` header; everything
+is aggregated for ``/api/metrics``.
+
+``span()`` outside a traced request returns a shared no-op context manager,
+so instrumented code costs about a context-variable lookup when sampling is off.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+# Upper bounds, in seconds, of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_trace = ContextVar('request_trace', default=None)
+
+
+class RequestTrace:
+    __slots__ = ('spans', 'queries', 'query_seconds')
+
+    def __init__(self):
+        # name -> [seconds, count]
+        self.spans = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    """Time the enclosed block as ``name`` when the current request is traced."""
+    trace = _trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class Metrics:
+    """Process-wide aggregates behind ``/api/metrics``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)             # (endpoint, method, status) -> count
+        self.duration_sum = defaultdict(float)       # endpoint -> seconds
+        self.duration_buckets = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self.traced = defaultdict(int)               # endpoint -> traced requests
+        self.query_count = defaultdict(int)          # endpoint -> statements in traced requests
+        self.query_seconds = defaultdict(float)
+        self.span_seconds = defaultdict(float)       # (endpoint, span) -> seconds
+        self.span_count = defaultdict(int)
+
+    def observe(self, endpoint: str, method: str, status: int, seconds: float, trace: RequestTrace = None) -> None:
+        bucket = next((index for index, bound in enumerate(DURATION_BUCKETS) if seconds <= bound), len(DURATION_BUCKETS))
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.duration_sum[endpoint] += seconds
+            self.duration_buckets[endpoint][bucket] += 1
+            if trace is not None:
+                self.traced[endpoint] += 1
+                self.query_count[endpoint] += trace.queries
+                self.query_seconds[endpoint] += trace.query_seconds
+                for name, (span_seconds, count) in trace.spans.items():
+                    self.span_seconds[(endpoint, name)] += span_seconds
+                    self.span_count[(endpoint, name)] += count
+
+    def render(self, gauges: dict = None) -> str:
+        """Prometheus text exposition of the aggregates plus ``gauges``."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('smarttrolley_requests_total', 'counter', 'Requests by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'smarttrolley_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            family('smarttrolley_request_duration_seconds', 'histogram', 'Wall time per endpoint.')
+            for endpoint, buckets in sorted(self.duration_buckets.items()):
+                cumulative = 0
+                for bound, count in zip((*DURATION_BUCKETS, '+Inf'), buckets):
+                    cumulative += count
+                    lines.append(f'smarttrolley_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'smarttrolley_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self.duration_sum[endpoint]:.6f}')
+                lines.append(f'smarttrolley_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+            family('smarttrolley_traced_requests_total', 'counter', 'Requests sampled for query and span timing.')
+            for endpoint, count in sorted(self.traced.items()):
+                lines.append(f'smarttrolley_traced_requests_total{{endpoint="{endpoint}"}} {count}')
+            family('smarttrolley_db_queries_total', 'counter', 'SQL statements run by traced requests.')
+            for endpoint, count in sorted(self.query_count.items()):
+                lines.append(f'smarttrolley_db_queries_total{{endpoint="{endpoint}"}} {count}')
+            family('smarttrolley_db_query_seconds_total', 'counter', 'Time spent in SQL by traced requests.')
+            for endpoint, seconds in sorted(self.query_seconds.items()):
+                lines.append(f'smarttrolley_db_query_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+            family('smarttrolley_span_seconds_total', 'counter', 'Time in named spans of traced requests.')
+            for (endpoint, name), seconds in sorted(self.span_seconds.items()):
+                lines.append(f'smarttrolley_span_seconds_total{{endpoint="{endpoint}",span="{name}"}} {seconds:.6f}')
+            family('smarttrolley_span_total', 'counter', 'Entries into named spans of traced requests.')
+            for (endpoint, name), count in sorted(self.span_count.items()):
+                lines.append(f'smarttrolley_span_total{{endpoint="{endpoint}",span="{name}"}} {count}')
+
+        for name, value in sorted((gauges or {}).items()):
+            family(name, 'gauge', 'Runtime value from /api/stats.')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def flatten_stats(stats: dict, prefix: str = 'smarttrolley') -> dict:
+    """Numeric leaves of a nested stats dict as ``prefix_key_subkey`` gauges."""
+    flat = {}
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'.replace('-', '_').replace('.', '_')
+        if isinstance(value, dict):
+            flat.update(flatten_stats(value, name))
+        elif isinstance(value, bool):
+            flat[name] = int(value)
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def _server_timing(trace: RequestTrace, total: float) -> str:
+    parts = [f'app;dur={total * 1000:.2f}']
+    if trace.queries:
+        parts.append(f'db;dur={trace.query_seconds * 1000:.2f};desc="{trace.queries} queries"')
+    for name, (seconds, _) in trace.spans.items():
+        parts.append(f'{name};dur={seconds * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _endpoint(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match else 'unmatched'
+
+
+class InstrumentationMiddleware:
+    """Times every request; traces a sample of them (see module docstring)."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self) -> bool:
+        return self.sample_rate > 0 and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def _finish(self, request, response, start, trace):
+        total = time.perf_counter() - start
+        metrics.observe(_endpoint(request), request.method, response.status_code, total, trace)
+        if trace is not None:
+            response['Server-Timing'] = _server_timing(trace, total)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        if not self._sampled():
+            return self._finish(request, self.get_response(request), start, None)
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        try:
+            with connection.execute_wrapper(trace.record_query):
+                response = self.get_response(request)
+        finally:
+            _trace.reset(token)
+        return self._finish(request, response, start, trace)
+
+    async def __acall__(self, request):
+        # Async views query from worker threads with their own connections, so
+        # only spans are traced here.
+        start = time.perf_counter()
+        if not self._sampled():
+            return self._finish(request, await self.get_response(request), start, None)
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _trace.reset(token)
+        return self._finish(request, response, start, trace)
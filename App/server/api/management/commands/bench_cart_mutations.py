@@ -0,0 +1,131 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.benchmarking import (
+    BENCH_PREFIX,
+    LatencyRecorder,
+    cleanup_bench_data,
+    create_bench_products,
+    run_threads,
+    write_report,
+)
+from api.catalog import get_catalog
+from api.models import CartItem, Session, Trolley
+from api.utils import add_to_cart, get_locked_session, get_session, recalculate_cart_total, remove_from_cart
+from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
+
+
+def _legacy_change(session, product, step):
+    # The cart path before single-statement updates: lock, read, modify in Python, save.
+    cart_item = CartItem.objects.select_for_update().filter(session=session, product=product).first()
+    previous_subtotal = cart_item.subtotal if cart_item else Decimal('0.00')
+    if cart_item is None:
+        if step < 0:
+            return
+        cart_item = CartItem.objects.create(session=session, product=product, quantity=1, subtotal=product.price)
+    elif cart_item.quantity + step > 0:
+        cart_item.quantity += step
+        cart_item.subtotal = (product.price * cart_item.quantity).quantize(Decimal('0.01'))
+        cart_item.save(update_fields=['quantity', 'subtotal'])
+    else:
+        cart_item.delete()
+        cart_item.subtotal = Decimal('0.00')
+    session.cart_total = (session.cart_total + cart_item.subtotal - previous_subtotal).quantize(Decimal('0.01'))
+    session.cart_version += 1
+    session.save(update_fields=['cart_total', 'cart_version'])
+
+
+def _legacy(session_id, product, step):
+    with transaction.atomic():
+        session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
+        _legacy_change(session, product, step)
+
+
+def _atomic(session_id, product, step):
+    session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        if step > 0:
+            add_to_cart(session, product.barcode)
+        else:
+            remove_from_cart(session, product)
+
+
+MODES = {'legacy': _legacy, 'atomic': _atomic}
+
+
+class Command(BaseCommand):
+    help = 'Compare cart scan/remove throughput of locked read-modify-write against single-statement updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scanners', type=int, default=32, help='Concurrent scanner threads')
+        parser.add_argument('--sessions', type=int, default=8, help='Sessions the scanners are spread over')
+        parser.add_argument('--products', type=int, default=10)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--remove-every', type=int, default=4, help='Every Nth operation is a remove (0 = never)')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        products = create_bench_products(options['products'])
+        get_catalog().invalidate()
+        report = {'options': {key: options[key] for key in ('scanners', 'sessions', 'products', 'duration', 'remove_every')}}
+        try:
+            for mode, change in MODES.items():
+                session_ids = []
+                for index in range(options['sessions']):
+                    trolley = Trolley.objects.create(
+                        trolley_id=f'{BENCH_PREFIX}CART-{mode}-{index}', is_assigned=True, last_seen=timezone.now(),
+                    )
+                    session_ids.append(Session.objects.create(trolley=trolley, last_activity=timezone.now()).session_id)
+                recorder = LatencyRecorder()
+
+                def scanner(index, deadline):
+                    session_id = session_ids[index % len(session_ids)]
+                    count = 0
+                    while time.perf_counter() < deadline:
+                        count += 1
+                        product = products[(index + count) % len(products)]
+                        step = -1 if options['remove_every'] and count % options['remove_every'] == 0 else 1
+                        name = 'remove' if step < 0 else 'scan'
+                        start = time.perf_counter()
+                        failed = False
+                        try:
+                            change(session_id, product, step)
+                        except Exception:
+                            # Lock wait timeouts, deadlocks, "Item not in cart" races
+                            failed = True
+                        recorder.record(name, time.perf_counter() - start, failed)
+
+                run_threads(options['scanners'], scanner, options['duration'])
+                recorder.stop()
+                summary = recorder.summary()
+                succeeded = sum(row['count'] - row['errors'] for row in summary.values())
+                summary['transactions_per_second'] = round(succeeded / options['duration'], 2)
+                summary['totals_consistent'] = all(
+                    session.cart_total == recalculate_cart_total(session)
+                    for session in Session.objects.filter(session_id__in=session_ids)
+                )
+                report[mode] = summary
+                self._print_mode(mode, summary)
+        finally:
+            cleanup_bench_data()
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _print_mode(self, mode, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{mode}: {summary['transactions_per_second']} tx/s, totals consistent: {summary['totals_consistent']}"
+        ))
+        for name in ('scan', 'remove'):
+            row = summary.get(name)
+            if row:
+                self.stdout.write(
+                    f"  {name:<8} n={row['count']:<7} err={row['errors']:<5} "
+                    f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms"
+                )
@@ -0,0 +1,105 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.benchmarking import BENCH_PREFIX, cleanup_bench_data, write_report
+from api.models import Session, Trolley
+from api.provisioning import provision
+from api.utils import expire_session
+
+
+def _legacy_create(trolley_ids):
+    # seed_trolleys before bulk provisioning: one get_or_create per trolley
+    for trolley_id in trolley_ids:
+        Trolley.objects.get_or_create(trolley_id=trolley_id, defaults={'last_seen': timezone.now()})
+
+
+def _legacy_set_active(trolley_ids, active):
+    # The admin without bulk actions: one save per trolley, one expire_session per session
+    for trolley in Trolley.objects.filter(trolley_id__in=trolley_ids):
+        with transaction.atomic():
+            if not active:
+                for session in Session.objects.select_for_update().select_related('trolley').filter(trolley=trolley, is_active=True):
+                    expire_session(session)
+                trolley.is_assigned = False
+            trolley.is_active = active
+            trolley.save(update_fields=['is_active', 'is_assigned'])
+
+
+MODES = {
+    'legacy': {
+        'create': _legacy_create,
+        'deactivate': lambda ids: _legacy_set_active(ids, False),
+        'activate': lambda ids: _legacy_set_active(ids, True),
+    },
+    'bulk': {
+        'create': lambda ids: provision('create', ids),
+        'deactivate': lambda ids: provision('deactivate', ids),
+        'activate': lambda ids: provision('activate', ids),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Time creating, deactivating and re-activating a trolley fleet row by row against bulk provisioning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trolleys', type=int, default=10000)
+        parser.add_argument('--sessions', type=int, default=1000, help='Active sessions to end on deactivation')
+        parser.add_argument('--skip-legacy', action='store_true')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        report = {'options': {key: options[key] for key in ('trolleys', 'sessions')}}
+        modes = [mode for mode in MODES if not (options['skip_legacy'] and mode == 'legacy')]
+        cleanup_bench_data()
+        try:
+            for mode in modes:
+                trolley_ids = [f'{BENCH_PREFIX}FLEET-{mode}-{index:05d}' for index in range(options['trolleys'])]
+                timings = {}
+                start = time.perf_counter()
+                MODES[mode]['create'](trolley_ids)
+                timings['create'] = time.perf_counter() - start
+
+                # Occupy some trolleys so deactivation has sessions to end (not timed)
+                now = timezone.now()
+                occupied = list(Trolley.objects.filter(trolley_id__in=trolley_ids[:options['sessions']]))
+                Session.objects.bulk_create([Session(trolley=trolley, last_activity=now) for trolley in occupied])
+                Trolley.objects.filter(pk__in=[trolley.pk for trolley in occupied]).update(is_assigned=True)
+
+                for action in ('deactivate', 'activate'):
+                    start = time.perf_counter()
+                    MODES[mode][action](trolley_ids)
+                    timings[action] = time.perf_counter() - start
+
+                trolleys = Trolley.objects.filter(trolley_id__in=trolley_ids)
+                report[mode] = {
+                    **{
+                        action: {
+                            'ms': round(seconds * 1000, 1),
+                            'trolleys_per_second': round(len(trolley_ids) / seconds, 1) if seconds else 0.0,
+                        }
+                        for action, seconds in timings.items()
+                    },
+                    'consistent': (
+                        trolleys.count() == len(trolley_ids)
+                        and not trolleys.filter(is_active=False).exists()
+                        and not trolleys.filter(is_assigned=True).exists()
+                        and not Session.objects.filter(trolley__in=trolleys, is_active=True).exists()
+                    ),
+                }
+                self._print_mode(mode, report[mode])
+        finally:
+            cleanup_bench_data()
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _print_mode(self, mode, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{mode}: consistent: {summary['consistent']}"))
+        for action in ('create', 'deactivate', 'activate'):
+            row = summary[action]
+            self.stdout.write(f"  {action:<11} {row['ms']:>10} ms  {row['trolleys_per_second']:>10} trolleys/s")
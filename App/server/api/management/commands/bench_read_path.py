@@ -0,0 +1,123 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.utils import timezone
+
+from api.benchmarking import (
+    BENCH_PREFIX,
+    LatencyRecorder,
+    cleanup_bench_data,
+    create_bench_products,
+    run_threads,
+    write_report,
+)
+from api.models import Session, Trolley
+from api.serializers import CartItemSerializer
+from api.utils import calculate_cart_total, get_locked_session, get_session, refresh_activity
+from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
+
+
+def _read_cart(session):
+    calculate_cart_total(session)
+    return CartItemSerializer(session.cart_items.select_related('product'), many=True).data
+
+
+def _locking_poll(session_id):
+    # What CartView and the heartbeat did before: a row lock per read.
+    with transaction.atomic():
+        _read_cart(get_locked_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+def _locking_heartbeat(session_id):
+    with transaction.atomic():
+        refresh_activity(get_locked_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+def _lock_free_poll(session_id):
+    _read_cart(get_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+def _lock_free_heartbeat(session_id):
+    refresh_activity(get_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+MODES = {
+    'locking': (_locking_poll, _locking_heartbeat),
+    'lock-free': (_lock_free_poll, _lock_free_heartbeat),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure scan latency on one session while many pollers read it, with and without row locks on reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pollers', type=int, default=50)
+        parser.add_argument('--scanners', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--heartbeat-every', type=int, default=8, help='Every Nth poller request is a heartbeat')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        cleanup_bench_data()
+        products = create_bench_products(20)
+        report = {'options': {key: options[key] for key in ('pollers', 'scanners', 'duration', 'heartbeat_every')}}
+        try:
+            for mode, (poll, heartbeat) in MODES.items():
+                trolley = Trolley.objects.create(trolley_id=f'{BENCH_PREFIX}READ-{mode}', is_assigned=True, last_seen=timezone.now())
+                session = Session.objects.create(trolley=trolley, last_activity=timezone.now())
+                session_id = str(session.session_id)
+                recorder = LatencyRecorder()
+
+                def poller(index, deadline):
+                    count = 0
+                    while time.perf_counter() < deadline:
+                        count += 1
+                        is_heartbeat = count % options['heartbeat_every'] == 0
+                        start = time.perf_counter()
+                        failed = False
+                        try:
+                            (heartbeat if is_heartbeat else poll)(session_id)
+                        except Exception:
+                            failed = True
+                        recorder.record('heartbeat' if is_heartbeat else 'poll', time.perf_counter() - start, failed)
+
+                def scanner(index, deadline):
+                    client = Client(raise_request_exception=False)
+                    count = 0
+                    while time.perf_counter() < deadline:
+                        barcode = products[(index + count) % len(products)].barcode
+                        count += 1
+                        start = time.perf_counter()
+                        response = client.post(
+                            '/api/cart/scan',
+                            {'session_id': session_id, 'barcode': barcode, 'response_format': 'delta'},
+                            content_type='application/json',
+                        )
+                        recorder.record('scan', time.perf_counter() - start, response.status_code != 200)
+
+                def run(index, deadline):
+                    if index < options['scanners']:
+                        scanner(index, deadline)
+                    else:
+                        poller(index, deadline)
+
+                run_threads(options['scanners'] + options['pollers'], run, options['duration'])
+                recorder.stop()
+                report[mode] = recorder.summary()
+                self._print_mode(mode, report[mode])
+        finally:
+            cleanup_bench_data()
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _print_mode(self, mode, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(mode))
+        for name, row in summary.items():
+            self.stdout.write(
+                f"  {name:<10} n={row['count']:<7} err={row['errors']:<5} {row['per_second']:>9}/s  "
+                f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms"
+            )
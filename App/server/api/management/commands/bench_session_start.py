@@ -0,0 +1,141 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from api.benchmarking import BENCH_PREFIX, LatencyRecorder, cleanup_bench_data, lock_wait_counters, run_threads, write_report
+from api.fleet import get_fleet
+from api.models import Session, Trolley
+from api.utils import (
+    TrolleyUnavailable,
+    expire_session,
+    get_locked_session,
+    session_timed_out,
+    start_session,
+)
+from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
+
+
+def _legacy_start(trolley_id):
+    # Session start before the conditional claim: lock the trolley, lock any
+    # active session, insert, then mark the trolley assigned.
+    fleet = get_fleet()
+    state = fleet.ensure(trolley_id)
+    with transaction.atomic():
+        trolley = Trolley.objects.select_for_update().filter(pk=state.pk).first()
+        if not trolley.is_active or trolley.is_assigned:
+            raise TrolleyUnavailable()
+        existing_session = (
+            Session.objects.select_for_update()
+            .filter(trolley=trolley, is_active=True)
+            .order_by('-created_at')
+            .first()
+        )
+        if existing_session:
+            if not session_timed_out(existing_session, SESSION_TIMEOUT_SECONDS):
+                raise TrolleyUnavailable()
+            expire_session(existing_session)
+        now = timezone.now()
+        session = Session.objects.create(trolley=trolley, is_active=True, last_activity=now)
+        fleet.assign(trolley.pk, now)
+    return session.session_id
+
+
+def _claim_start(trolley_id):
+    state = get_fleet().ensure(trolley_id)
+    return start_session(state.pk, SESSION_TIMEOUT_SECONDS).session_id
+
+
+def _end(session_id):
+    with transaction.atomic():
+        expire_session(get_locked_session(session_id, SESSION_TIMEOUT_SECONDS))
+
+
+MODES = {'locked': _legacy_start, 'claim': _claim_start}
+
+
+class Command(BaseCommand):
+    help = 'Measure session start/end cycles per second at store-opening concurrency, locked start vs conditional claim'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--phones', type=int, default=64, help='Concurrent phones starting sessions')
+        parser.add_argument(
+            '--phones-per-trolley', type=int, default=1,
+            help='Phones racing for each trolley (QR codes scanned twice, shared carts)',
+        )
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        phones = options['phones']
+        trolley_count = max(1, phones // max(1, options['phones_per_trolley']))
+        report = {'options': {key: options[key] for key in ('phones', 'phones_per_trolley', 'duration')}}
+        cleanup_bench_data()
+        try:
+            for mode, start in MODES.items():
+                trolley_ids = [f'{BENCH_PREFIX}START-{mode}-{index:04d}' for index in range(trolley_count)]
+                Trolley.objects.bulk_create([Trolley(trolley_id=trolley_id, last_seen=timezone.now()) for trolley_id in trolley_ids])
+                get_fleet().invalidate()
+                recorder = LatencyRecorder()
+                locks_before = lock_wait_counters()
+
+                def phone(index, deadline):
+                    trolley_id = trolley_ids[index % len(trolley_ids)]
+                    while time.perf_counter() < deadline:
+                        began = time.perf_counter()
+                        try:
+                            session_id = start(trolley_id)
+                        except TrolleyUnavailable:
+                            # Another phone holds the trolley: a correct refusal, not an error
+                            recorder.record('refused', time.perf_counter() - began)
+                            continue
+                        except Exception:
+                            # Lock wait timeouts and deadlocks
+                            recorder.record('start', time.perf_counter() - began, True)
+                            continue
+                        recorder.record('start', time.perf_counter() - began)
+                        began = time.perf_counter()
+                        try:
+                            _end(session_id)
+                        except Exception:
+                            recorder.record('end', time.perf_counter() - began, True)
+                            continue
+                        recorder.record('end', time.perf_counter() - began)
+
+                run_threads(phones, phone, options['duration'])
+                recorder.stop()
+                summary = recorder.summary()
+                ended = summary.get('end', {})
+                summary['cycles_per_second'] = round((ended.get('count', 0) - ended.get('errors', 0)) / options['duration'], 2)
+                summary['lock_waits'] = {
+                    name: value - locks_before.get(name, 0) for name, value in lock_wait_counters().items()
+                }
+                summary['one_active_session_per_trolley'] = not (
+                    Session.objects.filter(trolley__trolley_id__in=trolley_ids, is_active=True)
+                    .values('trolley').annotate(active=Count('pk')).filter(active__gt=1).exists()
+                )
+                report[mode] = summary
+                self._print_mode(mode, summary)
+        finally:
+            cleanup_bench_data()
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _print_mode(self, mode, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{mode}: {summary['cycles_per_second']} start/end cycles/s, "
+            f"one active session per trolley: {summary['one_active_session_per_trolley']}"
+        ))
+        for name in ('start', 'end', 'refused'):
+            row = summary.get(name)
+            if row:
+                self.stdout.write(
+                    f"  {name:<8} n={row['count']:<7} err={row['errors']:<5} "
+                    f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms"
+                )
+        if summary['lock_waits']:
+            self.stdout.write(f"  lock waits: {summary['lock_waits']}")
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from api.benchmarking import BENCH_PREFIX, LatencyRecorder, cleanup_bench_data, render_blank_jpeg, write_report
+from api.models import Session, Trolley
+
+HOST = 'localhost'
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+
+class _SlowBody(io.RawIOBase):
+    """``wsgi.input`` that hands out the body at ``rate`` bytes per second, like a weak uplink."""
+
+    def __init__(self, body: bytes, rate: float, chunk: int):
+        self.body = body
+        self.rate = rate
+        self.chunk = chunk
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        remaining = len(self.body) - self.offset
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        # Django asks for the whole body in one read; it arrives one packet at a time
+        data = bytearray()
+        while len(data) < size:
+            piece = self.body[self.offset:self.offset + min(self.chunk, size - len(data))]
+            time.sleep(len(piece) / self.rate)
+            data += piece
+            self.offset += len(piece)
+        return bytes(data)
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare a WSGI worker with N threads against the ASGI app (sync and async views) while '
+        'trolleys upload frames over a slow link and phones poll their carts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(MODES), help=f"Comma-separated, from {', '.join(MODES)}")
+        parser.add_argument('--uploaders', type=int, default=48, help='Trolleys uploading frames concurrently')
+        parser.add_argument('--upload-rate', type=float, default=8192, help='Upload speed per trolley in bytes/s')
+        parser.add_argument('--pollers', type=int, default=16, help='Phones polling /cart/view')
+        parser.add_argument('--poll-interval', type=float, default=0.5)
+        parser.add_argument('--wsgi-threads', type=int, default=8, help='Threads of the simulated WSGI worker')
+        parser.add_argument('--duration', type=float, default=15.0, help='Seconds per mode')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(sorted(unknown))}")
+        frame = render_blank_jpeg()
+        report = {
+            'options': {key: options[key] for key in (
+                'uploaders', 'upload_rate', 'pollers', 'poll_interval', 'wsgi_threads', 'duration',
+            )},
+            'frame_bytes': len(frame),
+            'upload_seconds_per_frame': round(len(frame) / options['upload_rate'], 3),
+        }
+        self.stdout.write(
+            f"{len(frame)} byte frames take {report['upload_seconds_per_frame']}s each to upload"
+        )
+
+        cleanup_bench_data()
+        try:
+            now = timezone.now()
+            trolleys = Trolley.objects.bulk_create([
+                Trolley(trolley_id=f'{BENCH_PREFIX}SLOW-{index:03d}', is_assigned=True, last_seen=now)
+                for index in range(max(1, options['pollers']))
+            ])
+            session_ids = [
+                str(session.session_id)
+                for session in Session.objects.bulk_create([Session(trolley=trolley, last_activity=now) for trolley in trolleys])
+            ]
+            for mode in modes:
+                recorder = LatencyRecorder()
+                if mode == 'wsgi':
+                    self._run_wsgi(options, frame, session_ids, recorder)
+                else:
+                    asyncio.run(self._run_asgi(options, frame, session_ids, recorder, use_async=mode == 'asgi-async'))
+                recorder.stop()
+                report[mode] = recorder.summary()
+                self._print_mode(mode, report[mode])
+        finally:
+            cleanup_bench_data()
+
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _run_wsgi(self, options, frame, session_ids, recorder):
+        handler = WSGIHandler()
+        scan_path, poll_path = reverse('barcode-scan'), reverse('cart-view')
+        worker = ThreadPoolExecutor(max_workers=options['wsgi_threads'])
+        deadline = time.perf_counter() + options['duration']
+
+        def call(method, path, query='', body=b'', content_type='', rate=None):
+            environ = {
+                'REQUEST_METHOD': method,
+                'PATH_INFO': path,
+                'QUERY_STRING': query,
+                'CONTENT_TYPE': content_type,
+                'CONTENT_LENGTH': str(len(body)),
+                'SERVER_NAME': HOST,
+                'SERVER_PORT': '80',
+                'HTTP_HOST': HOST,
+                'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.input': _SlowBody(body, rate, 1024) if rate else io.BytesIO(body),
+                'wsgi.errors': io.StringIO(),
+                'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0),
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return int(statuses[0].split()[0])
+
+        def timed(name, *args, **kwargs):
+            # The request waits for a free worker thread, as behind a real socket backlog
+            start = time.perf_counter()
+            status = worker.submit(call, *args, **kwargs).result()
+            recorder.record(name, time.perf_counter() - start, status >= 400)
+
+        def uploader(index):
+            while time.perf_counter() < deadline:
+                timed('scan', 'POST', scan_path, body=frame, content_type='image/jpeg', rate=options['upload_rate'])
+
+        def poller(index):
+            session_id = session_ids[index % len(session_ids)]
+            while time.perf_counter() < deadline:
+                timed('poll', 'GET', poll_path, query=f'session_id={session_id}')
+                time.sleep(options['poll_interval'])
+
+        threads = [threading.Thread(target=uploader, args=(index,)) for index in range(options['uploaders'])]
+        threads += [threading.Thread(target=poller, args=(index,)) for index in range(options['pollers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        worker.shutdown()
+
+    async def _run_asgi(self, options, frame, session_ids, recorder, use_async):
+        application = ASGIHandler()
+        suffix = '-async' if use_async else ''
+        scan_path, poll_path = reverse('barcode-scan' + suffix), reverse('cart-view' + suffix)
+        deadline = time.perf_counter() + options['duration']
+
+        async def call(method, path, query='', body=b'', content_type='', rate=None):
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': method,
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': query.encode(),
+                'headers': [
+                    (b'host', HOST.encode()),
+                    (b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode()),
+                ],
+                'client': ('127.0.0.1', 50000),
+                'server': (HOST, 80),
+            }
+            chunks = [body[offset:offset + 1024] for offset in range(0, len(body), 1024)] or [b'']
+            finished = asyncio.Event()
+            statuses = []
+
+            async def receive():
+                if chunks:
+                    chunk = chunks.pop(0)
+                    if rate:
+                        await asyncio.sleep(len(chunk) / rate)
+                    return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                    finished.set()
+
+            await application(scope, receive, send)
+            finished.set()
+            return statuses[0]
+
+        async def timed(name, *args, **kwargs):
+            start = time.perf_counter()
+            status = await call(*args, **kwargs)
+            recorder.record(name, time.perf_counter() - start, status >= 400)
+
+        async def uploader(index):
+            while time.perf_counter() < deadline:
+                await timed('scan', 'POST', scan_path, body=frame, content_type='image/jpeg', rate=options['upload_rate'])
+
+        async def poller(index):
+            session_id = session_ids[index % len(session_ids)]
+            while time.perf_counter() < deadline:
+                await timed('poll', 'GET', poll_path, query=f'session_id={session_id}')
+                await asyncio.sleep(options['poll_interval'])
+
+        await asyncio.gather(
+            *(uploader(index) for index in range(options['uploaders'])),
+            *(poller(index) for index in range(options['pollers'])),
+        )
+
+    def _print_mode(self, mode, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(mode))
+        for name in ('scan', 'poll'):
+            row = summary.get(name)
+            if row:
+                self.stdout.write(
+                    f"  {name:<5} n={row['count']:<6} {row['per_second']:>8}/s errors={row['errors']:<4} "
+                    f"p50={row['p50_ms']}ms p99={row['p99_ms']}ms"
+                )
@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.sales_export import FORMATS, export_sales, incremental_window
+
+_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+
+def _moment(value: str, option: str) -> datetime:
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'{option} must be a date (2026-01-31) or a datetime (2026-01-31T18:00)')
+        moment = datetime.combine(day, dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream payments with their session, trolley and cart lines to CSV, JSON Lines or Parquet (needs pyarrow). '
+        'Select payments by --since/--until, or continue from the previous run with --incremental.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, or '-' for stdout (csv/jsonl)")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the output file extension, else csv')
+        parser.add_argument('--since', help='Payments created at or after this date/datetime')
+        parser.add_argument('--until', help='Payments created before this date/datetime')
+        parser.add_argument('--incremental', action='store_true', help='Export payments created since the last incremental run')
+        parser.add_argument('--state', default='export_sales_state.json', help='Where --incremental keeps its position')
+        parser.add_argument(
+            '--settle-minutes', type=float, default=15.0,
+            help='With --incremental, leave payments this long to be confirmed before exporting them',
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Payments per page read from the database')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or _EXTENSIONS.get(os.path.splitext(output)[1].lower(), 'csv')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if file_format == 'parquet' and output == '-':
+            raise CommandError('Parquet needs a file path, not stdout')
+
+        if options['incremental']:
+            if options['since'] or options['until']:
+                raise CommandError('--incremental picks its own window; drop --since/--until')
+            state = {}
+            if os.path.exists(options['state']):
+                with open(options['state'], encoding='utf-8') as handle:
+                    state = json.load(handle)
+            since, until = incremental_window(state, options['settle_minutes'])
+        else:
+            since = _moment(options['since'], '--since') if options['since'] else None
+            until = _moment(options['until'], '--until') if options['until'] else None
+
+        try:
+            if file_format == 'parquet':
+                result = export_sales(output, file_format, since=since, until=until, chunk_size=options['chunk_size'])
+            elif output == '-':
+                result = export_sales(sys.stdout, file_format, since=since, until=until, chunk_size=options['chunk_size'])
+            else:
+                with open(output, 'w', encoding='utf-8', newline='') as handle:
+                    result = export_sales(handle, file_format, since=since, until=until, chunk_size=options['chunk_size'])
+        except RuntimeError as exc:
+            raise CommandError(str(exc)) from exc
+
+        if options['incremental']:
+            # Only move the window once the file is complete
+            state = {'until': until.isoformat(), 'exported_at': timezone.now().isoformat(), 'output': output, 'rows': result.rows}
+            temporary = f"{options['state']}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as handle:
+                json.dump(state, handle, indent=2)
+            os.replace(temporary, options['state'])
+
+        # Keep stdout clean when the export itself goes there
+        stream = self.stderr if output == '-' else self.stdout
+        if options['json']:
+            stream.write(json.dumps(result.as_dict()))
+            return
+        window = f"{result.since or 'the beginning'} to {result.until or 'now'}"
+        stream.write(self.style.SUCCESS(
+            f'Exported {result.rows} rows for {result.payments} payments ({window}) '
+            f'as {file_format} in {result.duration_s:.2f}s'
+        ))
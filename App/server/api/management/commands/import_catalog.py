@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_import import FIELDS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update products from a CSV (with a header row) or JSON Lines file, matched by barcode. '
+        'Columns: barcode, name, price, category, is_active; only barcode is required for existing products.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to jsonl for .jsonl/.ndjson, csv otherwise')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk upsert')
+        parser.add_argument('--dry-run', action='store_true', help='Show what would change without writing')
+        parser.add_argument('--show', type=int, default=50, help='Changes to print in a dry run (-1 for all)')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        shown = 0
+
+        def show(line, barcode, before, after):
+            nonlocal shown
+            if options['show'] >= 0 and shown >= options['show']:
+                return
+            shown += 1
+            if before is None:
+                self.stdout.write(self.style.SUCCESS(
+                    f"+ {barcode} {after['name']!r} {after['price']} [{after['category']}]"
+                    + ('' if after['is_active'] else ' inactive')
+                ))
+                return
+            changes = ', '.join(f'{name}: {before[name]} -> {after[name]}' for name in FIELDS if before[name] != after[name])
+            self.stdout.write(self.style.WARNING(f'~ {barcode} {changes}'))
+
+        try:
+            result = import_products(
+                read_rows(options['path'], options['format']),
+                chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'],
+                on_change=show if options['dry_run'] else None,
+            )
+        except OSError as exc:
+            raise CommandError(f"Cannot read {options['path']}: {exc}") from exc
+
+        if options['json']:
+            self.stdout.write(json.dumps({'dry_run': options['dry_run'], **result.as_dict()}))
+            return
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if options['dry_run'] and shown < result.created + result.updated:
+            self.stdout.write(f'... {result.created + result.updated - shown} more changes not shown')
+        created, updated = ('Would create', 'update') if options['dry_run'] else ('Created', 'updated')
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} {result.created}, {updated} {result.updated}, unchanged {result.unchanged}, '
+            f'invalid {result.invalid} of {result.rows} rows in {result.duration_s:.2f}s '
+            f'({result.rows_per_second} rows/s, {result.chunks} chunks)'
+        ))
@@ -0,0 +1,325 @@
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from api.benchmarking import (
+    BENCH_PREFIX,
+    LatencyRecorder,
+    bench_ean13_barcodes,
+    cleanup_bench_data,
+    create_bench_ean13_products,
+    lock_wait_counters,
+    render_blank_jpeg,
+    render_ean13_jpeg,
+    run_threads,
+    write_report,
+)
+from api.catalog import get_catalog
+from api.frame_cache import get_frame_cache
+from api.models import Trolley
+
+# Device timings, in seconds of real time before --time-scale is applied
+CAPTURE_INTERVAL = 3.0      # scan.ino CAPTURE_INTERVAL_MS
+HEARTBEAT_INTERVAL = 15.0   # heartbeatManager.js HEARTBEAT_INTERVAL
+CART_POLL_INTERVAL = 2.0    # Cart.jsx polling fallback
+
+
+class _ClientTransport:
+    """Requests through the Django test client, in this process."""
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()}
+        if method == 'GET':
+            response = self.client.get(path, **extra)
+        else:
+            response = self.client.post(path, body, content_type=content_type, **extra)
+        return response.status_code, response.headers, response.content
+
+
+class _HttpTransport:
+    """Requests over HTTP to a running server (runserver, gunicorn, uvicorn)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, content_type=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=dict(headers or {}))
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.headers, exc.read()
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate a store of trolleys and phones running full shopping trips against the API, '
+        'and report throughput, latency percentiles per endpoint and lock waits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trolleys', type=int, default=20)
+        parser.add_argument('--items', type=int, default=8, help='Items scanned per trip')
+        parser.add_argument('--trips', type=int, default=1, help='Trips per trolley')
+        parser.add_argument('--item-interval', type=float, default=15.0, help='Seconds of shopping between items')
+        parser.add_argument('--time-scale', type=float, default=1.0, help='Multiply every interval, e.g. 0.05 for a quick run')
+        parser.add_argument('--json-scan-ratio', type=float, default=0.2, help='Share of items sent as JSON to /cart/scan')
+        parser.add_argument('--remove-ratio', type=float, default=0.1, help='Share of items put back after scanning')
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=600.0, help='Stop after this many seconds regardless')
+        parser.add_argument(
+            '--base-url',
+            help='Drive a running server, e.g. http://127.0.0.1:8000, instead of the test client. The local database is '
+                 "left alone, so the server's must already hold the bench products (see --keep-data)",
+        )
+        parser.add_argument('--keep-data', action='store_true', help='Leave the bench products and trolleys in place afterwards')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Earlier report to compare p99 latencies against')
+
+    def handle(self, *args, **options):
+        if options['trolleys'] < 1 or options['items'] < 1:
+            raise CommandError('--trolleys and --items must be at least 1')
+        scale = options['time_scale']
+        remote = bool(options['base_url'])
+        if remote and scale != 1:
+            # The frame cache TTL and scan debounce are the server's, in real
+            # seconds, so a compressed trip would see its repeat scans rejected
+            raise CommandError(
+                '--time-scale only works with the test client; a running server keeps its own '
+                'FRAME_CACHE_TTL_SECONDS and SCAN_DEBOUNCE_SECONDS'
+            )
+        trolley_ids = [f'{BENCH_PREFIX}LOAD-{index:04d}' for index in range(options['trolleys'])]
+        if remote:
+            # Session start registers unknown trolleys on the server
+            barcodes = bench_ean13_barcodes(options['products'])
+        else:
+            cleanup_bench_data()
+            barcodes = [product.barcode for product in create_bench_ean13_products(options['products'])]
+            get_catalog().invalidate()
+            Trolley.objects.bulk_create([Trolley(trolley_id=trolley_id, last_seen=timezone.now()) for trolley_id in trolley_ids])
+            # Keep the dedup windows in step with the compressed trip
+            frame_cache = get_frame_cache()
+            frame_cache_windows = frame_cache.ttl, frame_cache.debounce
+            frame_cache.ttl *= scale
+            frame_cache.debounce *= scale
+
+        frames = {barcode: render_ean13_jpeg(barcode) for barcode in barcodes}
+        blank_frame = render_blank_jpeg()
+        urls = {name: reverse(name) for name in (
+            'session-start', 'session-heartbeat', 'session-end', 'cart-scan', 'barcode-scan',
+            'cart-remove', 'cart-view', 'payment-create', 'payment-confirm',
+        )}
+
+        recorder = LatencyRecorder()
+        statuses = defaultdict(Counter)
+        statuses_lock = threading.Lock()
+        trips = Counter()
+        scans = Counter()
+        server_errors = Counter()
+
+        def on_exception(sender, request=None, **kwargs):
+            # Sent from inside the handler's except block, so the exception is current.
+            exc = sys.exc_info()[1]
+            message = str(exc).lower()
+            kind = 'lock' if 'lock' in message else type(exc).__name__
+            with statuses_lock:
+                server_errors[kind] += 1
+
+        def make_transport():
+            return _HttpTransport(options['base_url']) if options['base_url'] else _ClientTransport()
+
+        def call(transport, name, method='POST', payload=None, body=None, content_type='application/json', path=None, headers=None):
+            if payload is not None:
+                body = json.dumps(payload).encode()
+            start = time.perf_counter()
+            try:
+                code, response_headers, content = transport.request(
+                    method, path or urls[name], body, content_type if body is not None else None, headers,
+                )
+            except OSError:
+                code, response_headers, content = 0, {}, b''
+            recorder.record(name, time.perf_counter() - start, code == 0 or code >= 500)
+            with statuses_lock:
+                statuses[name][code] += 1
+            try:
+                data = json.loads(content) if content else None
+            except ValueError:
+                data = None
+            return code, response_headers, data
+
+        def trolley(index, deadline):
+            transport = make_transport()
+            trolley_id = trolley_ids[index]
+            local = random.Random(options['seed'] * 100003 + index)
+            for _ in range(options['trips']):
+                if time.perf_counter() >= deadline:
+                    return
+                code, _, data = call(transport, 'session-start', payload={'trolley_id': trolley_id})
+                if code != 201:
+                    return
+                session_id = data['session_id']
+                etag = None
+                now = time.perf_counter()
+                next_capture = now + local.uniform(0, CAPTURE_INTERVAL) * scale
+                next_heartbeat = now + HEARTBEAT_INTERVAL * scale
+                next_poll = now + local.uniform(0, CART_POLL_INTERVAL) * scale
+                next_item = now + local.expovariate(1 / options['item_interval']) * scale
+                in_cart = []
+                scanned = 0
+                while scanned < options['items'] and time.perf_counter() < deadline:
+                    wake = min(next_capture, next_heartbeat, next_poll)
+                    time.sleep(max(0.0, wake - time.perf_counter()))
+                    now = time.perf_counter()
+                    if now >= next_capture:
+                        # The camera sends a frame every interval; only some of them show a barcode.
+                        next_capture = now + CAPTURE_INTERVAL * scale
+                        if now >= next_item:
+                            barcode = local.choice(barcodes)
+                            scanned += 1
+                            next_item = now + local.expovariate(1 / options['item_interval']) * scale
+                            if local.random() < options['json_scan_ratio']:
+                                code, _, _ = call(
+                                    transport, 'cart-scan',
+                                    payload={'trolley_id': trolley_id, 'barcode': barcode},
+                                    headers={'Idempotency-Key': f'{session_id}-{scanned}'},
+                                )
+                                outcome = 'added' if code == 200 else 'failed'
+                            else:
+                                code, _, data = call(
+                                    transport, 'barcode-scan', body=frames[barcode],
+                                    content_type='image/jpeg', path=f"{urls['barcode-scan']}?trolley_id={trolley_id}",
+                                )
+                                outcome = self._image_scan_outcome(code, data)
+                            with statuses_lock:
+                                scans[outcome] += 1
+                            if outcome == 'added':
+                                in_cart.append(barcode)
+                            if in_cart and local.random() < options['remove_ratio']:
+                                removed = in_cart.pop(local.randrange(len(in_cart)))
+                                call(transport, 'cart-remove', payload={'session_id': session_id, 'barcode': removed})
+                        else:
+                            call(
+                                transport, 'barcode-scan', body=blank_frame, content_type='image/jpeg',
+                                path=f"{urls['barcode-scan']}?trolley_id={trolley_id}",
+                            )
+                    if now >= next_heartbeat:
+                        next_heartbeat = now + HEARTBEAT_INTERVAL * scale
+                        call(transport, 'session-heartbeat', payload={'session_id': session_id})
+                    if now >= next_poll:
+                        next_poll = now + CART_POLL_INTERVAL * scale
+                        code, response_headers, _ = call(
+                            transport, 'cart-view', method='GET',
+                            path=f"{urls['cart-view']}?session_id={session_id}",
+                            headers={'If-None-Match': etag} if etag else None,
+                        )
+                        if code == 200:
+                            etag = response_headers.get('ETag')
+
+                code, _, _ = call(
+                    transport, 'payment-create', payload={'session_id': session_id},
+                    headers={'Idempotency-Key': f'{session_id}-pay'},
+                )
+                if code == 201:
+                    call(transport, 'payment-confirm', payload={'session_id': session_id})
+                call(transport, 'session-end', payload={'session_id': session_id})
+                with statuses_lock:
+                    trips['completed'] += 1
+
+        # Lock counters are only available for the local database
+        locks_before = {} if remote else lock_wait_counters()
+        got_request_exception.connect(on_exception)
+        try:
+            run_threads(options['trolleys'], trolley, options['duration'])
+        finally:
+            got_request_exception.disconnect(on_exception)
+            recorder.stop()
+            locks_after = {} if remote else lock_wait_counters()
+            if not remote:
+                frame_cache.ttl, frame_cache.debounce = frame_cache_windows
+                if not options['keep_data']:
+                    cleanup_bench_data()
+
+        elapsed = recorder.finished_at - recorder.started_at
+        endpoints = recorder.summary()
+        total = sum(row['count'] for row in endpoints.values())
+        report = {
+            'options': {key: options[key] for key in (
+                'trolleys', 'items', 'trips', 'item_interval', 'time_scale', 'json_scan_ratio',
+                'remove_ratio', 'products', 'base_url', 'seed',
+            )},
+            'database': 'remote' if remote else self._database_vendor(),
+            'elapsed_seconds': round(elapsed, 3),
+            'trips_completed': trips['completed'],
+            'scans': dict(scans),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'endpoints': endpoints,
+            'status_codes': {name: {str(code): count for code, count in sorted(codes.items())} for name, codes in sorted(statuses.items())},
+            'lock_waits': {
+                **{name: locks_after[name] - locks_before.get(name, 0) for name in locks_after},
+                'server_errors': dict(server_errors),
+            },
+        }
+        self._print_report(report)
+        if options['baseline']:
+            self._compare(report, options['baseline'])
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    @staticmethod
+    def _image_scan_outcome(code, data):
+        """Whether a raw image scan put its item in the cart; duplicates and misses didn't."""
+        if code != 200 or not data:
+            return 'failed'
+        if not data.get('found'):
+            return 'unread'
+        if data.get('duplicate'):
+            return 'duplicate'
+        return 'added' if 'cart' in data else 'failed'
+
+    def _database_vendor(self):
+        return connection.vendor
+
+    def _print_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['trips_completed']} trips, {report['requests']} requests in {report['elapsed_seconds']}s "
+            f"({report['throughput_rps']} req/s) on {report['database']}"
+        ))
+        for name, row in report['endpoints'].items():
+            self.stdout.write(
+                f"  {name:<18} n={row['count']:<7} 5xx={row['errors']:<5} "
+                f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms"
+            )
+        self.stdout.write(f"  scans: {report['scans']}")
+        self.stdout.write(f"  lock waits: {report['lock_waits']}")
+
+    def _compare(self, report, baseline_path):
+        with open(baseline_path, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'p99 against {baseline_path}'))
+        for name, row in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if not before or not before['p99_ms']:
+                continue
+            change = (row['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS
+            self.stdout.write(style(f"  {name:<18} {before['p99_ms']}ms -> {row['p99_ms']}ms ({change:+.1f}%)"))
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.provisioning import ACTIONS, parse_trolley_ids, provision
+
+
+class Command(BaseCommand):
+    help = (
+        'Create, activate or deactivate trolleys in bulk, e.g. '
+        '"provision_trolleys create TROLLEY_0001..TROLLEY_2000". Deactivating ends active sessions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=ACTIONS)
+        parser.add_argument('trolleys', nargs='+', help='Ids and PREFIX0001..PREFIX2000 ranges')
+        parser.add_argument('--inactive', action='store_true', help='Create the trolleys deactivated')
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            trolley_ids = parse_trolley_ids(','.join(options['trolleys']))
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        result = provision(options['action'], trolley_ids, active=not options['inactive'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(result.as_dict()))
+            return
+        verb = {'create': 'Created', 'activate': 'Activated', 'deactivate': 'Deactivated'}[result.action]
+        message = f'{verb} {result.changed} of {result.requested} trolleys in {result.duration_ms:.1f} ms'
+        if result.action == 'deactivate':
+            message += f', ended {result.sessions_ended} active sessions'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,41 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.reaper import reap_expired_sessions
+from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
+
+
+class Command(BaseCommand):
+    help = 'Expire timed-out sessions in bulk, clearing their carts and releasing their trolleys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SESSION_REAPER_BATCH_SIZE)
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.SESSION_REAPER_INTERVAL_SECONDS,
+            help='Seconds between passes with --loop',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep running, one pass every --interval seconds')
+        parser.add_argument('--json', action='store_true', help='Print each pass as a JSON line')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            result = reap_expired_sessions(SESSION_TIMEOUT_SECONDS, options['batch_size'])
+            if options['json']:
+                self.stdout.write(json.dumps(result.as_dict()))
+            elif result.sessions or not options['loop']:
+                slowest = max(result.batch_ms, default=0.0)
+                self.stdout.write(
+                    f'Expired {result.sessions} sessions, deleted {result.cart_items} cart items, '
+                    f'released {result.trolleys} trolleys in {result.batches} batches '
+                    f'({result.duration_ms:.1f} ms, slowest batch {slowest:.1f} ms)'
+                )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
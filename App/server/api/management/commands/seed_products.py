@@ -2,7 +2,7 @@ from decimal import Decimal
 
 from django.core.management.base import BaseCommand
 
-from api.models import Product
+from api.catalog_import import import_products
 
 
 class Command(BaseCommand):
@@ -55,23 +55,9 @@ class Command(BaseCommand):
             {'barcode': '8901234000030', 'name': 'Tissue Roll Pack 4', 'price': Decimal('55.00'), 'category': 'Household'},
         ]
 
-        created_count = 0
-        for product_data in products_data:
-            product, created = Product.objects.get_or_create(
-                barcode=product_data['barcode'],
-                defaults={
-                    'name': product_data['name'],
-                    'price': product_data['price'],
-                    'category': product_data['category'],
-                    'is_active': True,
-                },
-            )
-            if created:
-                created_count += 1
-                self.stdout.write(self.style.SUCCESS(f'✓ Created: {product.name}'))
-            else:
-                self.stdout.write(self.style.WARNING(f'⊗ Exists: {product.name}'))
-
-        self.stdout.write(
-            self.style.SUCCESS(f'\n✓ Seed complete! {created_count} new products added.')
-        )
+        # Same path as import_catalog: one statement and one cache invalidation.
+        # Products that already exist keep any edits made in the admin.
+        result = import_products(enumerate(products_data, start=1), create_only=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Seed complete! {result.created} new products added, {result.skipped} already present.'
+        ))
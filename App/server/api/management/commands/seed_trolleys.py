@@ -1,7 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 
-from api.models import Trolley
+from api.provisioning import provision
 
 
 class Command(BaseCommand):
@@ -21,21 +20,7 @@ class Command(BaseCommand):
             'TROLLEY_10',
         ]
 
-        created_count = 0
-        for trolley_id in trolleys_data:
-            trolley, created = Trolley.objects.get_or_create(
-                trolley_id=trolley_id,
-                defaults={
-                    'is_assigned': False,
-                    'is_active': True,
-                    'last_seen': timezone.now(),
-                },
-            )
-            if created:
-                created_count += 1
-                self.stdout.write(self.style.SUCCESS(f'✓ Created: {trolley.trolley_id}'))
-            else:
-                self.stdout.write(self.style.WARNING(f'⊗ Exists: {trolley.trolley_id}'))
+        created_count = provision('create', trolleys_data).changed
 
         self.stdout.write(
             self.style.SUCCESS(f'\n✓ Seed complete! {created_count} new trolleys added.')
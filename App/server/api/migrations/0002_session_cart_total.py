@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 17:54
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Session = apps.get_model('api', 'Session')
+    for session in Session.objects.filter(is_active=True).annotate(summed=Sum('cart_items__subtotal')):
+        if session.summed:
+            Session.objects.filter(pk=session.pk).update(cart_total=session.summed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='cart_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_session_cart_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='cart_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_session_cart_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['is_active', 'last_activity'], name='session_active_activity_idx'),
+        ),
+    ]
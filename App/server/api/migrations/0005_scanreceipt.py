@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 18:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_session_active_activity_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_seq', models.PositiveBigIntegerField()),
+                ('barcode', models.CharField(max_length=64)),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_receipts', to='api.session')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('session', 'client_seq'), name='unique_scan_seq_per_session')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_scanreceipt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['session', '-created_at'], name='payment_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['barcode', 'is_active'], name='product_barcode_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['trolley', 'is_active', '-created_at'], name='session_trolley_active_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-17 18:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_open_carts(apps, schema_editor):
+    # Payments whose session still has its cart rows; ended sessions' carts are gone
+    CartItem = apps.get_model('api', 'CartItem')
+    Payment = apps.get_model('api', 'Payment')
+    PaymentLine = apps.get_model('api', 'PaymentLine')
+    for payment in Payment.objects.filter(session__cart_items__isnull=False).distinct().iterator():
+        PaymentLine.objects.bulk_create([
+            PaymentLine(
+                payment=payment,
+                product_id=item.product_id,
+                barcode=item.product.barcode,
+                name=item.product.name,
+                category=item.product.category,
+                quantity=item.quantity,
+                subtotal=item.subtotal,
+            )
+            for item in CartItem.objects.filter(session_id=payment.session_id).select_related('product')
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('barcode', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(max_length=100)),
+                ('quantity', models.PositiveIntegerField()),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='api.payment')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_lines', to='api.product')),
+            ],
+        ),
+        migrations.RunPython(copy_open_carts, migrations.RunPython.noop),
+    ]
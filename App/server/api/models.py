@@ -1,4 +1,5 @@
 import uuid
+from decimal import Decimal
 
 from django.db import models
 from django.db.models import Q
@@ -28,6 +29,10 @@ class Product(models.Model):
 
 	class Meta:
 		ordering = ['name']
+		indexes = [
+			# Active-product lookups by barcode (batch scans, catalog misses) read only the index
+			models.Index(fields=['barcode', 'is_active'], name='product_barcode_active_idx'),
+		]
 
 	def __str__(self):
 		return f"{self.name} ({self.barcode})"
@@ -53,6 +58,10 @@ class Session(models.Model):
 	is_active = models.BooleanField(default=True)
 	last_activity = models.DateTimeField()
 	created_at = models.DateTimeField(auto_now_add=True)
+	# Running sum of cart_items.subtotal, maintained in the same transaction as each cart change
+	cart_total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+	# Bumped on every cart change; clients use it to resume event streams and revalidate caches
+	cart_version = models.PositiveBigIntegerField(default=0)
 
 	class Meta:
 		ordering = ['-created_at']
@@ -63,6 +72,12 @@ class Session(models.Model):
 				name='unique_active_session_per_trolley',
 			),
 		]
+		indexes = [
+			# The session reaper's scan for timed-out sessions
+			models.Index(fields=['is_active', 'last_activity'], name='session_active_activity_idx'),
+			# A trolley's current session: filter on both columns, newest first, no sort
+			models.Index(fields=['trolley', 'is_active', '-created_at'], name='session_trolley_active_idx'),
+		]
 
 	def __str__(self):
 		return str(self.session_id)
@@ -84,6 +99,23 @@ class CartItem(models.Model):
 		return f"{self.product.name} x {self.quantity}"
 
 
+class ScanReceipt(models.Model):
+	"""One applied line of a batch scan, so a retried batch isn't counted twice"""
+	session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='scan_receipts')
+	client_seq = models.PositiveBigIntegerField()
+	barcode = models.CharField(max_length=64)
+	quantity = models.PositiveIntegerField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['session', 'client_seq'], name='unique_scan_seq_per_session'),
+		]
+
+	def __str__(self):
+		return f"{self.session_id} #{self.client_seq}"
+
+
 class Payment(models.Model):
 	class PaymentStatus(models.TextChoices):
 		PENDING = 'PENDING', 'Pending'
@@ -98,6 +130,24 @@ class Payment(models.Model):
 
 	class Meta:
 		ordering = ['-created_at']
+		indexes = [
+			# A session's latest payment
+			models.Index(fields=['session', '-created_at'], name='payment_session_created_idx'),
+		]
 
 	def __str__(self):
 		return f"Payment {self.pk} - {self.payment_status}"
+
+
+class PaymentLine(models.Model):
+	"""A cart line as it was billed; cart rows are deleted when the session ends"""
+	payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='lines')
+	product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_lines')
+	barcode = models.CharField(max_length=64)
+	name = models.CharField(max_length=255)
+	category = models.CharField(max_length=100)
+	quantity = models.PositiveIntegerField()
+	subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+
+	def __str__(self):
+		return f"{self.name} x {self.quantity}"
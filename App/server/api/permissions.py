@@ -0,0 +1,18 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsStaffOrMonitoring(BasePermission):
+    """Staff sessions, or a monitoring system presenting ``MONITORING_TOKEN``
+    as a bearer token or calling from one of ``MONITORING_ALLOWED_IPS``."""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = settings.MONITORING_TOKEN
+        scheme, _, presented = request.headers.get('Authorization', '').partition(' ')
+        if token and scheme.lower() == 'bearer' and hmac.compare_digest(presented.strip().encode(), token.encode()):
+            return True
+        return request.META.get('REMOTE_ADDR') in settings.MONITORING_ALLOWED_IPS
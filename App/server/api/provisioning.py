@@ -0,0 +1,155 @@
+"""Bulk creation, activation and deactivation of trolleys.
+
+Trolleys are addressed by specs such as ``TROLLEY_0001..TROLLEY_2000``,
+``T001-T010`` or ``TROLLEY_01,TROLLEY_02`` and changed a chunk of ids at a
+time with one ``bulk_create`` or ``UPDATE`` per chunk. Deactivating a trolley also ends its
+active session through ``reaper.expire_sessions``.
+
+None of these statements send model signals, so the fleet registry is told to
+reload once per operation.
+"""
+import re
+import time
+from dataclasses import asdict, dataclass
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .fleet import get_fleet
+from .models import Session, Trolley
+from .reaper import expire_sessions
+
+_RANGE = re.compile(r'^(?P<prefix>.*?)(?P<start>\d+)\.\.(?P=prefix)?(?P<end>\d+)$')
+# Ids may contain '-', so only PREFIX001-PREFIX010 with the prefix written twice is a range
+_DASH_RANGE = re.compile(r'^(?P<prefix>.*?)(?P<start>\d+)-(?P=prefix)(?P<end>\d+)$')
+
+ACTIONS = ('create', 'activate', 'deactivate')
+
+
+@dataclass
+class ProvisionResult:
+    action: str
+    requested: int = 0
+    changed: int = 0
+    sessions_ended: int = 0
+    duration_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        result = asdict(self)
+        result['duration_ms'] = round(self.duration_ms, 3)
+        return result
+
+
+def _padded(digits: str) -> bool:
+    return len(digits) > 1 and digits[0] == '0'
+
+
+def parse_trolley_ids(spec: str) -> list:
+    """Expand a comma-separated list of ids and ``PREFIX0001..PREFIX2000`` ranges.
+
+    ``PREFIX0001-PREFIX2000`` is a range too. Both ends of a zero-padded range
+    need the same number of digits. Duplicates are dropped and the order of
+    first appearance is kept.
+    """
+    ids = {}
+    for part in (part.strip() for part in spec.split(',')):
+        if not part:
+            continue
+        match = _RANGE.match(part) if '..' in part else _DASH_RANGE.match(part)
+        if match is None:
+            if '..' in part:
+                raise ValueError(f'{part!r} is not a range like TROLLEY_0001..TROLLEY_2000')
+            ids[part] = None
+        else:
+            start, end = int(match['start']), int(match['end'])
+            if end < start:
+                raise ValueError(f'{part!r} ends before it starts')
+            width = len(match['start'])
+            if len(match['end']) != width and (_padded(match['start']) or _padded(match['end'])):
+                raise ValueError(f'{part!r} mixes {width}- and {len(match["end"])}-digit numbers')
+            if len(ids) + end - start + 1 > settings.PROVISION_MAX_TROLLEYS:
+                raise ValueError(f'At most {settings.PROVISION_MAX_TROLLEYS} trolleys per request')
+            for number in range(start, end + 1):
+                ids[f"{match['prefix']}{number:0{width}d}"] = None
+        if len(ids) > settings.PROVISION_MAX_TROLLEYS:
+            raise ValueError(f'At most {settings.PROVISION_MAX_TROLLEYS} trolleys per request')
+    for trolley_id in ids:
+        if len(trolley_id) > 50:
+            raise ValueError(f'{trolley_id!r} is longer than 50 characters')
+    return list(ids)
+
+
+def _chunks(ids: list, size: int):
+    iterator = iter(ids)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def create_trolleys(trolley_ids: list, active: bool = True, chunk_size: int = 1000) -> int:
+    """Create the trolleys that don't exist yet; returns how many were created."""
+    created = 0
+    now = timezone.now()
+    for chunk in _chunks(trolley_ids, chunk_size):
+        existing = set(Trolley.objects.filter(trolley_id__in=chunk).values_list('trolley_id', flat=True))
+        missing = [Trolley(trolley_id=trolley_id, is_active=active, last_seen=now) for trolley_id in chunk if trolley_id not in existing]
+        if not missing:
+            continue
+        # ignore_conflicts covers a trolley registering itself in the meantime
+        Trolley.objects.bulk_create(missing, ignore_conflicts=True)
+        # Rows dropped as conflicts were inserted by someone else, with their own last_seen
+        created += Trolley.objects.filter(
+            trolley_id__in=[trolley.trolley_id for trolley in missing], last_seen=now,
+        ).count()
+    return created
+
+
+def activate_trolleys(trolley_ids: list, chunk_size: int = 1000) -> int:
+    activated = 0
+    for chunk in _chunks(trolley_ids, chunk_size):
+        activated += Trolley.objects.filter(trolley_id__in=chunk, is_active=False).update(is_active=True)
+    return activated
+
+
+def deactivate_trolleys(trolley_ids: list, chunk_size: int = 1000) -> tuple:
+    """Deactivate trolleys and end their active sessions; returns ``(trolleys, sessions)``."""
+    deactivated = ended = 0
+    for chunk in _chunks(trolley_ids, chunk_size):
+        with transaction.atomic():
+            # Lock the trolleys first so no session can start on them in between
+            pks = list(
+                Trolley.objects.select_for_update()
+                .filter(trolley_id__in=chunk, is_active=True)
+                .values_list('pk', flat=True)
+            )
+            if not pks:
+                continue
+            session_ids = list(
+                Session.objects.select_for_update()
+                .filter(trolley_id__in=pks, is_active=True)
+                .values_list('session_id', flat=True)
+            )
+            sessions, _, _ = expire_sessions(session_ids)
+            ended += sessions
+            deactivated += Trolley.objects.filter(pk__in=pks).update(is_active=False, is_assigned=False)
+    return deactivated, ended
+
+
+def provision(action: str, trolley_ids: list, active: bool = True) -> ProvisionResult:
+    """Run one of ``ACTIONS`` over ``trolley_ids`` (``active`` applies to ``create``)."""
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action {action!r}; use one of {', '.join(ACTIONS)}")
+    result = ProvisionResult(action=action, requested=len(trolley_ids))
+    started = time.perf_counter()
+    chunk_size = settings.PROVISION_CHUNK_SIZE
+    if action == 'create':
+        result.changed = create_trolleys(trolley_ids, active=active, chunk_size=chunk_size)
+    elif action == 'activate':
+        result.changed = activate_trolleys(trolley_ids, chunk_size=chunk_size)
+    else:
+        result.changed, result.sessions_ended = deactivate_trolleys(trolley_ids, chunk_size=chunk_size)
+    if result.changed:
+        transaction.on_commit(get_fleet().invalidate)
+    result.duration_ms = (time.perf_counter() - started) * 1000
+    return result
@@ -0,0 +1,113 @@
+"""Bulk expiry of sessions nobody is using any more.
+
+Requests still expire a timed-out session they run into, but abandoned
+trolleys are released by ``python manage.py reap_sessions``, which finds
+timed-out sessions through ``session_active_activity_idx`` and expires them in
+batches of a few statements each instead of one ``expire_session`` per row.
+"""
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .activity import get_activity_tracker
+from .events import publish_on_commit
+from .fleet import get_fleet
+from .models import CartItem, Session
+
+
+@dataclass
+class ReapResult:
+    sessions: int = 0
+    cart_items: int = 0
+    trolleys: int = 0
+    batches: int = 0
+    duration_ms: float = 0.0
+    batch_ms: list = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        result = asdict(self)
+        result['duration_ms'] = round(self.duration_ms, 3)
+        result['batch_ms'] = [round(ms, 3) for ms in self.batch_ms]
+        return result
+
+
+def expire_sessions(session_ids: list) -> tuple:
+    """Expire active sessions in bulk: clear their carts and release their trolleys.
+
+    The bulk counterpart of ``utils.expire_session``. Call it inside a
+    transaction. Of ``session_ids``, only the sessions still active are
+    expired; those locked by another transaction are skipped, so a session a
+    request is using right now stays alive, and only the expired ones get an
+    ended event. Returns ``(sessions, cart_items, trolleys)`` counts.
+    """
+    if not session_ids:
+        return 0, 0, 0
+    now = timezone.now()
+    # Rows this transaction already holds are not skipped
+    active = list(
+        Session.objects.select_for_update(skip_locked=True)
+        .filter(session_id__in=session_ids, is_active=True)
+        .values_list('session_id', 'trolley_id')
+    )
+    if not active:
+        return 0, 0, 0
+    expired_ids = [session_id for session_id, _ in active]
+    cart_items, _ = CartItem.objects.filter(session_id__in=expired_ids).delete()
+    expired = Session.objects.filter(session_id__in=expired_ids).update(
+        is_active=False,
+        last_activity=now,
+        cart_total=Decimal('0.00'),
+        cart_version=F('cart_version') + 1,
+    )
+    # At most one active session per trolley, so these trolleys are now free.
+    trolleys = get_fleet().release([trolley_pk for _, trolley_pk in active], now)
+
+    tracker = get_activity_tracker()
+    for session_id, version in Session.objects.filter(session_id__in=expired_ids).values_list('session_id', 'cart_version'):
+        tracker.discard(session_id)
+        publish_on_commit(session_id, 'session', {'status': 'ended'}, version)
+    return expired, cart_items, trolleys
+
+
+def reap_expired_sessions(timeout_seconds: int, batch_size: int, max_batches: int = None) -> ReapResult:
+    """Expire every session idle for longer than ``timeout_seconds``, ``batch_size`` at a time.
+
+    Activity the other workers have not flushed yet can be up to one flush
+    interval plus one write granularity behind, so that much grace is added to
+    the timeout.
+    """
+    grace = settings.ACTIVITY_FLUSH_INTERVAL_SECONDS + settings.ACTIVITY_WRITE_GRANULARITY_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds + grace)
+    tracker = get_activity_tracker()
+    result = ReapResult()
+    started = time.perf_counter()
+    while max_batches is None or result.batches < max_batches:
+        batch_started = time.perf_counter()
+        with transaction.atomic():
+            candidates = list(
+                Session.objects.select_for_update(skip_locked=True)
+                .filter(is_active=True, last_activity__lt=cutoff)
+                .order_by('last_activity')
+                .values_list('session_id', 'last_activity')[:batch_size]
+            )
+            # Touches recorded by this process but not yet flushed keep a session alive.
+            session_ids = [
+                session_id for session_id, last_activity in candidates
+                if tracker.latest(session_id, last_activity) < cutoff
+            ]
+            sessions, cart_items, trolleys = expire_sessions(session_ids)
+        result.sessions += sessions
+        result.cart_items += cart_items
+        result.trolleys += trolleys
+        result.batches += 1
+        result.batch_ms.append((time.perf_counter() - batch_started) * 1000)
+        if len(candidates) < batch_size or not session_ids:
+            break
+    result.duration_ms = (time.perf_counter() - started) * 1000
+    return result
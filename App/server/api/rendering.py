@@ -0,0 +1,70 @@
+"""Cart JSON built from plain rows instead of DRF serializers.
+
+``CartItemSerializer`` instantiates a nested ``ProductSerializer`` for every
+line, which dominates the response time of large carts returned after each
+scan. Here the cart is read with ``values_list()`` and each product's JSON is
+rendered once and kept with the catalog cache (``CatalogCache.fragment``), so a
+cart costs one query and a dict per line.
+
+``render_cart`` produces exactly what ``CartItemSerializer`` produces
+(see ``api/tests.py``). ``render_cart_compact`` lists each product once in a
+side table and refers to it by barcode from the lines.
+"""
+from decimal import Decimal
+
+from rest_framework import serializers
+
+from .catalog import get_catalog
+from .models import CartItem, Product, Session
+
+# Same formatting as the ModelSerializer fields for these columns
+_price = serializers.DecimalField(max_digits=10, decimal_places=2).to_representation
+_subtotal = serializers.DecimalField(max_digits=12, decimal_places=2).to_representation
+
+
+def render_product(product: Product) -> dict:
+    return {
+        'barcode': product.barcode,
+        'name': product.name,
+        'price': _price(product.price),
+        'category': product.category,
+        'is_active': product.is_active,
+    }
+
+
+def _fragment(barcode: str) -> dict:
+    fragment = get_catalog().fragment(barcode, render_product)
+    if fragment is None:
+        # Not visible to the catalog yet, e.g. created by another worker moments ago
+        fragment = render_product(Product.objects.get(barcode=barcode))
+    return fragment
+
+
+def _rows(session: Session):
+    # CartItem.Meta.ordering applies, so lines come out in the serializer's order
+    return CartItem.objects.filter(session=session).values_list('product__barcode', 'quantity', 'subtotal')
+
+
+def render_cart_item(cart_item: CartItem) -> dict:
+    return {
+        'product': _fragment(cart_item.product.barcode),
+        'quantity': cart_item.quantity,
+        'subtotal': _subtotal(cart_item.subtotal),
+    }
+
+
+def render_cart(session: Session, total: Decimal) -> dict:
+    items = [
+        {'product': _fragment(barcode), 'quantity': quantity, 'subtotal': _subtotal(subtotal)}
+        for barcode, quantity, subtotal in _rows(session)
+    ]
+    return {'items': items, 'total': str(total)}
+
+
+def render_cart_compact(session: Session, total: Decimal) -> dict:
+    items = []
+    products = {}
+    for barcode, quantity, subtotal in _rows(session):
+        products[barcode] = _fragment(barcode)
+        items.append({'barcode': barcode, 'quantity': quantity, 'subtotal': _subtotal(subtotal)})
+    return {'items': items, 'products': products, 'total': str(total)}
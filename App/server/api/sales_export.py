@@ -0,0 +1,227 @@
+"""Streaming export of payments with their session and cart lines.
+
+One row per line of each payment (``Payment`` joined to ``Session`` and
+``Trolley`` and left-joined to ``PaymentLine``), or a single row with empty line
+columns for a payment of an empty cart. The lines are the copy of the cart
+taken when the payment was created, since ending the session deletes the cart
+rows themselves.
+
+Payments are walked in ``chunk_size`` pages by primary key, and each page is
+read with ``values_list(...).iterator()``, so memory stays flat however many
+payments there are, also on MySQL, whose driver buffers whole result sets.
+
+Incremental exports cover ``[previous until, now - settle)``: payments are
+left ``settle`` minutes to be confirmed or fail before they are exported, and
+each payment is exported exactly once.
+"""
+import csv
+import json
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .models import Payment
+
+COLUMNS = (
+    'payment_id',
+    'payment_created_at',
+    'payment_status',
+    'payment_total',
+    'session_id',
+    'session_started_at',
+    'trolley_id',
+    'user_id',
+    'barcode',
+    'product_name',
+    'category',
+    'quantity',
+    'line_subtotal',
+)
+_FIELDS = (
+    'id',
+    'created_at',
+    'payment_status',
+    'total_amount',
+    'session_id',
+    'session__created_at',
+    'session__trolley__trolley_id',
+    'user_id',
+    'lines__barcode',
+    'lines__name',
+    'lines__category',
+    'lines__quantity',
+    'lines__subtotal',
+)
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+@dataclass
+class ExportResult:
+    format: str
+    rows: int = 0
+    payments: int = 0
+    since: datetime = None
+    until: datetime = None
+    duration_s: float = 0.0
+
+    def as_dict(self) -> dict:
+        result = asdict(self)
+        result['since'] = self.since.isoformat() if self.since else None
+        result['until'] = self.until.isoformat() if self.until else None
+        result['duration_s'] = round(self.duration_s, 3)
+        return result
+
+
+def sales_rows(payments=None, since=None, until=None, chunk_size: int = 2000):
+    """Yield one tuple per ``COLUMNS`` row for ``payments`` created in ``[since, until)``."""
+    payments = Payment.objects.all() if payments is None else payments
+    if since is not None:
+        payments = payments.filter(created_at__gte=since)
+    if until is not None:
+        payments = payments.filter(created_at__lt=until)
+    # Default ordering is -created_at; pages go by primary key instead
+    payments = payments.order_by()
+    last_id = 0
+    while True:
+        page = list(payments.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not page:
+            return
+        rows = (
+            payments.filter(id__gte=page[0], id__lte=page[-1])
+            .order_by('id', 'lines__id')
+            .values_list(*_FIELDS)
+        )
+        yield from rows.iterator(chunk_size=chunk_size)
+        last_id = page[-1]
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def write_csv(handle, rows) -> int:
+    writer = csv.writer(handle)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        count += 1
+    return count
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """CSV text a line at a time, for a ``StreamingHttpResponse``."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([_text(value) for value in row])
+
+
+def write_jsonl(handle, rows) -> int:
+    count = 0
+    for row in rows:
+        record = {
+            column: (None if value is None else value if isinstance(value, (int, str)) else _text(value))
+            for column, value in zip(COLUMNS, row)
+        }
+        handle.write(json.dumps(record, ensure_ascii=False))
+        handle.write('\n')
+        count += 1
+    return count
+
+
+def write_parquet(path: str, rows, batch_size: int = 10000) -> int:
+    """Write row groups of ``batch_size`` rows; needs pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError('Parquet export needs pyarrow (pip install pyarrow)') from exc
+
+    money = pa.decimal128(12, 2)
+    schema = pa.schema([
+        ('payment_id', pa.int64()),
+        ('payment_created_at', pa.timestamp('us', tz='UTC')),
+        ('payment_status', pa.string()),
+        ('payment_total', money),
+        ('session_id', pa.string()),
+        ('session_started_at', pa.timestamp('us', tz='UTC')),
+        ('trolley_id', pa.string()),
+        ('user_id', pa.string()),
+        ('barcode', pa.string()),
+        ('product_name', pa.string()),
+        ('category', pa.string()),
+        ('quantity', pa.int64()),
+        ('line_subtotal', money),
+    ])
+    uuid_columns = {COLUMNS.index('session_id'), COLUMNS.index('user_id')}
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                count += _write_batch(pa, writer, schema, batch, uuid_columns)
+                batch = []
+        if batch or not count:
+            count += _write_batch(pa, writer, schema, batch, uuid_columns)
+    return count
+
+
+def _write_batch(pa, writer, schema, batch, uuid_columns) -> int:
+    columns = [list(column) for column in zip(*batch)] if batch else [[] for _ in COLUMNS]
+    for index in uuid_columns:
+        columns[index] = [None if value is None else str(value) for value in columns[index]]
+    writer.write_table(pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    ))
+    return len(batch)
+
+
+def export_sales(output, file_format: str, payments=None, since=None, until=None, chunk_size: int = 2000) -> ExportResult:
+    """Write sales rows to ``output``: an open text file for csv/jsonl, a path for parquet."""
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}; use one of {', '.join(FORMATS)}")
+    result = ExportResult(format=file_format, since=since, until=until)
+    started = time.perf_counter()
+    last_payment = None
+
+    def rows():
+        nonlocal last_payment
+        # Rows come ordered by payment, so counting id changes counts payments
+        for row in sales_rows(payments, since, until, chunk_size):
+            if row[0] != last_payment:
+                last_payment = row[0]
+                result.payments += 1
+            yield row
+
+    if file_format == 'csv':
+        result.rows = write_csv(output, rows())
+    elif file_format == 'jsonl':
+        result.rows = write_jsonl(output, rows())
+    else:
+        result.rows = write_parquet(output, rows())
+    result.duration_s = time.perf_counter() - started
+    return result
+
+
+def incremental_window(state: dict, settle_minutes: float, now=None) -> tuple:
+    """``(since, until)`` continuing from a previous export's ``state``."""
+    now = now or timezone.now()
+    since = datetime.fromisoformat(state['until']) if state.get('until') else None
+    until = now - timedelta(minutes=settle_minutes)
+    if since is not None and until < since:
+        until = since
+    return since, until
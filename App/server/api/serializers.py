@@ -1,8 +1,10 @@
 import uuid
 
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import CartItem, Payment, Product, Session, Trolley, User
+from .models import CartItem, Payment, Product, Trolley, User
+from .provisioning import ACTIONS, parse_trolley_ids
 
 
 class UserSignupSerializer(serializers.ModelSerializer):
@@ -26,17 +28,54 @@ class SessionIdSerializer(serializers.Serializer):
     session_id = serializers.UUIDField()
 
 
-class CartScanSerializer(SessionIdSerializer):
+class CartResponseFormatSerializer(serializers.Serializer):
+    """'full' returns the whole cart; 'delta' returns only the changed item and the new total;
+    'compact' returns the whole cart with products in a side table keyed by barcode"""
+    response_format = serializers.ChoiceField(choices=['full', 'delta', 'compact'], default='full')
+
+
+class CartScanSerializer(SessionIdSerializer, CartResponseFormatSerializer):
     barcode = serializers.CharField(max_length=64)
 
 
-class CartScanTrolleySerializer(serializers.Serializer):
+class CartScanTrolleySerializer(CartResponseFormatSerializer):
     """Serializer for ESP32 product scans using trolley_id instead of session_id"""
     trolley_id = serializers.CharField(max_length=50)
     barcode = serializers.CharField(max_length=64)
 
 
-class CartRemoveSerializer(SessionIdSerializer):
+class BarcodeScanQuerySerializer(CartResponseFormatSerializer):
+    """Optional cart target for raw image scans, passed in the query string"""
+    session_id = serializers.UUIDField(required=False)
+    trolley_id = serializers.CharField(max_length=50, required=False)
+
+
+class BatchScanItemSerializer(serializers.Serializer):
+    barcode = serializers.CharField(max_length=64)
+    qty = serializers.IntegerField(min_value=1, default=1)
+    # Increasing per trolley; a retried batch reuses the same numbers
+    client_seq = serializers.IntegerField(min_value=0)
+
+
+class CartScanBatchSerializer(serializers.Serializer):
+    """Scans buffered by a trolley while offline, applied in one transaction"""
+    session_id = serializers.UUIDField(required=False)
+    trolley_id = serializers.CharField(max_length=50, required=False)
+    items = BatchScanItemSerializer(many=True, allow_empty=False, max_length=settings.BATCH_SCAN_MAX_ITEMS)
+
+    def validate_items(self, value):
+        seqs = [item['client_seq'] for item in value]
+        if len(set(seqs)) != len(seqs):
+            raise serializers.ValidationError('client_seq values must be unique within a batch')
+        return value
+
+    def validate(self, attrs):
+        if bool(attrs.get('session_id')) == bool(attrs.get('trolley_id')):
+            raise serializers.ValidationError('Exactly one of session_id or trolley_id is required')
+        return attrs
+
+
+class CartRemoveSerializer(SessionIdSerializer, CartResponseFormatSerializer):
     barcode = serializers.CharField(max_length=64)
 
 
@@ -63,12 +102,9 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class CartViewSerializer(serializers.Serializer):
+    """Only parses the query; the view's session read answers 404 for an unknown session"""
     session_id = serializers.UUIDField()
-
-    def validate_session_id(self, value):
-        if not Session.objects.filter(session_id=value).exists():
-            raise serializers.ValidationError('Session not found')
-        return value
+    response_format = serializers.ChoiceField(choices=['full', 'compact'], default='full')
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -78,6 +114,19 @@ class PaymentSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class FleetProvisionSerializer(serializers.Serializer):
+    """Bulk trolley change; ``trolleys`` is a spec such as 'TROLLEY_0001..TROLLEY_2000,TROLLEY_X'"""
+    action = serializers.ChoiceField(choices=ACTIONS)
+    trolleys = serializers.CharField()
+    active = serializers.BooleanField(default=True, help_text="New trolleys' is_active, for 'create'")
+
+    def validate_trolleys(self, value):
+        try:
+            return parse_trolley_ids(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc)) from exc
+
+
 class TrolleySerializer(serializers.ModelSerializer):
     class Meta:
         model = Trolley
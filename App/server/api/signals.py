@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import get_catalog
+from .fleet import get_fleet
+from .models import Product, Trolley
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(get_catalog().invalidate)
+
+
+@receiver(post_save, sender=Trolley)
+@receiver(post_delete, sender=Trolley)
+def invalidate_fleet(sender, update_fields=None, **kwargs):
+    # Assignment and activity writes keep the registry up to date themselves
+    if update_fields and set(update_fields) <= {'is_assigned', 'last_seen'}:
+        return
+    transaction.on_commit(get_fleet().invalidate)
@@ -1,3 +1,1180 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from smarttrolley.db.mysql_pool.pool import ConnectionPool, PoolTimeout
+
+from . import decoding
+from .activity import ActivityTracker, get_activity_tracker
+from .async_views import api_errors
+from .benchmarking import render_ean13_jpeg
+from .catalog import CatalogCache, check_shared_cache, get_catalog
+from .catalog_import import import_products
+from .decoding import DecodeEngine, DecodeResult
+from .fleet import get_fleet
+from .frame_cache import FrameCache, get_frame_cache
+from .idempotency import aidempotent, get_idempotency_store
+from .models import CartItem, Payment, Product, Session, Trolley, User
+from .provisioning import create_trolleys, parse_trolley_ids
+from .reaper import expire_sessions, reap_expired_sessions
+from .rendering import render_cart, render_cart_compact, render_cart_item
+from .sales_export import export_sales
+from .serializers import CartItemSerializer
+from .utils import TrolleyUnavailable, claim_session, get_session, recalculate_cart_total, start_session
+
+
+class CartRenderingTests(TestCase):
+    """The hand-built cart JSON must match what CartItemSerializer produced."""
+
+    @classmethod
+    def setUpTestData(cls):
+        trolley = Trolley.objects.create(trolley_id='TEST_TROLLEY', is_assigned=True, last_seen=timezone.now())
+        cls.session = Session.objects.create(trolley=trolley, last_activity=timezone.now())
+        products = [
+            Product.objects.create(barcode='1000000000001', name='Milk', price=Decimal('45.00'), category='Dairy'),
+            Product.objects.create(barcode='1000000000002', name='Apples', price=Decimal('120.5'), category='Fruit'),
+            Product.objects.create(barcode='1000000000003', name='Ünïcode "quoted"', price=Decimal('0.99'), category=''),
+            Product.objects.create(
+                barcode='1000000000004', name='Discontinued', price=Decimal('9999999.99'), category='Misc', is_active=False,
+            ),
+        ]
+        for quantity, product in enumerate(products, start=1):
+            CartItem.objects.create(
+                session=cls.session, product=product, quantity=quantity, subtotal=product.price * quantity,
+            )
+        total = sum(item.subtotal for item in CartItem.objects.filter(session=cls.session))
+        Session.objects.filter(pk=cls.session.pk).update(cart_total=total)
+
+    def setUp(self):
+        get_catalog().invalidate()
+        self.session.refresh_from_db()
+
+    def _serializer_cart(self):
+        items = CartItemSerializer(self.session.cart_items.select_related('product'), many=True).data
+        return {'items': items, 'total': str(self.session.cart_total)}
+
+    def assertSameJSON(self, first, second):
+        self.assertEqual(json.dumps(first), json.dumps(second))
+
+    def test_full_cart_matches_serializer(self):
+        expected = self._serializer_cart()
+        self.assertSameJSON(render_cart(self.session, self.session.cart_total), expected)
+        # Second render comes from cached product fragments
+        self.assertSameJSON(render_cart(self.session, self.session.cart_total), expected)
+
+    def test_item_matches_serializer(self):
+        for cart_item in self.session.cart_items.select_related('product'):
+            self.assertSameJSON(render_cart_item(cart_item), CartItemSerializer(cart_item).data)
+        removed = CartItem(session=self.session, product=Product.objects.get(barcode='1000000000001'), quantity=0, subtotal=Decimal('0.00'))
+        self.assertSameJSON(render_cart_item(removed), CartItemSerializer(removed).data)
+
+    def test_product_change_is_rendered_after_invalidation(self):
+        render_cart(self.session, self.session.cart_total)
+        product = Product.objects.get(barcode='1000000000001')
+        product.name = 'Whole milk'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertSameJSON(render_cart(self.session, self.session.cart_total), self._serializer_cart())
+
+    def test_compact_cart_expands_to_full_cart(self):
+        compact = render_cart_compact(self.session, self.session.cart_total)
+        self.assertEqual(len(compact['products']), 4)
+        expanded = {
+            'items': [
+                {'product': compact['products'][item['barcode']], 'quantity': item['quantity'], 'subtotal': item['subtotal']}
+                for item in compact['items']
+            ],
+            'total': compact['total'],
+        }
+        self.assertSameJSON(expanded, self._serializer_cart())
+
+    def test_cart_view_response_unchanged(self):
+        response = self.client.get('/api/cart/view', {'session_id': str(self.session.session_id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, json.dumps(self._serializer_cart(), separators=(',', ':'), ensure_ascii=False).encode())
+
+
+# Most queries each hot endpoint may run with warm caches. Lower a number when
+# a change saves queries; raising one should be a deliberate trade-off.
+QUERY_BUDGETS = {
+    'session-start': 3,
+    'session-heartbeat': 1,
+    'cart-scan-new-line': 6,
+    'cart-scan': 5,
+    'cart-scan-by-trolley': 6,
+    'cart-scan-batch': 8,
+    'cart-remove': 7,
+    'cart-remove-last': 8,
+    'cart-view': 2,
+    'cart-view-not-modified': 1,
+    'payment-create': 7,
+    'payment-confirm': 6,
+    'session-end': 4,
+}
+
+
+def explain_full_scans(sql, params):
+    """Full table scans in the plan of one statement, as readable strings.
+
+    SQLite reports ``SCAN <table>`` for any scan of a whole table or index. On
+    MySQL a scan (``type = ALL``) only counts when no index could have been
+    used, since the optimiser may prefer scanning a test-sized table.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall() if row[-1].startswith('SCAN ')]
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0].lower() for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return [f"{row['table']} ({row['extra']})" for row in rows if row['type'] == 'ALL' and not row['possible_keys']]
+
+
+class HotPathQueryTests(TestCase):
+    """Query counts and plans of the endpoints trolleys and phones call constantly."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.trolley = Trolley.objects.create(trolley_id='PLAN_TROLLEY', last_seen=now)
+        Trolley.objects.bulk_create([Trolley(trolley_id=f'PLAN_OTHER_{index}', last_seen=now) for index in range(20)])
+        cls.products = Product.objects.bulk_create([
+            Product(barcode=f'20000000000{index:02d}', name=f'Plan product {index}', price=Decimal('10.00') + index, category='Plan')
+            for index in range(20)
+        ])
+        cls.user = User.objects.create(name='Plan user', phone_number='9000000001')
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest(f'EXPLAIN parsing is not implemented for {connection.vendor}')
+        # Keep background work out of the measured requests: no fleet refresh
+        # between requests and activity written by the tracker's own thread.
+        fleet = get_fleet()
+        for patcher in (
+            mock.patch.object(fleet, 'refresh_interval', 3600),
+            mock.patch.object(get_activity_tracker(), 'flush_interval', 3600),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        fleet.invalidate()
+        fleet.get(self.trolley.trolley_id)
+        get_catalog().invalidate()
+        for product in self.products:
+            get_catalog().get(product.barcode)
+
+    @contextmanager
+    def assertHotPath(self, name):
+        """Run the block, then check its query count and every statement's plan."""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params, many))
+            return execute(sql, params, many, context)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with connection.execute_wrapper(record):
+                yield
+        queries = [
+            (sql, params) for sql, params, many in statements
+            if sql.lstrip().split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT')
+        ]
+        self.assertLessEqual(
+            len(queries), QUERY_BUDGETS[name],
+            f'{name} ran {len(queries)} queries, budget {QUERY_BUDGETS[name]}:\n'
+            + '\n'.join(sql for sql, _ in queries),
+        )
+        for sql, params in queries:
+            if sql.lstrip().upper().startswith('INSERT'):
+                continue
+            scans = explain_full_scans(sql, params)
+            self.assertFalse(scans, f'{name} scans a whole table ({", ".join(scans)}):\n{sql}')
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response.json()
+
+    def start(self):
+        return self.post('/api/session/start', {'trolley_id': self.trolley.trolley_id})['session_id']
+
+    def scan(self, session_id, product):
+        return self.post('/api/cart/scan', {'session_id': session_id, 'barcode': product.barcode})
+
+    def test_explain_reports_full_scans(self):
+        sql, params = Product.objects.filter(category='Plan').values_list('pk').query.sql_with_params()
+        self.assertTrue(explain_full_scans(sql, params))
+
+    def test_session_start(self):
+        with self.assertHotPath('session-start'):
+            self.post('/api/session/start', {'trolley_id': self.trolley.trolley_id, 'user_id': str(self.user.user_id)})
+
+    def test_heartbeat(self):
+        session_id = self.start()
+        with self.assertHotPath('session-heartbeat'):
+            self.post('/api/session/heartbeat', {'session_id': session_id})
+
+    def test_cart_scan(self):
+        session_id = self.start()
+        self.scan(session_id, self.products[0])
+        with self.assertHotPath('cart-scan-new-line'):
+            self.scan(session_id, self.products[1])
+        with self.assertHotPath('cart-scan'):
+            self.scan(session_id, self.products[1])
+
+    def test_cart_scan_by_trolley(self):
+        self.start()
+        with self.assertHotPath('cart-scan-by-trolley'):
+            self.post('/api/cart/scan', {'trolley_id': self.trolley.trolley_id, 'barcode': self.products[0].barcode})
+
+    def test_cart_scan_batch(self):
+        session_id = self.start()
+        items = [{'client_seq': index, 'barcode': product.barcode} for index, product in enumerate(self.products[:5])]
+        with self.assertHotPath('cart-scan-batch'):
+            self.post('/api/cart/scan/batch', {'session_id': session_id, 'items': items})
+
+    def test_cart_remove(self):
+        session_id = self.start()
+        self.scan(session_id, self.products[0])
+        self.scan(session_id, self.products[0])
+        with self.assertHotPath('cart-remove'):
+            self.post('/api/cart/remove', {'session_id': session_id, 'barcode': self.products[0].barcode})
+        with self.assertHotPath('cart-remove-last'):
+            self.post('/api/cart/remove', {'session_id': session_id, 'barcode': self.products[0].barcode})
+
+    def test_cart_view(self):
+        session_id = self.start()
+        for product in self.products[:5]:
+            self.scan(session_id, product)
+        with self.assertHotPath('cart-view'):
+            response = self.client.get('/api/cart/view', {'session_id': session_id})
+        self.assertEqual(len(response.json()['items']), 5)
+        with self.assertHotPath('cart-view-not-modified'):
+            response = self.client.get('/api/cart/view', {'session_id': session_id}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_payment(self):
+        session_id = self.start()
+        self.scan(session_id, self.products[0])
+        with self.assertHotPath('payment-create'):
+            self.post('/api/payment/create', {'session_id': session_id})
+        with self.assertHotPath('payment-confirm'):
+            self.post('/api/payment/confirm', {'session_id': session_id})
+
+    def test_session_end(self):
+        session_id = self.start()
+        self.scan(session_id, self.products[0])
+        with self.assertHotPath('session-end'):
+            self.post('/api/session/end', {'session_id': session_id})
+
+
+BARCODE = '3000000000001'
+
+
+def _jpeg(seed):
+    image = Image.new('L', (64, 48))
+    image.putdata([(x * seed + y * 7) % 256 for y in range(48) for x in range(64)])
+    output = BytesIO()
+    image.save(output, 'JPEG')
+    return output.getvalue()
+
+
+class FrameDedupTests(TestCase):
+    """Repeated camera frames are decoded once and their item added once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='FRAME_TROLLEY', last_seen=timezone.now())
+
+    def setUp(self):
+        # A fresh cache per test, and a decoder that "sees" BARCODE in any frame
+        for patcher in (
+            mock.patch('api.frame_cache._frame_cache', None),
+            mock.patch('api.views.decode_barcode', return_value=DecodeResult(BARCODE, 'EAN13', 5.0)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        get_catalog().invalidate()
+        response = self.client.post('/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json')
+        self.session_id = response.json()['session_id']
+
+    def scan_frame(self, frame):
+        return self.client.post('/api/cart/scan', {
+            'session_id': self.session_id,
+            'barcode_image': SimpleUploadedFile('frame.jpg', frame, content_type='image/jpeg'),
+        })
+
+    def test_failed_add_is_retried(self):
+        frame = _jpeg(3)
+        self.assertEqual(self.scan_frame(frame).status_code, 404)
+        Product.objects.create(barcode=BARCODE, name='Frame product', price=Decimal('10.00'), category='Frame')
+        get_catalog().invalidate()
+        response = self.scan_frame(frame)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['items'][0]['quantity'], 1)
+        self.assertEqual(self.scan_frame(frame).status_code, 409)
+        self.assertEqual(CartItem.objects.get(session_id=self.session_id).quantity, 1)
+
+    def test_raw_scan_endpoint(self):
+        Product.objects.create(barcode=BARCODE, name='Frame product', price=Decimal('10.00'), category='Frame')
+        get_catalog().invalidate()
+        path = f'/api/barcode/scan?session_id={self.session_id}'
+        response = self.client.post(path, _jpeg(3), content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['barcode'], BARCODE)
+        self.assertFalse(response.json()['duplicate'])
+        self.assertEqual(response.json()['cart']['total'], '10.00')
+
+        # The same shot with a little sensor noise is recognised without decoding
+        image = Image.open(BytesIO(_jpeg(3)))
+        image.putpixel((10, 10), 255 - image.getpixel((10, 10)))
+        noisy = BytesIO()
+        image.save(noisy, 'JPEG')
+        response = self.client.post(path, noisy.getvalue(), content_type='image/jpeg')
+        self.assertTrue(response.json()['duplicate'])
+        self.assertNotIn('cart', response.json())
+        self.assertEqual(get_frame_cache().stats()['hits'], 1)
+        self.assertEqual(CartItem.objects.get(session_id=self.session_id).quantity, 1)
+
+        response = self.client.post(path, {'barcode': BARCODE}, content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+
+    def test_next_session_on_trolley_starts_clean(self):
+        Product.objects.create(barcode=BARCODE, name='Frame product', price=Decimal('10.00'), category='Frame')
+        get_catalog().invalidate()
+        path = f'/api/barcode/scan?trolley_id={self.trolley.trolley_id}'
+        self.assertIn('cart', self.client.post(path, _jpeg(3), content_type='image/jpeg').json())
+        self.assertTrue(self.client.post(path, _jpeg(3), content_type='image/jpeg').json()['duplicate'])
+
+        self.client.post('/api/session/end', {'session_id': self.session_id}, content_type='application/json')
+        response = self.client.post('/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json')
+        next_session = response.json()['session_id']
+        # Same frame within the debounce window, but it's a new shopper's cart
+        response = self.client.post(path, _jpeg(3), content_type='image/jpeg')
+        self.assertFalse(response.json()['duplicate'])
+        self.assertEqual(CartItem.objects.get(session_id=next_session).quantity, 1)
+
+    def test_frame_in_view_stays_cached(self):
+        frame_cache = FrameCache(max_trolleys=8, frames_per_trolley=4, ttl=15, max_distance=4, debounce=5)
+        result = DecodeResult(BARCODE, 'EAN13', 5.0)
+        with mock.patch('api.frame_cache.time.monotonic') as monotonic:
+            monotonic.return_value = 0.0
+            frame_cache.remember('trolley:T', 0b1010, result)
+            # Seen every 10 s, so never older than the 15 s TTL
+            for now in (10.0, 20.0, 30.0):
+                monotonic.return_value = now
+                self.assertEqual(frame_cache.lookup('trolley:T', 0b1011), result)
+            monotonic.return_value = 46.0
+            self.assertIsNone(frame_cache.lookup('trolley:T', 0b1010))
+
+
+class ReaperTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.trolleys = Trolley.objects.bulk_create([
+            Trolley(trolley_id=f'REAP_TROLLEY_{index}', is_assigned=True, last_seen=now) for index in range(4)
+        ])
+
+    def session(self, trolley, idle_seconds, is_active=True):
+        return Session.objects.create(
+            trolley=trolley, is_active=is_active, last_activity=timezone.now() - timedelta(seconds=idle_seconds),
+        )
+
+    def test_grace_period(self):
+        grace = settings.ACTIVITY_FLUSH_INTERVAL_SECONDS + settings.ACTIVITY_WRITE_GRANULARITY_SECONDS
+        # Timed out, but a touch other workers haven't flushed could still be pending
+        within_grace = self.session(self.trolleys[0], 30 + grace / 2)
+        past_grace = self.session(self.trolleys[1], 30 + grace + 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = reap_expired_sessions(30, batch_size=10)
+        self.assertEqual(result.sessions, 1)
+        self.assertTrue(Session.objects.get(pk=within_grace.pk).is_active)
+        self.assertFalse(Session.objects.get(pk=past_grace.pk).is_active)
+        self.assertFalse(Trolley.objects.get(pk=self.trolleys[1].pk).is_assigned)
+
+    def test_ended_events_only_for_expired_sessions(self):
+        live = self.session(self.trolleys[0], 600)
+        already_ended = self.session(self.trolleys[1], 600, is_active=False)
+        with mock.patch('api.reaper.publish_on_commit') as publish, transaction.atomic():
+            sessions, _, trolleys = expire_sessions([live.session_id, already_ended.session_id])
+        self.assertEqual((sessions, trolleys), (1, 1))
+        self.assertEqual([call.args[0] for call in publish.call_args_list], [live.session_id])
+        self.assertTrue(Trolley.objects.get(pk=self.trolleys[1].pk).is_assigned)
+
+
+    def test_bulk_end_closes_only_expired_sessions(self):
+        product = Product.objects.create(barcode='5000000000001', name='Reaped', price=Decimal('4.00'), category='Misc')
+        expired = [self.session(self.trolleys[0], 600), self.session(self.trolleys[1], 900)]
+        live = self.session(self.trolleys[2], 5)
+        ended = self.session(self.trolleys[3], 900, is_active=False)
+        for session in (*expired, live):
+            CartItem.objects.create(session=session, product=product, quantity=1, subtotal=product.price)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = reap_expired_sessions(30, batch_size=1)
+        self.assertEqual((result.sessions, result.cart_items, result.trolleys), (2, 2, 2))
+        for session in expired:
+            self.assertFalse(Session.objects.get(pk=session.pk).is_active)
+            self.assertFalse(Trolley.objects.get(pk=session.trolley_id).is_assigned)
+        self.assertTrue(Session.objects.get(pk=live.pk).is_active)
+        self.assertTrue(Trolley.objects.get(pk=self.trolleys[2].pk).is_assigned)
+        self.assertEqual(CartItem.objects.get().session_id, live.session_id)
+        self.assertEqual(Session.objects.get(pk=ended.pk).cart_version, ended.cart_version)
+
+    def test_read_path_expires_only_timed_out_sessions(self):
+        live = self.session(self.trolleys[0], 5)
+        stale = self.session(self.trolleys[1], 600)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_session(live.session_id, 30).cart_version, live.cart_version)
+        with self.assertRaisesMessage(ValidationError, 'Session expired'):
+            get_session(stale.session_id, 30)
+        self.assertFalse(Session.objects.get(pk=stale.pk).is_active)
+        self.assertFalse(Trolley.objects.get(pk=self.trolleys[1].pk).is_assigned)
+        self.assertTrue(Session.objects.get(pk=live.pk).is_active)
+        self.assertTrue(Trolley.objects.get(pk=self.trolleys[0].pk).is_assigned)
+        with self.assertRaisesMessage(ValidationError, 'Session is inactive'):
+            get_session(stale.session_id, 30)
+
+class ActivityTrackerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='ACTIVITY_TROLLEY', is_assigned=True, last_seen=timezone.now())
+
+    def setUp(self):
+        self.tracker = ActivityTracker(flush_interval=60, granularity=1)
+        # Flush by hand instead of from the background thread
+        patcher = mock.patch.object(self.tracker, '_ensure_thread')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        start = timezone.now().replace(microsecond=0)
+        self.start = start
+        self.session = Session.objects.create(trolley=self.trolley, last_activity=start - timedelta(minutes=1))
+
+    def test_touches_coalesce_into_one_update(self):
+        for seconds in (1, 5, 3):
+            self.tracker.touch(self.session, self.start + timedelta(seconds=seconds))
+        # One UPDATE for the session and one for its trolley
+        with self.assertNumQueries(2):
+            self.assertEqual(self.tracker.flush(), 1)
+        self.assertEqual(Session.objects.get(pk=self.session.pk).last_activity, self.start + timedelta(seconds=5))
+        self.assertEqual(self.tracker.stats()['pending'], 0)
+
+    def test_flush_leaves_ended_session_alone(self):
+        for touched_after in (-2, 2):
+            with self.subTest(touched_after=touched_after):
+                ended_at = self.start + timedelta(seconds=10)
+                self.tracker.touch(self.session, ended_at + timedelta(seconds=touched_after))
+                # Another worker ends the session before this one flushes
+                Session.objects.filter(pk=self.session.pk).update(is_active=False, last_activity=ended_at)
+                self.tracker.flush()
+                session = Session.objects.get(pk=self.session.pk)
+                self.assertFalse(session.is_active)
+                self.assertEqual(session.last_activity, ended_at)
+
+    def test_discarded_touch_is_not_written(self):
+        self.tracker.touch(self.session, self.start)
+        self.tracker.discard(self.session.session_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.tracker.flush(), 0)
+
+class BatchScanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='BATCH_TROLLEY', last_seen=timezone.now())
+        cls.milk = Product.objects.create(barcode='4000000000001', name='Milk', price=Decimal('10.00'), category='Dairy')
+        cls.bread = Product.objects.create(barcode='4000000000002', name='Bread', price=Decimal('20.00'), category='Bakery')
+        cls.retired = Product.objects.create(
+            barcode='4000000000003', name='Retired', price=Decimal('5.00'), category='Misc', is_active=False,
+        )
+
+    def setUp(self):
+        get_catalog().invalidate()
+        response = self.client.post('/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json')
+        self.session_id = response.json()['session_id']
+
+    def batch(self, items):
+        response = self.client.post(
+            '/api/cart/scan/batch', {'session_id': self.session_id, 'items': items}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        return {result['client_seq']: result['status'] for result in body['results']}, body['cart']
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(session_id=self.session_id).values_list('product__barcode', 'quantity'))
+
+    def test_resent_batch_is_not_counted_twice(self):
+        items = [
+            {'client_seq': 1, 'barcode': self.milk.barcode, 'qty': 2},
+            {'client_seq': 2, 'barcode': self.bread.barcode},
+        ]
+        statuses, cart = self.batch(items)
+        self.assertEqual(statuses, {1: 'added', 2: 'added'})
+        self.assertEqual(cart['total'], '40.00')
+
+        statuses, cart = self.batch(items + [{'client_seq': 3, 'barcode': self.milk.barcode}])
+        self.assertEqual(statuses, {1: 'duplicate', 2: 'duplicate', 3: 'added'})
+        self.assertEqual(cart['total'], '50.00')
+        self.assertEqual(self.quantities(), {self.milk.barcode: 3, self.bread.barcode: 1})
+        self.assertEqual(Session.objects.get(pk=self.session_id).cart_total, Decimal('50.00'))
+
+    def test_unknown_and_inactive_barcodes(self):
+        statuses, cart = self.batch([
+            {'client_seq': 1, 'barcode': self.milk.barcode},
+            {'client_seq': 2, 'barcode': '4999999999999'},
+            {'client_seq': 3, 'barcode': self.retired.barcode},
+        ])
+        self.assertEqual(statuses, {1: 'added', 2: 'not_found', 3: 'not_found'})
+        self.assertEqual(self.quantities(), {self.milk.barcode: 1})
+        self.assertEqual(cart['total'], '10.00')
+        # Nothing was recorded for the rejected lines, so they apply once the product exists
+        Product.objects.filter(pk=self.retired.pk).update(is_active=True)
+        statuses, _ = self.batch([{'client_seq': 3, 'barcode': self.retired.barcode}])
+        self.assertEqual(statuses, {3: 'added'})
+
+
+class IdempotencyTests(TestCase):
+    """Retries with the same Idempotency-Key replay the first response instead of running again."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='IDEM_TROLLEY', last_seen=timezone.now())
+        cls.product = Product.objects.create(barcode=BARCODE, name='Idem product', price=Decimal('12.50'), category='Idem')
+
+    def setUp(self):
+        get_catalog().invalidate()
+        response = self.client.post('/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json')
+        self.session_id = response.json()['session_id']
+        self.key = str(uuid.uuid4())
+
+    def post(self, path, data, key=None):
+        return self.client.post(path, data, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key or self.key)
+
+    def test_scan_retry_adds_one_unit(self):
+        data = {'session_id': self.session_id, 'barcode': self.product.barcode}
+        first = self.post('/api/cart/scan', data)
+        retry = self.post('/api/cart/scan', data)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(CartItem.objects.get(session_id=self.session_id).quantity, 1)
+        # A new key is a new scan
+        self.post('/api/cart/scan', data, key=str(uuid.uuid4()))
+        self.assertEqual(CartItem.objects.get(session_id=self.session_id).quantity, 2)
+
+    def test_payment_retry_creates_one_payment(self):
+        self.post('/api/cart/scan', {'session_id': self.session_id, 'barcode': self.product.barcode}, key=str(uuid.uuid4()))
+        first = self.post('/api/payment/create', {'session_id': self.session_id})
+        retry = self.post('/api/payment/create', {'session_id': self.session_id})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json()['payment_id'], first.json()['payment_id'])
+        self.assertEqual(Payment.objects.filter(session_id=self.session_id).count(), 1)
+
+    def test_key_reused_for_another_body(self):
+        self.post('/api/cart/scan', {'session_id': self.session_id, 'barcode': self.product.barcode})
+        response = self.post('/api/cart/scan', {'session_id': self.session_id, 'barcode': '4999999999999'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CartItem.objects.get(session_id=self.session_id).quantity, 1)
+
+    def test_retry_while_first_request_runs(self):
+        store = get_idempotency_store()
+        # Hold the key as a first request still in flight would
+        self.assertTrue(store.acquire(f'/api/cart/scan:{self.key}'))
+        self.addCleanup(store.release, f'/api/cart/scan:{self.key}')
+        with mock.patch.object(store, 'lock_timeout', 0.1):
+            response = self.post('/api/cart/scan', {'session_id': self.session_id, 'barcode': self.product.barcode})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(CartItem.objects.filter(session_id=self.session_id).exists())
+
+    def test_async_retry_is_replayed(self):
+        calls = []
+
+        @api_errors
+        @aidempotent
+        async def view(request):
+            calls.append(request)
+            return JsonResponse({'call': len(calls)}, status=201)
+
+        factory = RequestFactory()
+
+        def request(body):
+            return factory.post('/api/async/test', body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=self.key)
+
+        first = async_to_sync(view)(request({'barcode': BARCODE}))
+        retry = async_to_sync(view)(request({'barcode': BARCODE}))
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content), {'call': 1})
+        self.assertEqual(async_to_sync(view)(request({'barcode': '4999999999999'})).status_code, 422)
+        self.assertEqual(len(calls), 1)
+
+
+class CartMutationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='MUTATION_TROLLEY', last_seen=timezone.now())
+        cls.product = Product.objects.create(barcode=BARCODE, name='Mutation product', price=Decimal('10.00'), category='Misc')
+
+    def setUp(self):
+        get_catalog().invalidate()
+        self.session_id = self.post('/api/session/start', {'trolley_id': self.trolley.trolley_id})['session_id']
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response.json()
+
+    def scan(self):
+        return self.post('/api/cart/scan', {'session_id': self.session_id, 'barcode': self.product.barcode})
+
+    def remove(self):
+        return self.post('/api/cart/remove', {'session_id': self.session_id, 'barcode': self.product.barcode})
+
+    def set_price(self, price):
+        Product.objects.filter(pk=self.product.pk).update(price=price)
+        get_catalog().invalidate()
+
+    def assertTotalMatchesLines(self):
+        session = Session.objects.get(pk=self.session_id)
+        self.assertEqual(session.cart_total, recalculate_cart_total(session))
+
+    def test_remove_after_price_change(self):
+        self.scan()
+        self.scan()
+        self.set_price(Decimal('50.00'))
+        cart = self.remove()
+        self.assertEqual(cart['items'][0]['subtotal'], '10.00')
+        self.assertEqual(cart['total'], '10.00')
+        self.assertTotalMatchesLines()
+        self.assertEqual(self.post('/api/payment/create', {'session_id': self.session_id})['total_amount'], '10.00')
+
+    def test_remove_mixed_prices_down_to_empty(self):
+        self.scan()
+        self.set_price(Decimal('15.00'))
+        self.scan()
+        self.scan()
+        for expected in ('26.67', '13.33', '0.00'):
+            self.assertEqual(self.remove()['total'], expected)
+            self.assertTotalMatchesLines()
+
+    def test_running_total_and_deltas_follow_the_cart(self):
+        other = Product.objects.create(barcode='3000000000002', name='Other product', price=Decimal('2.35'), category='Misc')
+        steps = [
+            ('scan', self.product), ('scan', other), ('scan', self.product), ('remove', other),
+            ('price', Decimal('7.15')), ('scan', self.product), ('scan', other),
+            ('remove', self.product), ('remove', self.product), ('remove', self.product), ('scan', other),
+        ]
+        version = Session.objects.get(pk=self.session_id).cart_version
+        with self.settings(CART_TOTAL_MODE='incremental'):
+            for action, argument in steps:
+                with self.subTest(action=action, argument=argument):
+                    if action == 'price':
+                        self.set_price(argument)
+                        continue
+                    delta = self.post(f'/api/cart/{action}', {
+                        'session_id': self.session_id, 'barcode': argument.barcode, 'response_format': 'delta',
+                    })
+                    version += 1
+                    session = Session.objects.get(pk=self.session_id)
+                    self.assertEqual(session.cart_version, version)
+                    self.assertEqual(delta['total'], str(recalculate_cart_total(session)))
+
+                    cart = self.client.get('/api/cart/view', {'session_id': self.session_id}).json()
+                    self.assertEqual(delta['total'], cart['total'])
+                    lines = {item['product']['barcode']: item for item in cart['items']}
+                    if delta['item']['quantity']:
+                        self.assertEqual(delta['item'], lines[argument.barcode])
+                    else:
+                        self.assertNotIn(argument.barcode, lines)
+        self.assertEqual(cart['total'], '4.70')
+
+    def test_cart_events_refused_outside_asgi(self):
+        response = self.client.get('/api/cart/events', {'session_id': self.session_id})
+        self.assertEqual(response.status_code, 501)
+
+    def test_cart_view_etag(self):
+        self.scan()
+        first = self.client.get('/api/cart/view', {'session_id': self.session_id})
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/view', {'session_id': self.session_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self.scan()
+        response = self.client.get('/api/cart/view', {'session_id': self.session_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['items'][0]['quantity'], 2)
+
+        self.post('/api/session/end', {'session_id': self.session_id})
+        response = self.client.get('/api/cart/view', {'session_id': self.session_id}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/cart/view', {'session_id': str(uuid.uuid4())}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_insert_of_a_new_line(self):
+        update = QuerySet.update
+        raced = []
+
+        def inserted_elsewhere(queryset, **kwargs):
+            # Another phone inserts the line after this scan found none
+            if queryset.model is CartItem and not raced:
+                raced.append(True)
+                CartItem.objects.create(
+                    session_id=self.session_id, product=self.product, quantity=1, subtotal=self.product.price,
+                )
+                Session.objects.filter(pk=self.session_id).update(cart_total=F('cart_total') + self.product.price)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=inserted_elsewhere):
+            cart = self.scan()
+        self.assertEqual(cart['items'][0]['quantity'], 2)
+        self.assertEqual(cart['items'][0]['subtotal'], '20.00')
+        self.assertTotalMatchesLines()
+
+
+class ConcurrentScanTests(TransactionTestCase):
+    """Phones scanning into one cart at once; needs a database with row locks."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite':
+            self.skipTest('SQLite locks the whole database, so scans cannot overlap')
+        get_catalog().invalidate()
+        get_fleet().invalidate()
+        self.trolley = Trolley.objects.create(trolley_id='CONCURRENT_TROLLEY', last_seen=timezone.now())
+        self.product = Product.objects.create(barcode=BARCODE, name='Concurrent product', price=Decimal('2.50'), category='Misc')
+
+    def test_concurrent_increments(self):
+        session_id = Client().post(
+            '/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json',
+        ).json()['session_id']
+        threads, scans = 8, 5
+        errors = []
+
+        def phone():
+            client = Client()
+            try:
+                for _ in range(scans):
+                    response = client.post(
+                        '/api/cart/scan', {'session_id': session_id, 'barcode': self.product.barcode},
+                        content_type='application/json',
+                    )
+                    if response.status_code != 200:
+                        errors.append(response.content)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=phone) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        session = Session.objects.get(pk=session_id)
+        self.assertEqual(CartItem.objects.get(session=session).quantity, threads * scans)
+        self.assertEqual(session.cart_total, self.product.price * threads * scans)
+        self.assertEqual(session.cart_total, recalculate_cart_total(session))
+
+
+class SessionStartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='START_TROLLEY', last_seen=timezone.now())
+
+    def setUp(self):
+        fleet = get_fleet()
+        # No refresh between requests, as on a worker whose last refresh was moments ago
+        patcher = mock.patch.object(fleet, 'refresh_interval', 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fleet.invalidate()
+
+    def start(self):
+        return self.client.post('/api/session/start', {'trolley_id': self.trolley.trolley_id}, content_type='application/json')
+
+    def test_reactivated_trolley_starts_with_stale_registry(self):
+        Trolley.objects.filter(pk=self.trolley.pk).update(is_active=False)
+        self.assertFalse(get_fleet().get(self.trolley.trolley_id).is_active)
+        # Reactivated on another worker: last_seen doesn't move and no invalidation arrives here
+        Trolley.objects.filter(pk=self.trolley.pk).update(is_active=True)
+        response = self.start()
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_inactive_trolley_is_refused(self):
+        get_fleet().get(self.trolley.trolley_id)
+        Trolley.objects.filter(pk=self.trolley.pk).update(is_active=False)
+        response = self.start()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'Trolley inactive'})
+        self.assertFalse(Session.objects.filter(trolley=self.trolley).exists())
+
+    def test_claim_refuses_a_busy_trolley(self):
+        session = claim_session(self.trolley.pk)
+        self.assertIsNotNone(session)
+        self.assertTrue(Trolley.objects.get(pk=self.trolley.pk).is_assigned)
+        self.assertIsNone(claim_session(self.trolley.pk))
+        with self.assertRaisesMessage(TrolleyUnavailable, 'Trolley already in use'):
+            start_session(self.trolley.pk, 30)
+        response = self.start()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'Trolley already in use'})
+        self.assertEqual(list(Session.objects.filter(trolley=self.trolley, is_active=True)), [session])
+
+    def test_claim_refuses_an_inactive_trolley(self):
+        Trolley.objects.filter(pk=self.trolley.pk).update(is_active=False)
+        self.assertIsNone(claim_session(self.trolley.pk))
+        with self.assertRaisesMessage(TrolleyUnavailable, 'Trolley inactive'):
+            start_session(self.trolley.pk, 30)
+        self.assertFalse(Trolley.objects.get(pk=self.trolley.pk).is_assigned)
+        self.assertFalse(Session.objects.filter(trolley=self.trolley).exists())
+
+
+class ProvisioningTests(TestCase):
+    def test_parse_ranges(self):
+        self.assertEqual(parse_trolley_ids('T001..T003,T002,X'), ['T001', 'T002', 'T003', 'X'])
+        self.assertEqual(parse_trolley_ids('T001-T010'), [f'T{number:03d}' for number in range(1, 11)])
+        self.assertEqual(parse_trolley_ids('T8..T11'), ['T8', 'T9', 'T10', 'T11'])
+        # A dash without the prefix repeated is part of an id
+        self.assertEqual(parse_trolley_ids('BAY-2,T001-X010'), ['BAY-2', 'T001-X010'])
+
+    def test_parse_rejects_bad_ranges(self):
+        for spec in ('T001..X010', 'T001..T0010', 'T001-T1000', 'T010..T001', 'T010-T001', 'T001..'):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_trolley_ids(spec)
+
+    def test_create_counts_only_inserted_rows(self):
+        Trolley.objects.create(trolley_id='PROV_001', last_seen=timezone.now())
+        bulk_create = Trolley.objects.bulk_create
+
+        def raced(objs, **kwargs):
+            # Another run inserts PROV_003 between the existence check and the insert
+            Trolley.objects.create(trolley_id='PROV_003', last_seen=timezone.now() - timedelta(seconds=1))
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Trolley.objects, 'bulk_create', side_effect=raced):
+            created = create_trolleys(parse_trolley_ids('PROV_001..PROV_004'))
+        self.assertEqual(created, 2)
+        self.assertEqual(Trolley.objects.filter(trolley_id__startswith='PROV_').count(), 4)
+
+
+
+class ImportProductsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.milk = Product.objects.create(barcode='7000000000001', name='Milk', price=Decimal('40.00'), category='Dairy')
+
+    def rows(self, *raws):
+        return list(enumerate(raws, start=2))
+
+    def test_upsert_creates_updates_and_skips_unchanged(self):
+        result = import_products(self.rows(
+            {'barcode': '7000000000001', 'price': '42.50'},
+            {'barcode': '7000000000002', 'name': 'Bread', 'price': '25', 'category': 'Bakery'},
+            {'barcode': '7000000000002', 'name': 'Bread', 'price': '25', 'category': 'Bakery', 'is_active': 'no'},
+        ))
+        self.assertEqual((result.created, result.updated, result.unchanged, result.invalid), (1, 1, 0, 0))
+        milk = Product.objects.get(barcode='7000000000001')
+        # Columns missing from the row keep their stored values
+        self.assertEqual((milk.name, milk.price, milk.category), ('Milk', Decimal('42.50'), 'Dairy'))
+        # The last row for a repeated barcode wins
+        self.assertFalse(Product.objects.get(barcode='7000000000002').is_active)
+
+        result = import_products(self.rows({'barcode': '7000000000001', 'price': '42.50'}))
+        self.assertEqual((result.updated, result.unchanged), (0, 1))
+
+    def test_dry_run_reports_without_writing(self):
+        changes = []
+        result = import_products(
+            self.rows({'barcode': '7000000000001', 'name': 'Whole milk'}, {'barcode': '7000000000003', 'name': 'Jam', 'price': '3'}),
+            dry_run=True,
+            on_change=lambda line, barcode, before, after: changes.append((line, barcode, before and before['name'], after['name'])),
+        )
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual(changes, [(2, '7000000000001', 'Milk', 'Whole milk'), (3, '7000000000003', None, 'Jam')])
+        self.assertEqual(Product.objects.get(barcode='7000000000001').name, 'Milk')
+        self.assertFalse(Product.objects.filter(barcode='7000000000003').exists())
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        result = import_products(self.rows(
+            {'name': 'No barcode', 'price': '1'},
+            {'barcode': '7000000000004', 'name': 'Cheap', 'price': '-1'},
+            {'barcode': '7000000000005', 'price': '2.00'},
+            {'barcode': '7000000000006', 'name': 'Fine', 'price': '1.999'},
+            {'barcode': '7000000000007', 'name': 'Good', 'price': '2.00', 'is_active': 'maybe'},
+            {'barcode': '7000000000008', 'name': 'Good', 'price': '2.00'},
+        ))
+        self.assertEqual((result.rows, result.created, result.invalid), (6, 1, 5))
+        self.assertEqual([error['line'] for error in result.errors], [2, 3, 5, 6, 4])
+        created = Product.objects.filter(barcode__startswith='70000000000').exclude(pk=self.milk.pk)
+        self.assertEqual(list(created.values_list('barcode', flat=True)), ['7000000000008'])
+
+    def test_seed_keeps_admin_edits(self):
+        call_command('seed_products', stdout=StringIO())
+        Product.objects.filter(barcode='8901234000001').update(price=Decimal('38.00'), name='Amul Milk 500ml (edited)')
+        out = StringIO()
+        call_command('seed_products', stdout=out)
+        product = Product.objects.get(barcode='8901234000001')
+        self.assertEqual((product.name, product.price), ('Amul Milk 500ml (edited)', Decimal('38.00')))
+        self.assertIn('0 new products added, 30 already present', out.getvalue())
+
+class SalesExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trolley = Trolley.objects.create(trolley_id='EXPORT_TROLLEY', last_seen=timezone.now())
+        cls.milk = Product.objects.create(barcode='5000000000001', name='Milk', price=Decimal('45.00'), category='Dairy')
+        cls.bread = Product.objects.create(barcode='5000000000002', name='Bread', price=Decimal('30.00'), category='Bakery')
+
+    def setUp(self):
+        get_catalog().invalidate()
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response.json()
+
+    def test_confirmed_payment_keeps_its_lines(self):
+        session_id = self.post('/api/session/start', {'trolley_id': self.trolley.trolley_id})['session_id']
+        for product in (self.milk, self.milk, self.bread):
+            self.post('/api/cart/scan', {'session_id': session_id, 'barcode': product.barcode})
+        self.post('/api/payment/create', {'session_id': session_id})
+        self.post('/api/payment/confirm', {'session_id': session_id})
+        self.assertFalse(CartItem.objects.filter(session_id=session_id).exists())
+
+        output = StringIO()
+        result = export_sales(output, 'csv')
+        rows = list(csv.DictReader(StringIO(output.getvalue())))
+        self.assertEqual((result.payments, result.rows), (1, 2))
+        self.assertEqual({row['payment_status'] for row in rows}, {'SUCCESS'})
+        self.assertEqual(
+            sorted((row['barcode'], row['product_name'], row['category'], row['quantity'], row['line_subtotal']) for row in rows),
+            [('5000000000001', 'Milk', 'Dairy', '2', '90.00'), ('5000000000002', 'Bread', 'Bakery', '1', '30.00')],
+        )
+        self.assertEqual({row['payment_total'] for row in rows}, {'120.00'})
+
+
+class DecodingTests(TestCase):
+    def test_pool_matches_in_process_decoding(self):
+        rng = np.random.default_rng(7)
+        frames = [render_ean13_jpeg(code, rng=rng) for code in ('5901234123457', '4006381333931')] + [_jpeg(3)]
+        inline = DecodeEngine(workers=0, max_pending=4, timeout=10, retry_after=1, ladder=('gray', 'roi', 'threshold'))
+        pooled = DecodeEngine(workers=1, max_pending=4, timeout=30, retry_after=1, ladder=('gray', 'roi', 'threshold'))
+        self.addCleanup(pooled.shutdown)
+        for frame in frames:
+            expected, actual = inline.decode(frame), pooled.decode(frame)
+            self.assertEqual((actual.barcode, actual.symbology), (expected.barcode, expected.symbology))
+        self.assertEqual(pooled.stats()['decoded'], inline.stats()['decoded'])
+        self.assertEqual(pooled.stats()['pending'], 0)
+
+    def test_ladder_stops_at_first_decoding_rung(self):
+        decoding._init_worker()
+        seen = []
+
+        def fake_decode(pixels):
+            seen.append(pixels.shape)
+            if len(seen) < 2:
+                return []
+            return [SimpleNamespace(data=b'5901234123457', type='EAN13')]
+
+        with mock.patch.object(decoding, '_zbar_decode', fake_decode):
+            barcode, symbology, _, steps = decoding.decode_image_bytes(_jpeg(3), ('gray', 'roi', 'threshold'))
+        self.assertEqual((barcode, symbology), ('5901234123457', 'EAN13'))
+        self.assertEqual([step for step, _ in steps], ['gray', 'roi'])
+        self.assertEqual(len(seen), 2)
+
+    def test_ladder_reports_every_rung_when_nothing_decodes(self):
+        decoding._init_worker()
+        with mock.patch.object(decoding, '_zbar_decode', return_value=[]):
+            barcode, symbology, _, steps = decoding.decode_image_bytes(_jpeg(3), ('gray', 'downscale', 'threshold'))
+        self.assertEqual((barcode, symbology), (None, None))
+        self.assertEqual([step for step, _ in steps], ['gray', 'downscale', 'threshold'])
+
+
+class CatalogCacheTests(TestCase):
+    def catalog(self, warmup='full', negative_ttl=30.0):
+        return CatalogCache(warmup=warmup, max_size=100, version_check_interval=0, negative_ttl=negative_ttl)
+
+    def test_invalidation_reaches_other_processes(self):
+        product = Product.objects.create(barcode='6000000000001', name='Tea', price=Decimal('3.00'), category='Drinks')
+        writer, reader = self.catalog(), self.catalog()
+        self.assertEqual(reader.get(product.barcode).price, Decimal('3.00'))
+        Product.objects.filter(pk=product.pk).update(price=Decimal('4.00'))
+        self.assertEqual(reader.get(product.barcode).price, Decimal('3.00'))
+        writer.invalidate()
+        self.assertEqual(reader.get(product.barcode).price, Decimal('4.00'))
+
+    def test_full_mode_miss_falls_back_to_database(self):
+        catalog = self.catalog()
+        catalog.warm()
+        # bulk_create sends no signals, like a write whose invalidation hasn't arrived yet
+        Product.objects.bulk_create([Product(barcode='6000000000002', name='Jam', price=Decimal('2.50'), category='Pantry')])
+        self.assertEqual(catalog.get('6000000000002').name, 'Jam')
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get('6000000000002').name, 'Jam')
+
+    def test_unknown_barcodes_expire(self):
+        for barcode, warmup in (('6000000000103', 'full'), ('6000000000104', 'lazy')):
+            with self.subTest(warmup=warmup):
+                catalog = self.catalog(warmup)
+                self.assertIsNone(catalog.get(barcode))
+                Product.objects.bulk_create([Product(barcode=barcode, name='Late', price=Decimal('1.00'), category='Misc')])
+                with self.assertNumQueries(0):
+                    self.assertIsNone(catalog.get(barcode))
+                later = time.monotonic() + 31
+                with mock.patch('api.catalog.time.monotonic', return_value=later):
+                    self.assertEqual(catalog.get(barcode).name, 'Late')
+
+    def test_warns_about_process_local_cache_in_production(self):
+        with self.settings(DEBUG=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['api.W001'])
+        with self.settings(DEBUG=False, CACHES={**settings.CACHES, 'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class MonitoringAccessTests(TestCase):
+    paths = ('/api/stats', '/api/metrics', '/api/fleet/status')
+
+    def assertStatus(self, expected, **extra):
+        for path in self.paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, **extra).status_code, expected)
+
+    def test_anonymous_requests_are_refused(self):
+        self.assertStatus(403)
+        with self.settings(MONITORING_TOKEN='s3cret'):
+            self.assertStatus(403, HTTP_AUTHORIZATION='Bearer wrong')
+
+    def test_staff_token_and_allowed_address(self):
+        staff = get_user_model().objects.create_user('ops', password='ops', is_staff=True)
+        self.client.force_login(staff)
+        self.assertStatus(200)
+        self.client.logout()
+        with self.settings(MONITORING_TOKEN='s3cret'):
+            self.assertStatus(200, HTTP_AUTHORIZATION='Bearer s3cret')
+        with self.settings(MONITORING_ALLOWED_IPS=['10.0.0.5']):
+            self.assertStatus(200, REMOTE_ADDR='10.0.0.5')
+            self.assertStatus(403, REMOTE_ADDR='10.0.0.6')
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('smarttrolley.db.mysql_pool.pool.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.opened = []
+        self.ping_error = None
+
+    def connect(self):
+        connection = _FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def ping(self, connection):
+        if self.ping_error:
+            raise self.ping_error
+
+    def pool(self, **options):
+        return ConnectionPool(self.connect, self.ping, **{'max_size': 2, 'check_interval': 30, 'max_lifetime': 1800, **options})
+
+    def test_checkout_times_out_when_pool_is_full(self):
+        pool = self.pool(max_size=1, timeout=0)
+        connection, reused = pool.acquire()
+        self.assertFalse(reused)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.release(connection)
+        self.assertEqual(pool.acquire(), (connection, True))
+
+    def test_connection_failing_ping_is_replaced(self):
+        pool = self.pool()
+        first, _ = pool.acquire()
+        pool.release(first)
+        self.now += 31
+        self.ping_error = OSError('gone away')
+        second, reused = pool.acquire()
+        self.assertFalse(reused)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual((pool.stats()['health_check_failures'], pool.size), (1, 1))
+
+    def test_connections_past_max_lifetime_are_replaced(self):
+        pool = self.pool()
+        first, _ = pool.acquire()
+        pool.release(first)
+        self.now += 1801
+        second, reused = pool.acquire()
+        self.assertFalse(reused)
+        self.assertTrue(first.closed)
+        # Also when the lifetime runs out while checked out
+        self.now += 1801
+        pool.release(second)
+        self.assertTrue(second.closed)
+        self.assertEqual((pool.stats()['expired'], pool.size), (2, 0))
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = self.pool(max_size=1, timeout=0)
+        with mock.patch.object(pool, '_connect', side_effect=OSError('refused')):
+            with self.assertRaises(OSError):
+                pool.acquire()
+            pool.min_size = 1
+            with self.assertLogs('smarttrolley.db.mysql_pool.pool', 'ERROR'):
+                pool.prefill()
+        self.assertEqual((pool.size, pool.stats()['connect_errors']), (0, 2))
+        connection, _ = pool.acquire()
+        self.assertIs(connection, self.opened[0])
+
+    @skipUnless(importlib.util.find_spec('MySQLdb'), 'needs mysqlclient')
+    def test_release_rolls_back_open_transaction(self):
+        from smarttrolley.db.mysql_pool.base import DatabaseWrapper
+
+        pool = self.pool()
+        connection, _ = pool.acquire()
+        wrapper = SimpleNamespace(
+            connection=connection, pool=pool, errors_occurred=False, in_atomic_block=True, get_autocommit=lambda: False,
+        )
+        DatabaseWrapper._close(wrapper)
+        self.assertEqual((connection.rollbacks, connection.closed), (1, False))
+        self.assertEqual(pool.acquire(), (connection, True))
 
-# Create your tests here.
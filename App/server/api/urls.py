@@ -1,14 +1,35 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+if settings.API_ASYNC_VIEWS:
+    session_heartbeat = async_views.session_heartbeat
+    barcode_scan = async_views.barcode_scan
+    cart_view = async_views.cart_view
+else:
+    session_heartbeat = views.SessionHeartbeatView.as_view()
+    barcode_scan = views.BarcodeScanView.as_view()
+    cart_view = views.CartView.as_view()
 
 urlpatterns = [
     path('user/signup', views.UserSignupView.as_view(), name='user-signup'),
     path('session/start', views.SessionStartView.as_view(), name='session-start'),
-    path('session/heartbeat', views.SessionHeartbeatView.as_view(), name='session-heartbeat'),
+    path('session/heartbeat', session_heartbeat, name='session-heartbeat'),
     path('session/end', views.SessionEndView.as_view(), name='session-end'),
     path('cart/scan', views.CartScanView.as_view(), name='cart-scan'),
+    path('cart/scan/batch', views.CartScanBatchView.as_view(), name='cart-scan-batch'),
+    path('barcode/scan', barcode_scan, name='barcode-scan'),
     path('cart/remove', views.CartRemoveView.as_view(), name='cart-remove'),
-    path('cart/view', views.CartView.as_view(), name='cart-view'),
+    path('cart/view', cart_view, name='cart-view'),
+    path('cart/events', views.cart_events, name='cart-events'),
     path('payment/create', views.PaymentCreateView.as_view(), name='payment-create'),
     path('payment/confirm', views.PaymentConfirmView.as_view(), name='payment-confirm'),
+    path('stats', views.StatsView.as_view(), name='stats'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
+    path('fleet/status', views.FleetStatusView.as_view(), name='fleet-status'),
+    path('fleet/provision', views.FleetProvisionView.as_view(), name='fleet-provision'),
+    # Event-loop versions of the device hot paths, for ASGI deployments (see api/async_views.py)
+    path('async/session/heartbeat', async_views.session_heartbeat, name='session-heartbeat-async'),
+    path('async/barcode/scan', async_views.barcode_scan, name='barcode-scan-async'),
+    path('async/cart/view', async_views.cart_view, name='cart-view-async'),
 ]
@@ -1,10 +1,26 @@
+from collections import defaultdict
 from decimal import Decimal
 
-from django.db import transaction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
 from django.utils import timezone
-from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 
-from .models import CartItem, Session
+from .activity import get_activity_tracker
+from .catalog import get_catalog
+from .events import publish_on_commit
+from .fleet import get_fleet
+from .instrumentation import span
+from .models import CartItem, Payment, PaymentLine, Product, ScanReceipt, Session, Trolley, User
+from .rendering import render_cart_item
+
+
+class TrolleyUnavailable(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Trolley already in use'
+    default_code = 'trolley_unavailable'
 
 
 def expire_session(session: Session) -> None:
@@ -12,48 +28,200 @@ def expire_session(session: Session) -> None:
         return
     session.is_active = False
     session.last_activity = timezone.now()
-    session.save(update_fields=['is_active', 'last_activity'])
+    session.cart_total = Decimal('0.00')
+    session.cart_version += 1
+    session.save(update_fields=['is_active', 'last_activity', 'cart_total', 'cart_version'])
     CartItem.objects.filter(session=session).delete()
+    get_activity_tracker().discard(session.session_id)
+    publish_on_commit(session.session_id, 'session', {'status': 'ended'}, session.cart_version)
     trolley = session.trolley
     trolley.is_assigned = False
     trolley.last_seen = timezone.now()
-    trolley.save(update_fields=['is_assigned', 'last_seen'])
+    get_fleet().release([trolley.pk], trolley.last_seen)
+
+
+def is_timed_out(last_activity, timeout_seconds: int) -> bool:
+    return (timezone.now() - last_activity).total_seconds() > timeout_seconds
+
+
+def session_timed_out(session: Session, timeout_seconds: int) -> bool:
+    """Timeout check that also counts activity the tracker has not written yet."""
+    last_activity = get_activity_tracker().latest(session.session_id, session.last_activity)
+    return is_timed_out(last_activity, timeout_seconds)
 
 
 def enforce_session_timeout(session: Session, timeout_seconds: int) -> None:
-    now = timezone.now()
     if not session.is_active:
         raise ValidationError('Session is inactive')
-    if (now - session.last_activity).total_seconds() > timeout_seconds:
+    if session_timed_out(session, timeout_seconds):
         expire_session(session)
         raise ValidationError('Session expired')
 
 
+def claim_session(trolley_pk: int, user_id=None):
+    """Start a session on a free trolley in one round trip, or return ``None``.
+
+    A conditional UPDATE claims the trolley and the session is INSERTed in the
+    same transaction, with no reads. ``None`` means the trolley is not active
+    and free, or it still has an active session (caught by
+    ``unique_active_session_per_trolley``); ``start_session_locked`` then works
+    out why. MySQL has no partial unique indexes, so there the claim alone
+    keeps it to one active session per trolley: every path that ends a
+    session frees the trolley in the same transaction.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            if not get_fleet().claim(trolley_pk, now):
+                return None
+            return Session.objects.create(trolley_id=trolley_pk, user_id=user_id, is_active=True, last_activity=now)
+    except IntegrityError:
+        return None
+
+
+def start_session_locked(trolley_pk: int, timeout_seconds: int, user_id=None) -> Session:
+    """Start a session with the trolley row locked, expiring a timed-out leftover session.
+
+    Raises ``NotFound`` or ``TrolleyUnavailable`` when no session can start.
+    """
+    fleet = get_fleet()
+    user = User.objects.filter(user_id=user_id).first() if user_id else None
+    with transaction.atomic():
+        trolley = Trolley.objects.select_for_update().filter(pk=trolley_pk).first()
+        if not trolley:
+            raise NotFound('Trolley not found')
+        if not trolley.is_active or trolley.is_assigned:
+            # The registry was behind another worker; take the database's word for it
+            fleet.record(trolley)
+            raise TrolleyUnavailable('Trolley inactive' if not trolley.is_active else None)
+
+        existing_session = (
+            Session.objects.select_for_update()
+            .filter(trolley=trolley, is_active=True)
+            .order_by('-created_at')
+            .first()
+        )
+        if existing_session:
+            if not session_timed_out(existing_session, timeout_seconds):
+                raise TrolleyUnavailable()
+            expire_session(existing_session)
+
+        now = timezone.now()
+        session = Session.objects.create(trolley=trolley, user=user, is_active=True, last_activity=now)
+        fleet.assign(trolley.pk, now)
+    return session
+
+
+def start_session(trolley_pk: int, timeout_seconds: int, user_id=None) -> Session:
+    """Claim the trolley without locks, falling back to the locked path when that fails."""
+    return claim_session(trolley_pk, user_id) or start_session_locked(trolley_pk, timeout_seconds, user_id)
+
+
 def get_locked_session(session_id, timeout_seconds: int) -> Session:
     with transaction.atomic():
         try:
-            session = (
-                Session.objects.select_for_update()
-                .select_related('trolley', 'user')
-                .get(session_id=session_id)
-            )
+            with span('lock'):
+                session = (
+                    Session.objects.select_for_update()
+                    .select_related('trolley', 'user')
+                    .get(session_id=session_id)
+                )
         except Session.DoesNotExist as exc:
             raise NotFound('Session not found') from exc
         enforce_session_timeout(session, timeout_seconds)
         return session
 
 
+def get_session(session_id, timeout_seconds: int) -> Session:
+    """Read a live session without taking a row lock, for read-mostly endpoints.
+
+    The timeout check is optimistic: only a session that looks timed out is
+    re-read under ``select_for_update`` and expired in its own transaction, so
+    the expiry sticks even though the caller gets an error. Must not be called
+    inside an outer ``transaction.atomic()`` for that reason.
+    """
+    try:
+        session = Session.objects.select_related('trolley', 'user').get(session_id=session_id)
+    except Session.DoesNotExist as exc:
+        raise NotFound('Session not found') from exc
+    return _check_live_session(session, timeout_seconds)
+
+
+def get_session_by_trolley(trolley_id: str, timeout_seconds: int) -> Session:
+    """Lock-free counterpart of ``get_locked_session_by_trolley``; same caveats as ``get_session``."""
+    session = (
+        Session.objects.select_related('trolley', 'user')
+        .filter(trolley__trolley_id=trolley_id, is_active=True)
+        .order_by('-created_at')
+        .first()
+    )
+    if not session:
+        raise NotFound('No active session for this trolley')
+    return _check_live_session(session, timeout_seconds)
+
+
+def active_session_id(trolley_id: str):
+    """Id of the trolley's active session, or ``None``. No timeout check."""
+    return (
+        Session.objects.filter(trolley__trolley_id=trolley_id, is_active=True)
+        .order_by('-created_at')
+        .values_list('session_id', flat=True)
+        .first()
+    )
+
+
+def _check_live_session(session: Session, timeout_seconds: int) -> Session:
+    if not session.is_active:
+        raise ValidationError('Session is inactive')
+    if not session_timed_out(session, timeout_seconds):
+        return session
+
+    with transaction.atomic():
+        session = (
+            Session.objects.select_for_update()
+            .select_related('trolley', 'user')
+            .get(session_id=session.session_id)
+        )
+        expired = session.is_active and session_timed_out(session, timeout_seconds)
+        if expired:
+            expire_session(session)
+    if expired:
+        raise ValidationError('Session expired')
+    if not session.is_active:
+        raise ValidationError('Session is inactive')
+    return session
+
+
+def get_cart_version(session_id, timeout_seconds: int):
+    """Current cart version of a live session, read without locks or cart rows.
+
+    Returns ``None`` when the session is missing, inactive or timed out, so the
+    caller falls back to its full path and reports the problem there.
+    """
+    state = (
+        Session.objects.filter(session_id=session_id)
+        .values('is_active', 'last_activity', 'cart_version')
+        .first()
+    )
+    if not state or not state['is_active']:
+        return None
+    if is_timed_out(get_activity_tracker().latest(session_id, state['last_activity']), timeout_seconds):
+        return None
+    return state['cart_version']
+
+
 def get_locked_session_by_trolley(trolley_id: str, timeout_seconds: int) -> Session:
     """Get active session for a trolley (used by ESP32 product scans)"""
     with transaction.atomic():
         try:
-            session = (
-                Session.objects.select_for_update()
-                .select_related('trolley', 'user')
-                .filter(trolley__trolley_id=trolley_id, is_active=True)
-                .order_by('-created_at')
-                .first()
-            )
+            with span('lock'):
+                session = (
+                    Session.objects.select_for_update()
+                    .select_related('trolley', 'user')
+                    .filter(trolley__trolley_id=trolley_id, is_active=True)
+                    .order_by('-created_at')
+                    .first()
+                )
         except Session.DoesNotExist as exc:
             raise NotFound('No active session for this trolley') from exc
         
@@ -64,16 +232,203 @@ def get_locked_session_by_trolley(trolley_id: str, timeout_seconds: int) -> Sess
         return session
 
 
+def _bump_session(session: Session, delta: Decimal) -> None:
+    """Add ``delta`` to the running total and bump the cart version in one UPDATE.
+
+    This takes the session row lock for the rest of the transaction, so cart
+    mutations on one session still queue behind each other, and it fails
+    instead of touching the cart when the session ended in the meantime.
+    """
+    with span('lock'):
+        updated = Session.objects.filter(session_id=session.session_id, is_active=True).update(
+            cart_total=F('cart_total') + delta,
+            cart_version=F('cart_version') + 1,
+        )
+    if not updated:
+        raise ValidationError('Session is inactive')
+
+
+def _publish_cart_item(session: Session, cart_item: CartItem) -> None:
+    publish_on_commit(
+        session.session_id,
+        'cart_item',
+        {'item': render_cart_item(cart_item), 'total': str(session.cart_total)},
+        session.cart_version,
+    )
+
+
+def _read_back(session: Session, product) -> CartItem:
+    """Load the cart line and the session's new total/version in one query.
+
+    Returns an unsaved item with quantity 0 when the line no longer exists.
+    """
+    row = (
+        CartItem.objects.filter(session=session, product=product)
+        .values('pk', 'quantity', 'subtotal', 'session__cart_total', 'session__cart_version')
+        .first()
+    )
+    if row is None:
+        state = Session.objects.filter(session_id=session.session_id).values('cart_total', 'cart_version').get()
+        session.cart_total, session.cart_version = state['cart_total'], state['cart_version']
+        return CartItem(session=session, product=product, quantity=0, subtotal=Decimal('0.00'))
+    session.cart_total, session.cart_version = row['session__cart_total'], row['session__cart_version']
+    return CartItem(
+        pk=row['pk'], session=session, product=product, quantity=row['quantity'], subtotal=row['subtotal'],
+    )
+
+
+def add_to_cart(session: Session, barcode: str) -> CartItem:
+    """Add one unit of ``barcode`` with single-statement updates; call inside ``transaction.atomic()``.
+
+    The line is incremented in SQL, or inserted when it doesn't exist yet. A
+    concurrent insert of the same line trips ``unique_product_per_session`` and
+    falls back to the increment.
+    """
+    product = get_catalog().get(barcode)
+    if product is None:
+        raise NotFound('Product not found or inactive')
+    price = product.price.quantize(Decimal('0.01'))
+
+    _bump_session(session, price)
+    line = CartItem.objects.filter(session=session, product=product)
+    increment = {'quantity': F('quantity') + 1, 'subtotal': F('subtotal') + price}
+    if not line.update(**increment):
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(session=session, product=product, quantity=1, subtotal=price)
+        except IntegrityError:
+            line.update(**increment)
+    cart_item = _read_back(session, product)
+    _publish_cart_item(session, cart_item)
+    return cart_item
+
+
+def add_batch_to_cart(session: Session, items: list) -> list:
+    """Apply buffered ``{barcode, qty, client_seq}`` scans to the cart in one go.
+
+    Lines whose ``client_seq`` was already applied to this session are skipped,
+    so a retried batch is harmless. Products are resolved with one query and
+    cart rows written with one ``bulk_update`` and one ``bulk_create``. Callers
+    hold the session row lock and publish the new cart. Returns
+    ``{client_seq, status}`` per line, where status is ``added``, ``duplicate``
+    or ``not_found`` (unknown or inactive barcode).
+    """
+    seen = set(
+        ScanReceipt.objects.filter(session=session, client_seq__in=[item['client_seq'] for item in items])
+        .values_list('client_seq', flat=True)
+    )
+    fresh = [item for item in items if item['client_seq'] not in seen]
+    products = Product.objects.filter(barcode__in={item['barcode'] for item in fresh}, is_active=True).in_bulk(
+        field_name='barcode'
+    )
+
+    statuses = {seq: 'duplicate' for seq in seen}
+    quantities = defaultdict(int)
+    receipts = []
+    for item in fresh:
+        product = products.get(item['barcode'])
+        if product is None:
+            statuses[item['client_seq']] = 'not_found'
+            continue
+        statuses[item['client_seq']] = 'added'
+        quantities[product.pk] += item['qty']
+        receipts.append(ScanReceipt(
+            session=session, client_seq=item['client_seq'], barcode=item['barcode'], quantity=item['qty'],
+        ))
+
+    if quantities:
+        existing = {
+            cart_item.product_id: cart_item
+            for cart_item in CartItem.objects.select_for_update().filter(session=session, product_id__in=quantities)
+        }
+        prices = {product.pk: product.price for product in products.values()}
+        to_update, to_create = [], []
+        delta = Decimal('0.00')
+        for product_pk, quantity in quantities.items():
+            added = (prices[product_pk] * quantity).quantize(Decimal('0.01'))
+            delta += added
+            cart_item = existing.get(product_pk)
+            if cart_item:
+                cart_item.quantity += quantity
+                cart_item.subtotal += added
+                to_update.append(cart_item)
+            else:
+                to_create.append(CartItem(session=session, product_id=product_pk, quantity=quantity, subtotal=added))
+        CartItem.objects.bulk_update(to_update, ['quantity', 'subtotal'])
+        CartItem.objects.bulk_create(to_create)
+        ScanReceipt.objects.bulk_create(receipts)
+
+        session.cart_total = (session.cart_total + delta).quantize(Decimal('0.01'))
+        session.cart_version += 1
+        session.save(update_fields=['cart_total', 'cart_version'])
+
+    return [{'client_seq': item['client_seq'], 'status': statuses[item['client_seq']]} for item in items]
+
+
+def remove_from_cart(session: Session, product) -> CartItem:
+    """Take one unit of ``product`` out of the cart; call inside ``transaction.atomic()``.
+
+    The unit comes off at the price it was scanned at, the line's subtotal
+    divided by its quantity (the last unit takes what is left), so a catalog
+    price change since the scan leaves the line and the running total right.
+    Returns the updated item; when the last unit is removed the row is deleted
+    and an unsaved item with quantity 0 is returned instead.
+    """
+    # Lock the session first, so the line can't change between reading and writing it
+    _bump_session(session, Decimal('0.00'))
+    line = CartItem.objects.filter(session=session, product=product)
+    state = line.values_list('pk', 'quantity', 'subtotal').first()
+    if state is None:
+        raise NotFound('Item not in cart')
+    pk, quantity, subtotal = state
+    if quantity > 1:
+        unit_price = (subtotal / quantity).quantize(Decimal('0.01'))
+        CartItem.objects.filter(pk=pk).update(quantity=F('quantity') - 1, subtotal=F('subtotal') - unit_price)
+    else:
+        unit_price = subtotal
+        CartItem.objects.filter(pk=pk).delete()
+    Session.objects.filter(session_id=session.session_id).update(cart_total=F('cart_total') - unit_price)
+    cart_item = _read_back(session, product)
+    _publish_cart_item(session, cart_item)
+    return cart_item
+
+
 def calculate_cart_total(session: Session) -> Decimal:
-    total = Decimal('0.00')
-    for item in session.cart_items.select_related('product'):
-        total += item.subtotal
+    if settings.CART_TOTAL_MODE == 'incremental':
+        return session.cart_total.quantize(Decimal('0.01'))
+    return recalculate_cart_total(session)
+
+
+def recalculate_cart_total(session: Session) -> Decimal:
+    """Sum the cart in the database, ignoring the running total."""
+    with span('total'):
+        total = session.cart_items.aggregate(total=Sum('subtotal'))['total'] or Decimal('0.00')
     return total.quantize(Decimal('0.01'))
 
 
+def create_payment(session: Session) -> Payment:
+    """Create a pending payment for the summed cart rows, keeping a copy of the lines.
+
+    Ending the session deletes its cart rows, so the ``PaymentLine`` copies
+    are what records which items a payment was for.
+    """
+    with span('total'):
+        lines = list(session.cart_items.values_list(
+            'product_id', 'product__barcode', 'product__name', 'product__category', 'quantity', 'subtotal',
+        ))
+    total = sum((line[-1] for line in lines), Decimal('0.00')).quantize(Decimal('0.01'))
+    payment = Payment.objects.create(session=session, user=session.user, total_amount=total)
+    PaymentLine.objects.bulk_create([
+        PaymentLine(
+            payment=payment, product_id=product_id, barcode=barcode, name=name, category=category,
+            quantity=quantity, subtotal=subtotal,
+        )
+        for product_id, barcode, name, category, quantity, subtotal in lines
+    ])
+    return payment
+
+
 def refresh_activity(session: Session) -> None:
-    session.last_activity = timezone.now()
-    session.save(update_fields=['last_activity'])
-    trolley = session.trolley
-    trolley.last_seen = session.last_activity
-    trolley.save(update_fields=['last_seen'])
+    """Mark the session and its trolley as active; written in batches by the tracker."""
+    session.last_activity = get_activity_tracker().touch(session)
+
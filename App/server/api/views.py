@@ -1,26 +1,63 @@
-from decimal import Decimal
+import asyncio
 
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.http import parse_etags
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 
+from smarttrolley.db.mysql_pool.pool import pool_stats
 from smarttrolley.settings import SESSION_TIMEOUT_SECONDS
 
-from .models import CartItem, Payment, Product, Session, Trolley, User
+from .activity import get_activity_tracker
+from .catalog import get_catalog
+from .decoding import ImageDecodeError, decode_barcode, get_decode_engine
+from .events import CartEvent, get_broker, publish_on_commit
+from .fleet import STATES, get_fleet
+from .frame_cache import dhash, get_frame_cache
+from .idempotency import get_idempotency_store, idempotent
+from .instrumentation import flatten_stats, metrics, span
+from .models import CartItem, Payment, Session, User
+from .permissions import IsStaffOrMonitoring
+from .provisioning import provision
+from .rendering import render_cart, render_cart_compact, render_cart_item
 from .serializers import (
+	BarcodeScanQuerySerializer,
+	CartScanBatchSerializer,
 	CartRemoveSerializer,
 	CartScanSerializer,
 	CartScanTrolleySerializer,
 	CartViewSerializer,
-	CartItemSerializer,
+	FleetProvisionSerializer,
 	SessionIdSerializer,
 	SessionStartSerializer,
 	UserSignupSerializer,
 )
-from .utils import calculate_cart_total, expire_session, get_locked_session, get_locked_session_by_trolley, refresh_activity
+from .utils import (
+	active_session_id,
+	add_batch_to_cart,
+	add_to_cart,
+	calculate_cart_total,
+	create_payment,
+	expire_session,
+	get_cart_version,
+	get_locked_session,
+	get_locked_session_by_trolley,
+	get_session,
+	get_session_by_trolley,
+	refresh_activity,
+	remove_from_cart,
+	start_session,
+)
 
 
 class UserSignupView(APIView):
@@ -37,43 +74,19 @@ class SessionStartView(APIView):
 		serializer.is_valid(raise_exception=True)
 		trolley_id = serializer.validated_data['trolley_id']
 		user_id = serializer.validated_data.get('user_id')
-		user = User.objects.filter(user_id=user_id).first() if user_id else None
 
-		with transaction.atomic():
-			trolley = Trolley.objects.select_for_update().filter(trolley_id=trolley_id).first()
-			if not trolley:
-				trolley = Trolley.objects.create(trolley_id=trolley_id, last_seen=timezone.now())
-			else:
-				if not trolley.is_active:
-					return Response({'detail': 'Trolley inactive'}, status=status.HTTP_400_BAD_REQUEST)
-				if trolley.is_assigned:
-					return Response({'detail': 'Trolley already in use'}, status=status.HTTP_400_BAD_REQUEST)
-
-			existing_session = (
-				Session.objects.select_for_update()
-				.filter(trolley=trolley, is_active=True)
-				.order_by('-created_at')
-				.first()
-			)
-			if existing_session:
-				time_since_last = (timezone.now() - existing_session.last_activity).total_seconds()
-				if time_since_last > SESSION_TIMEOUT_SECONDS:
-					expire_session(existing_session)
-				else:
-					return Response({'detail': 'Trolley already in use'}, status=status.HTTP_400_BAD_REQUEST)
-
-			now = timezone.now()
-			session = Session.objects.create(
-				trolley=trolley,
-				user=user,
-				is_active=True,
-				last_activity=now,
-			)
-			trolley.is_assigned = True
-			trolley.last_seen = now
-			trolley.save(update_fields=['is_assigned', 'last_seen'])
+		fleet = get_fleet()
+		# Unknown trolleys are registered here, before any row lock is taken. The
+		# registry may be behind on is_active, so the database row decides that.
+		state = fleet.ensure(trolley_id)
 
-			return Response({'session_id': session.session_id}, status=status.HTTP_201_CREATED)
+		try:
+			# Usually one UPDATE and one INSERT; locks only when the claim is refused
+			session = start_session(state.pk, SESSION_TIMEOUT_SECONDS, user_id)
+		except NotFound:
+			fleet.forget(trolley_id)
+			raise
+		return Response({'session_id': session.session_id}, status=status.HTTP_201_CREATED)
 
 
 class SessionHeartbeatView(APIView):
@@ -82,9 +95,9 @@ class SessionHeartbeatView(APIView):
 		serializer.is_valid(raise_exception=True)
 		session_id = serializer.validated_data['session_id']
 
-		with transaction.atomic():
-			session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
-			refresh_activity(session)
+		# Heartbeats only bump timestamps, so they don't queue behind scans on the session lock
+		session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
+		refresh_activity(session)
 		return Response({'status': 'ok'})
 
 
@@ -107,9 +120,7 @@ class SessionEndView(APIView):
 						session = Session.objects.select_for_update().select_related('trolley').get(session_id=session_id)
 						# Make sure trolley is freed even if session was already expired
 						if session.trolley.is_assigned:
-							session.trolley.is_assigned = False
-							session.trolley.last_seen = timezone.now()
-							session.trolley.save(update_fields=['is_assigned', 'last_seen'])
+							get_fleet().release([session.trolley_id], timezone.now())
 					except Session.DoesNotExist:
 						pass
 				else:
@@ -117,34 +128,123 @@ class SessionEndView(APIView):
 		return Response({'status': 'ended'})
 
 
+def _cart_payload(session, total, changed_item=None, response_format='full'):
+	"""Full cart by default; with ``response_format='delta'`` only the changed item and the new total.
+
+	``'compact'`` returns the whole cart with each product listed once under
+	``products`` and referenced by barcode from the items.
+	"""
+	with span('serialize'):
+		if response_format == 'delta':
+			return {'item': render_cart_item(changed_item), 'total': str(total)}
+		if response_format == 'compact':
+			return render_cart_compact(session, total)
+		return render_cart(session, total)
+
+
+def _scan_into_cart(barcode, session_id=None, trolley_id=None, response_format='full'):
+	"""Add one unit of ``barcode`` to the session's (or trolley's) cart."""
+	# Read without a row lock; add_to_cart locks the session with its first UPDATE
+	if session_id:
+		session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
+	else:
+		session = get_session_by_trolley(trolley_id, SESSION_TIMEOUT_SECONDS)
+	with transaction.atomic():
+		cart_item = add_to_cart(session, barcode)
+		total = calculate_cart_total(session)
+	refresh_activity(session)
+
+	return _cart_payload(session, total, cart_item, response_format)
+
+
+def _frame_cache_key(session_id=None, trolley_id=None):
+	"""Cache key for a cart's frames, or ``None`` when there is no cart to dedup against.
+
+	Frames and the debounce window belong to the session rather than the trolley,
+	so the trolley's next shopper can scan the item the last one just bought.
+	"""
+	if not session_id and trolley_id:
+		session_id = active_session_id(trolley_id)
+	if session_id:
+		return f'session:{session_id}'
+	return None
+
+
+def _decode_frame(image_bytes, cache_key=None):
+	"""Decode a camera frame, reusing the result of a near-identical recent frame.
+
+	Returns ``(result, duplicate, fingerprint)``. Frames without a barcode are
+	remembered straight away; one with a barcode is remembered by
+	``_remember_scan`` after its item was added to the cart.
+	"""
+	if cache_key is None:
+		with span('decode'):
+			return decode_barcode(image_bytes), False, None
+	frame_cache = get_frame_cache()
+	with span('frame_hash'):
+		fingerprint = dhash(image_bytes)
+	if fingerprint is not None:
+		cached = frame_cache.lookup(cache_key, fingerprint)
+		if cached is not None:
+			return cached, True, fingerprint
+	with span('decode'):
+		result = decode_barcode(image_bytes)
+	if fingerprint is not None and not result.barcode:
+		frame_cache.remember(cache_key, fingerprint, result)
+	return result, False, fingerprint
+
+
+def _remember_scan(cache_key, fingerprint, result, added=True):
+	"""Remember a frame whose barcode is in the cart; ``added`` also starts the debounce window."""
+	frame_cache = get_frame_cache()
+	if fingerprint is not None:
+		frame_cache.remember(cache_key, fingerprint, result)
+	if added:
+		frame_cache.record_add(cache_key, result.barcode)
+
+
 class CartScanView(APIView):
-	def post(self, request):
-		from PIL import Image
-		from pyzbar.pyzbar import decode
+	parser_classes = [MultiPartParser, FormParser, JSONParser]
 
-		# Accept image via multipart/form-data as 'barcode_image'
+	@idempotent
+	def post(self, request):
+		# Accept image via multipart/form-data as 'barcode_image', or an already
+		# decoded barcode in a JSON body
 		barcode_image = request.FILES.get('barcode_image')
 		has_session_id = 'session_id' in request.data
 		has_trolley_id = 'trolley_id' in request.data
+		cache_key = None
 
-		if not barcode_image:
-			return Response({'detail': 'barcode_image file is required'}, status=status.HTTP_400_BAD_REQUEST)
-
-		# Decode barcode from image
-		try:
-			img = Image.open(barcode_image)
-			decoded_objs = decode(img)
-			if not decoded_objs:
+		if barcode_image:
+			# Decode barcode from image in the decoder pool, skipping repeated frames
+			cache_key = _frame_cache_key(request.data.get('session_id'), request.data.get('trolley_id'))
+			try:
+				result, duplicate, fingerprint = _decode_frame(barcode_image.read(), cache_key)
+			except ImageDecodeError as e:
+				return Response({'detail': f'Error decoding barcode: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+			if not result.barcode:
 				return Response({'detail': 'No barcode found in image'}, status=status.HTTP_400_BAD_REQUEST)
-			barcode = decoded_objs[0].data.decode('utf-8')
-		except Exception as e:
-			return Response({'detail': f'Error decoding barcode: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+			if duplicate:
+				return Response(
+					{'detail': 'Duplicate frame, item already scanned', 'barcode': result.barcode},
+					status=status.HTTP_409_CONFLICT,
+				)
+			barcode = result.barcode
+		elif request.data.get('barcode'):
+			barcode = request.data['barcode']
+		else:
+			return Response({'detail': 'barcode_image file is required'}, status=status.HTTP_400_BAD_REQUEST)
 
 		# Validate session/trolley
+		data = {'barcode': barcode}
+		if 'response_format' in request.data:
+			data['response_format'] = request.data['response_format']
 		if has_session_id:
-			serializer = CartScanSerializer(data=request.data)
+			data['session_id'] = request.data['session_id']
+			serializer = CartScanSerializer(data=data)
 		elif has_trolley_id:
-			serializer = CartScanTrolleySerializer(data=request.data)
+			data['trolley_id'] = request.data['trolley_id']
+			serializer = CartScanTrolleySerializer(data=data)
 		else:
 			return Response(
 				{'detail': 'Either session_id or trolley_id is required'},
@@ -152,93 +252,237 @@ class CartScanView(APIView):
 			)
 
 		serializer.is_valid(raise_exception=True)
+		if cache_key and get_frame_cache().recently_added(cache_key, barcode):
+			_remember_scan(cache_key, fingerprint, result, added=False)
+			return Response(
+				{'detail': 'Barcode was just added, scan ignored', 'barcode': barcode},
+				status=status.HTTP_409_CONFLICT,
+			)
+		cart = _scan_into_cart(
+			serializer.validated_data['barcode'],
+			session_id=serializer.validated_data.get('session_id'),
+			trolley_id=serializer.validated_data.get('trolley_id'),
+			response_format=serializer.validated_data['response_format'],
+		)
+		if cache_key:
+			# Only now, so a failed add isn't taken for a duplicate when retried
+			_remember_scan(cache_key, fingerprint, result)
+		return Response(cart)
+
+
+class CartScanBatchView(APIView):
+	"""Apply scans a trolley buffered while offline, in one transaction.
+
+	Each line carries a ``client_seq``; lines already applied to the session
+	are reported as ``duplicate`` and not counted again, so the trolley can
+	resend the whole batch until it gets a response.
+	"""
+	def post(self, request):
+		serializer = CartScanBatchSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		session_id = serializer.validated_data.get('session_id')
 
 		with transaction.atomic():
-			if has_session_id:
-				session_id = serializer.validated_data['session_id']
+			if session_id:
 				session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
 			else:
-				trolley_id = serializer.validated_data['trolley_id']
-				session = get_locked_session_by_trolley(trolley_id, SESSION_TIMEOUT_SECONDS)
-			try:
-				product = Product.objects.get(barcode=barcode, is_active=True)
-			except Product.DoesNotExist:
-				return Response({'detail': 'Product not found or inactive'}, status=status.HTTP_404_NOT_FOUND)
-
-			cart_item = (
-				CartItem.objects.select_for_update()
-				.filter(session=session, product=product)
-				.first()
+				session = get_locked_session_by_trolley(serializer.validated_data['trolley_id'], SESSION_TIMEOUT_SECONDS)
+			results = add_batch_to_cart(session, serializer.validated_data['items'])
+			refresh_activity(session)
+			cart = _cart_payload(session, calculate_cart_total(session))
+			if any(result['status'] == 'added' for result in results):
+				publish_on_commit(session.session_id, 'cart', {**cart, 'version': session.cart_version}, session.cart_version)
+
+		return Response({'results': results, 'cart': cart})
+
+
+class BarcodeScanView(APIView):
+	"""Decode a raw ``image/jpeg`` body as posted by the ESP32-CAM firmware.
+
+	The body is read as-is, without multipart parsing. Pass ``trolley_id`` or
+	``session_id`` in the query string to also add the decoded product to that
+	cart, so a scan costs a single request. Repeats of a recently seen frame,
+	or of a barcode added moments ago, come back with ``duplicate: true`` and
+	are not added again.
+	"""
+	parser_classes = []
+
+	@idempotent
+	def post(self, request):
+		if not request.content_type.startswith(('image/', 'application/octet-stream')):
+			return Response(
+				{'detail': 'Expected a raw image/jpeg body'},
+				status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
 			)
-			if cart_item:
-				cart_item.quantity += 1
-				cart_item.subtotal = (product.price * cart_item.quantity).quantize(Decimal('0.01'))
-				cart_item.save(update_fields=['quantity', 'subtotal'])
-			else:
-				cart_item = CartItem.objects.create(
-					session=session,
-					product=product,
-					quantity=1,
-					subtotal=product.price.quantize(Decimal('0.01')),
-				)
+		image_bytes = request.body
+		if not image_bytes:
+			return Response({'detail': 'Image body is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-			refresh_activity(session)
-			total = calculate_cart_total(session)
+		params = BarcodeScanQuerySerializer(data=request.query_params)
+		params.is_valid(raise_exception=True)
+
+		session_id = params.validated_data.get('session_id')
+		trolley_id = params.validated_data.get('trolley_id')
+		cache_key = _frame_cache_key(session_id, trolley_id)
+		try:
+			result, duplicate, fingerprint = _decode_frame(image_bytes, cache_key)
+		except ImageDecodeError as e:
+			return Response({'detail': f'Error decoding barcode: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
 
-		cart_items = CartItemSerializer(session.cart_items.select_related('product'), many=True)
-		return Response({'items': cart_items.data, 'total': str(total)})
+		if result.barcode and cache_key and not duplicate and get_frame_cache().recently_added(cache_key, result.barcode):
+			_remember_scan(cache_key, fingerprint, result, added=False)
+			duplicate = True
+		payload = {
+			'found': result.barcode is not None,
+			'barcode': result.barcode,
+			'symbology': result.symbology,
+			'decode_ms': result.decode_ms,
+			'duplicate': duplicate,
+		}
+		if result.barcode and cache_key and not duplicate:
+			payload['cart'] = _scan_into_cart(
+				result.barcode,
+				session_id=session_id,
+				trolley_id=trolley_id,
+				response_format=params.validated_data['response_format'],
+			)
+			_remember_scan(cache_key, fingerprint, result)
+		return Response(payload)
 
 
 class CartRemoveView(APIView):
+	@idempotent
 	def post(self, request):
 		serializer = CartRemoveSerializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
 		session_id = serializer.validated_data['session_id']
 		barcode = serializer.validated_data['barcode']
 
+		session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
+		product = get_catalog().get(barcode, active_only=False)
+		if product is None:
+			return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+
 		with transaction.atomic():
-			session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
-			try:
-				product = Product.objects.get(barcode=barcode)
-			except Product.DoesNotExist:
-				return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-
-			cart_item = (
-				CartItem.objects.select_for_update()
-				.filter(session=session, product=product)
-				.first()
-			)
-			if not cart_item:
-				return Response({'detail': 'Item not in cart'}, status=status.HTTP_404_NOT_FOUND)
-
-			# Decrease quantity by 1, or remove if quantity becomes 0
-			if cart_item.quantity > 1:
-				cart_item.quantity -= 1
-				cart_item.subtotal = (product.price * cart_item.quantity).quantize(Decimal('0.01'))
-				cart_item.save(update_fields=['quantity', 'subtotal'])
-			else:
-				cart_item.delete()
-				
-			refresh_activity(session)
+			cart_item = remove_from_cart(session, product)
 			total = calculate_cart_total(session)
+		refresh_activity(session)
+
+		return Response(_cart_payload(session, total, cart_item, serializer.validated_data['response_format']))
 
-		cart_items = CartItemSerializer(session.cart_items.select_related('product'), many=True)
-		return Response({'items': cart_items.data, 'total': str(total)})
+
+def _cart_etag(cart_version):
+	return f'"{cart_version}"'
 
 
 class CartView(APIView):
+	"""Cart contents with an ETag of the session's cart version.
+
+	Polls that send ``If-None-Match`` with the current version get a 304 after
+	a single row read, without locks or touching cart rows. Anything else,
+	including an unknown or ended session, takes the full path.
+	"""
+
 	def get(self, request):
 		serializer = CartViewSerializer(data=request.query_params)
 		serializer.is_valid(raise_exception=True)
 		session_id = serializer.validated_data['session_id']
 
-		session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
+		if_none_match = request.headers.get('If-None-Match')
+		if if_none_match:
+			cart_version = get_cart_version(session_id, SESSION_TIMEOUT_SECONDS)
+			if cart_version is not None:
+				etag = _cart_etag(cart_version)
+				if etag in parse_etags(if_none_match) or if_none_match.strip() == '*':
+					return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+		session = get_session(session_id, SESSION_TIMEOUT_SECONDS)
 		total = calculate_cart_total(session)
-		cart_items = CartItemSerializer(session.cart_items.select_related('product'), many=True)
-		return Response({'items': cart_items.data, 'total': str(total)})
+		return Response(
+			_cart_payload(session, total, response_format=serializer.validated_data['response_format']),
+			headers={'ETag': _cart_etag(session.cart_version), 'Cache-Control': 'no-cache'},
+		)
+
+
+def _cart_snapshot(session_id):
+	"""First event of ``cart_events``, read on a pool thread.
+
+	The connection is handed back on the way out, as ``async_views._db`` does,
+	instead of staying with the stream for as long as the page is open.
+	"""
+	close_old_connections()
+	try:
+		session = Session.objects.filter(session_id=session_id, is_active=True).first()
+		if session is None:
+			return None
+		payload = _cart_payload(session, calculate_cart_total(session))
+		payload['version'] = session.cart_version
+		return payload
+	finally:
+		close_old_connections()
+
+
+async def cart_events(request):
+	"""Server-Sent Events stream of one session's cart changes.
+
+	A plain async view rather than an APIView so the stream runs on the ASGI
+	event loop instead of holding a worker thread. The first event is a full
+	``cart`` snapshot unless ``Last-Event-ID`` already matches the current
+	version; ``cart_item`` deltas, ``payment`` updates and a final ``session``
+	event follow, with a ``keepalive`` event whenever nothing happened for
+	``CART_EVENTS_KEEPALIVE_SECONDS``.
+
+	Refused with 501 when not served over ASGI, where the stream would tie up
+	a worker thread for as long as the page stays open; the page polls
+	``/api/cart/view`` instead.
+	"""
+	if not isinstance(request, ASGIRequest):
+		return JsonResponse(
+			{'detail': 'Live cart updates need the ASGI server, poll /api/cart/view instead'},
+			status=status.HTTP_501_NOT_IMPLEMENTED,
+		)
+	serializer = SessionIdSerializer(data=request.GET)
+	if not serializer.is_valid():
+		return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+	session_id = str(serializer.validated_data['session_id'])
+	last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+
+	# Subscribe before reading the snapshot so no change can fall in between.
+	subscription = get_broker().subscribe(session_id)
+	snapshot = await sync_to_async(_cart_snapshot, thread_sensitive=False)(session_id)
+	if snapshot is None:
+		subscription.close()
+		return JsonResponse({'detail': 'Session not found or inactive'}, status=status.HTTP_404_NOT_FOUND)
+	version = snapshot['version']
+	keepalive = settings.CART_EVENTS_KEEPALIVE_SECONDS
+
+	async def stream():
+		try:
+			if last_event_id != str(version):
+				yield CartEvent('cart', snapshot, version).encode()
+			while True:
+				try:
+					event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+				except asyncio.TimeoutError:
+					# An event rather than a comment, so the page notices a stalled stream
+					yield CartEvent('keepalive', {}).encode()
+					continue
+				if event.version is not None and event.version <= version:
+					continue
+				yield event.encode()
+				if event.type == 'session':
+					return
+		finally:
+			subscription.close()
+
+	response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+	response['Cache-Control'] = 'no-cache'
+	response['X-Accel-Buffering'] = 'no'
+	return response
 
 
 class PaymentCreateView(APIView):
+	@idempotent
 	def post(self, request):
 		serializer = SessionIdSerializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
@@ -247,21 +491,23 @@ class PaymentCreateView(APIView):
 		with transaction.atomic():
 			session = get_locked_session(session_id, SESSION_TIMEOUT_SECONDS)
 			
-			# Create a user if session doesn't have one
+			# Bill sessions without a signed-up user to the shared guest user
 			if not session.user:
-				user = User.objects.create(
-					name='Guest User',
+				user, _ = User.objects.get_or_create(
 					phone_number='0000000000',
+					defaults={'name': 'Guest User'},
 				)
 				session.user = user
 				session.save(update_fields=['user'])
 
-			total = calculate_cart_total(session)
-			payment = Payment.objects.create(
-				session=session,
-				user=session.user,
-				total_amount=total,
-			)
+			# Charge the summed cart rows rather than the running total
+			payment = create_payment(session)
+			total = payment.total_amount
+			publish_on_commit(session.session_id, 'payment', {
+				'payment_id': payment.id,
+				'total_amount': str(total),
+				'status': payment.payment_status,
+			})
 
 		qr_string = f"upi://pay?pa=smarttrolley@upi&pn=SmartTrolley&am={total}&cu=INR&tn=Smart%20Trolley"
 		return Response(
@@ -290,6 +536,82 @@ class PaymentConfirmView(APIView):
 
 			payment.payment_status = Payment.PaymentStatus.SUCCESS
 			payment.save(update_fields=['payment_status'])
+			publish_on_commit(session.session_id, 'payment', {
+				'payment_id': payment.id,
+				'total_amount': str(payment.total_amount),
+				'status': payment.payment_status,
+			})
 			expire_session(session)
 
 		return Response({'status': 'payment_success'})
+
+
+def _runtime_stats():
+	return {
+		'decoder': get_decode_engine().stats(),
+		'frame_cache': get_frame_cache().stats(),
+		'catalog': get_catalog().stats(),
+		'cart_events': get_broker().stats(),
+		'activity': get_activity_tracker().stats(),
+		'idempotency': get_idempotency_store().stats(),
+		'fleet': get_fleet().stats(),
+		'db_pool': pool_stats(),
+	}
+
+
+class StatsView(APIView):
+	authentication_classes = [SessionAuthentication]
+	permission_classes = [IsStaffOrMonitoring]
+
+	def get(self, request):
+		return Response(_runtime_stats())
+
+
+class FleetStatusView(APIView):
+	"""Trolley counts by state from the in-memory registry, without a query.
+
+	``?state=in_use|free|stale|inactive`` also lists the trolleys in that state.
+	"""
+	authentication_classes = [SessionAuthentication]
+	permission_classes = [IsStaffOrMonitoring]
+
+	def get(self, request):
+		fleet = get_fleet()
+		payload = fleet.status()
+		state = request.query_params.get('state')
+		if state:
+			if state not in STATES:
+				raise ValidationError({'state': f"Must be one of {', '.join(STATES)}"})
+			payload['trolleys'] = [
+				{'trolley_id': trolley.trolley_id, 'is_assigned': trolley.is_assigned, 'last_seen': trolley.last_seen}
+				for trolley in fleet.trolleys(state)
+			]
+		return Response(payload)
+
+
+class FleetProvisionView(APIView):
+	"""Create, activate or deactivate a range of trolleys in bulk; staff only."""
+	authentication_classes = [SessionAuthentication]
+	permission_classes = [IsAdminUser]
+
+	def post(self, request):
+		serializer = FleetProvisionSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		result = provision(
+			serializer.validated_data['action'],
+			serializer.validated_data['trolleys'],
+			active=serializer.validated_data['active'],
+		)
+		return Response(result.as_dict())
+
+
+class MetricsView(APIView):
+	"""Prometheus text format: request counters and timings, plus the /api/stats numbers as gauges."""
+	authentication_classes = [SessionAuthentication]
+	permission_classes = [IsStaffOrMonitoring]
+
+	def get(self, request):
+		return HttpResponse(
+			metrics.render(flatten_stats(_runtime_stats())),
+			content_type='text/plain; version=0.0.4; charset=utf-8',
+		)
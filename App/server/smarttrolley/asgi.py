@@ -3,6 +3,9 @@ ASGI config for smarttrolley project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve this (e.g. ``uvicorn smarttrolley.asgi:application``) rather than the
+WSGI app so that long-lived /api/cart/events streams run on the event loop.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -14,3 +17,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smarttrolley.settings')
 
 application = get_asgi_application()
+
+# Load the product catalog now instead of on this worker's first scan
+from api.catalog import warm_catalog  # noqa: E402
+
+warm_catalog()
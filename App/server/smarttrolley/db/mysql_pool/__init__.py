@@ -0,0 +1 @@
+"""MySQL database backend with a per-process connection pool; see ``base.py``."""
@@ -0,0 +1,84 @@
+"""MySQL backend that reuses connections from a per-process pool.
+
+Use it as ``ENGINE: 'smarttrolley.db.mysql_pool'`` and configure the pool the
+way Django's PostgreSQL backend does, under ``OPTIONS['pool']`` (``True`` for
+the defaults in ``pool.DEFAULTS``)::
+
+    'OPTIONS': {'pool': {'min_size': 2, 'max_size': 20}}
+
+Keep ``CONN_MAX_AGE = 0``: Django then "closes" the connection at the end of
+every request, which returns it to the pool, so a handful of connections
+serves any number of threads.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+
+from .pool import DEFAULTS, ConnectionPool, PoolTimeout, get_pool
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reused = False
+
+    @property
+    def pool_options(self) -> dict:
+        options = self.settings_dict['OPTIONS'].get('pool', True)
+        if options is True:
+            return dict(DEFAULTS)
+        if not isinstance(options, dict):
+            raise ImproperlyConfigured("OPTIONS['pool'] must be True or a dict of pool settings")
+        unknown = set(options) - set(DEFAULTS)
+        if unknown:
+            raise ImproperlyConfigured(f"Unknown OPTIONS['pool'] settings: {', '.join(sorted(unknown))}")
+        return {**DEFAULTS, **options}
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.alias, self._make_pool)
+
+    def _make_pool(self) -> ConnectionPool:
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured('The pooled MySQL backend needs CONN_MAX_AGE = 0')
+        conn_params = self.get_connection_params()
+        return ConnectionPool(
+            connect=lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            ping=lambda connection: connection.ping(),
+            name=self.alias,
+            **self.pool_options,
+        )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection, self._reused = self.pool.acquire()
+        except PoolTimeout as exc:
+            raise OperationalError(str(exc)) from exc
+        return connection
+
+    def init_connection_state(self):
+        # Session variables survive on a pooled connection; only set them once
+        if not self._reused:
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # After a database error, keep the connection only if it still answers
+        discard = self.errors_occurred and not self.is_usable()
+        if not discard and (self.in_atomic_block or not self.get_autocommit()):
+            # Closed mid-transaction (e.g. an exception inside atomic()): don't
+            # hand the open transaction to the next request
+            try:
+                self.connection.rollback()
+            except Exception:
+                discard = True
+        self.pool.release(self.connection, discard=discard)
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
@@ -0,0 +1,257 @@
+"""A small thread-safe pool of raw MySQLdb connections.
+
+Django opens one connection per thread and closes it at the end of every
+request (``CONN_MAX_AGE = 0``). The pooled backend hands that close to
+``ConnectionPool.release`` instead, so the next request on any thread — WSGI
+worker threads, the ASGI sync thread or the thread pool behind the async views
+— checks out an already authenticated connection.
+
+Connections are checked before reuse: ones idle for longer than
+``check_interval`` are pinged, and ones older than ``max_lifetime`` (keep it
+under the server's ``wait_timeout``) are replaced. Idle connections above
+``min_size`` are closed after ``max_idle`` seconds.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'min_size': 0,
+    'max_size': 20,
+    # Seconds a checkout waits for a free connection before failing
+    'timeout': 10.0,
+    'max_idle': 300.0,
+    'max_lifetime': 1800.0,
+    'check_interval': 30.0,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ('connection', 'created_at', 'released_at')
+
+    def __init__(self, connection, now):
+        self.connection = connection
+        self.created_at = now
+        self.released_at = now
+
+
+class ConnectionPool:
+    """Up to ``max_size`` connections made by ``connect()``, reused LIFO."""
+
+    def __init__(self, connect, ping, min_size=0, max_size=20, timeout=10.0,
+                 max_idle=300.0, max_lifetime=1800.0, check_interval=30.0, name='default'):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1')
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self._connect = connect
+        self._ping = ping
+        self._condition = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._opening = 0
+        self._waiting = 0
+        self._connect_times = deque(maxlen=1024)
+        self._counters = {
+            'connects': 0,
+            'connect_errors': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'expired': 0,
+            'discarded': 0,
+        }
+        self._wait_seconds = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def acquire(self):
+        """A usable connection and whether it was reused; opens one if below ``max_size``."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            self._counters['checkouts'] += 1
+            while not self._idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection free in pool {self.name!r} after {self.timeout}s '
+                        f'({self.max_size} in use)'
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._wait_seconds += time.monotonic() - started
+            # Most recently used first: it is the least likely to have timed out
+            entry = self._idle.pop() if self._idle else None
+            # The slot stays reserved while the connection is checked or opened
+            self._opening += 1
+
+        reused = entry is not None and self._usable(entry)
+        if not reused:
+            entry = self._open()
+        with self._condition:
+            self._opening -= 1
+            self._in_use[id(entry.connection)] = entry
+            if reused:
+                self._counters['reused'] += 1
+        return entry.connection, reused
+
+    def release(self, connection, discard: bool = False) -> None:
+        """Return ``connection``; ``discard`` closes it, e.g. after a connection error."""
+        now = time.monotonic()
+        with self._condition:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                discard = True
+            elif not discard and now - entry.created_at > self.max_lifetime:
+                self._counters['expired'] += 1
+                discard = True
+            if not discard:
+                entry.released_at = now
+                self._idle.append(entry)
+                closing = self._trim(now)
+            else:
+                self._counters['discarded'] += 1
+                closing = []
+            self._condition.notify()
+        if discard:
+            closing.append(connection)
+        for stale in closing:
+            self._close(stale)
+
+    def prefill(self) -> None:
+        """Open connections until ``min_size`` are idle or in use."""
+        while True:
+            with self._condition:
+                if self.size >= self.min_size:
+                    return
+                self._opening += 1
+            try:
+                entry = self._open()
+            except Exception:
+                logger.exception('Could not prefill database pool %r', self.name)
+                return
+            with self._condition:
+                self._opening -= 1
+                self._idle.append(entry)
+                self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._close(entry.connection)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._condition:
+            recent = sum(1 for at in self._connect_times if now - at <= 60)
+            return {
+                'size': self.size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._counters,
+                'connects_per_second': round(recent / 60, 3),
+                'wait_ms_total': round(self._wait_seconds * 1000, 3),
+            }
+
+    def _usable(self, entry) -> bool:
+        now = time.monotonic()
+        if now - entry.created_at > self.max_lifetime:
+            counter = 'expired'
+        elif now - entry.released_at > self.check_interval:
+            try:
+                self._ping(entry.connection)
+                return True
+            except Exception:
+                counter = 'health_check_failures'
+        else:
+            return True
+        with self._condition:
+            self._counters[counter] += 1
+        self._close(entry.connection)
+        return False
+
+    def _open(self):
+        """A new connection; the caller has reserved its slot in ``_opening``."""
+        try:
+            connection = self._connect()
+        except BaseException:
+            with self._condition:
+                self._opening -= 1
+                self._counters['connect_errors'] += 1
+                self._condition.notify()
+            raise
+        now = time.monotonic()
+        with self._condition:
+            self._counters['connects'] += 1
+            self._connect_times.append(now)
+        return _Entry(connection, now)
+
+    def _trim(self, now):
+        # Called with the lock held; the oldest idle connections are at the front
+        closing = []
+        while len(self._idle) > self.min_size and now - self._idle[0].released_at > self.max_idle:
+            closing.append(self._idle.pop(0).connection)
+        return closing
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+
+def get_pool(alias: str, factory):
+    """The pool for database ``alias`` in this process, made by ``factory()`` on first use.
+
+    Pools are dropped after a fork, so pre-forking servers don't share sockets
+    between workers.
+    """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = factory()
+            if pool.min_size:
+                threading.Thread(target=pool.prefill, name=f'db-pool-{alias}', daemon=True).start()
+    return pool
+
+
+def pool_stats() -> dict:
+    """Stats of every pool opened by this process, by database alias."""
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
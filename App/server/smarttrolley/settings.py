@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -26,6 +27,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,19 +59,37 @@ WSGI_APPLICATION = 'smarttrolley.wsgi.application'
 
 from decouple import config
 
+# MySQL connections come from a per-process pool (smarttrolley/db/mysql_pool)
+# and go back to it at the end of every request. With DB_POOL=false, each
+# thread instead keeps its own connection for DB_CONN_MAX_AGE seconds.
+DB_POOL = os.getenv('DB_POOL', 'true').lower() == 'true'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'smarttrolley.db.mysql_pool' if DB_POOL else 'django.db.backends.mysql',
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'PORT': config('DB_PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
         },
     }
 }
 
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '10')),
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE_SECONDS', '300')),
+        # Keep under MySQL's wait_timeout (8 hours by default)
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME_SECONDS', '1800')),
+        'check_interval': float(os.getenv('DB_POOL_CHECK_INTERVAL_SECONDS', '30')),
+    }
+
 
 AUTH_PASSWORD_VALIDATORS = []
 
@@ -91,6 +111,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 APPEND_SLASH = False  # Disable automatic slash appending for API endpoints
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['ETag', 'Idempotent-Replayed', 'Server-Timing']
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
@@ -106,3 +128,95 @@ REST_FRAMEWORK = {
 }
 
 SESSION_TIMEOUT_SECONDS = int(os.getenv('SESSION_TIMEOUT_SECONDS', '30'))
+
+# Heartbeat/scan activity is written in batches (see api/activity.py). Other
+# workers see a touch up to interval + granularity late, so keep that well under
+# SESSION_TIMEOUT_SECONDS. An interval of 0 writes through on every touch.
+ACTIVITY_FLUSH_INTERVAL_SECONDS = float(os.getenv('ACTIVITY_FLUSH_INTERVAL_SECONDS', '5'))
+ACTIVITY_WRITE_GRANULARITY_SECONDS = float(os.getenv('ACTIVITY_WRITE_GRANULARITY_SECONDS', '1'))
+
+# Defaults for `manage.py reap_sessions` (see api/reaper.py)
+SESSION_REAPER_BATCH_SIZE = int(os.getenv('SESSION_REAPER_BATCH_SIZE', '500'))
+SESSION_REAPER_INTERVAL_SECONDS = float(os.getenv('SESSION_REAPER_INTERVAL_SECONDS', '10'))
+
+# Barcode decoding (see api/decoding.py). Set BARCODE_DECODER_WORKERS=0 to decode
+# inline on the request thread, e.g. for local development.
+BARCODE_DECODER_WORKERS = int(os.getenv('BARCODE_DECODER_WORKERS', '2'))
+BARCODE_DECODER_MAX_PENDING = int(os.getenv('BARCODE_DECODER_MAX_PENDING', '16'))
+BARCODE_DECODER_TIMEOUT_SECONDS = float(os.getenv('BARCODE_DECODER_TIMEOUT_SECONDS', '2.0'))
+BARCODE_DECODER_RETRY_AFTER_SECONDS = int(os.getenv('BARCODE_DECODER_RETRY_AFTER_SECONDS', '3'))
+# Preprocessing rungs tried in order until one decodes: gray, downscale, roi, threshold.
+BARCODE_PREPROCESS_LADDER = [
+    step.strip() for step in os.getenv('BARCODE_PREPROCESS_LADDER', 'gray,roi,threshold').split(',') if step.strip()
+]
+
+# Duplicate-frame cache in front of the decoder (see api/frame_cache.py)
+FRAME_CACHE_TTL_SECONDS = float(os.getenv('FRAME_CACHE_TTL_SECONDS', '15'))
+FRAME_CACHE_MAX_TROLLEYS = int(os.getenv('FRAME_CACHE_MAX_TROLLEYS', '1024'))
+FRAME_CACHE_FRAMES_PER_TROLLEY = int(os.getenv('FRAME_CACHE_FRAMES_PER_TROLLEY', '4'))
+FRAME_CACHE_MAX_DISTANCE = int(os.getenv('FRAME_CACHE_MAX_DISTANCE', '4'))
+SCAN_DEBOUNCE_SECONDS = float(os.getenv('SCAN_DEBOUNCE_SECONDS', '5'))
+
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache) when
+# running several worker processes, so catalog invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Stored responses for Idempotency-Key retries (see api/idempotency.py)
+    'idempotency': {
+        'BACKEND': os.getenv('IDEMPOTENCY_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('IDEMPOTENCY_CACHE_LOCATION', 'idempotency'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))},
+    },
+}
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '3600'))
+IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', '10'))
+
+# Product catalog cache (see api/catalog.py). 'full' loads every product on first
+# use; 'lazy' loads barcodes on demand into an LRU of CATALOG_CACHE_MAX_SIZE.
+CATALOG_CACHE_WARMUP = os.getenv('CATALOG_CACHE_WARMUP', 'full')
+CATALOG_CACHE_MAX_SIZE = int(os.getenv('CATALOG_CACHE_MAX_SIZE', '50000'))
+CATALOG_CACHE_VERSION_CHECK_SECONDS = float(os.getenv('CATALOG_CACHE_VERSION_CHECK_SECONDS', '5'))
+# How long a barcode that isn't in the catalog is remembered as unknown
+CATALOG_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('CATALOG_CACHE_NEGATIVE_TTL_SECONDS', '30'))
+
+# Who may read /api/stats, /api/metrics and /api/fleet/status besides staff:
+# requests with "Authorization: Bearer <MONITORING_TOKEN>" (e.g. a Prometheus
+# scrape job) and requests from these addresses. Behind a reverse proxy every
+# request comes from the proxy's address, so prefer the token there.
+MONITORING_TOKEN = os.getenv('MONITORING_TOKEN', '')
+MONITORING_ALLOWED_IPS = [ip.strip() for ip in os.getenv('MONITORING_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# In-memory trolley registry (api/fleet.py). Each worker re-reads trolleys other
+# workers touched every FLEET_REFRESH_SECONDS; an in-use trolley not seen for
+# FLEET_STALE_SECONDS is reported as stale by /api/fleet/status.
+FLEET_SHARDS = int(os.getenv('FLEET_SHARDS', '16'))
+FLEET_REFRESH_SECONDS = float(os.getenv('FLEET_REFRESH_SECONDS', '5'))
+FLEET_STALE_SECONDS = float(os.getenv('FLEET_STALE_SECONDS', '60'))
+
+# Bulk trolley provisioning (provision_trolleys, /api/fleet/provision): ids per
+# statement, and the largest range one request may expand to.
+PROVISION_CHUNK_SIZE = int(os.getenv('PROVISION_CHUNK_SIZE', '1000'))
+PROVISION_MAX_TROLLEYS = int(os.getenv('PROVISION_MAX_TROLLEYS', '50000'))
+
+# 'incremental' reads the running Session.cart_total; 'aggregate' sums cart rows
+# in the database on every request.
+CART_TOTAL_MODE = os.getenv('CART_TOTAL_MODE', 'incremental')
+
+# Largest batch /api/cart/scan/batch accepts in one request
+BATCH_SCAN_MAX_ITEMS = int(os.getenv('BATCH_SCAN_MAX_ITEMS', '200'))
+
+# Cart change push channel (see api/events.py); /api/cart/events needs the ASGI app.
+CART_EVENT_BROKER = os.getenv('CART_EVENT_BROKER', 'api.events.InMemoryBroker')
+CART_EVENTS_KEEPALIVE_SECONDS = float(os.getenv('CART_EVENTS_KEEPALIVE_SECONDS', '15'))
+
+# Serve /api/barcode/scan, /api/cart/view and /api/session/heartbeat with the
+# async views in api/async_views.py. Worth it under ASGI; they are always
+# reachable under /api/async/ as well.
+API_ASYNC_VIEWS = os.getenv('API_ASYNC_VIEWS', 'false').lower() == 'true'
+
+# Share of requests traced for SQL and span timings and given a Server-Timing
+# header (see api/instrumentation.py). Request counts and wall time are always kept.
+INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('INSTRUMENTATION_SAMPLE_RATE', '0.1'))
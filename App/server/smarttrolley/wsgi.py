@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smarttrolley.settings')
 
 application = get_wsgi_application()
+
+# Load the product catalog now instead of on this worker's first scan
+from api.catalog import warm_catalog  # noqa: E402
+
+warm_catalog()
@@ -116,9 +116,11 @@ static bool connectWiFi() {
   return false;
 }
 
-static bool decodeBarcodeOnServer(const uint8_t* imgBuf, size_t imgLen, String& outBarcode) {
+// Decodes the frame and, because trolley_id is passed, adds the product to the
+// trolley's cart in the same request.
+static bool decodeBarcodeOnServer(const uint8_t* imgBuf, size_t imgLen, String& outBarcode, bool& outAdded) {
   HTTPClient http;
-  String url = String(BACKEND_BASE) + "/barcode/scan";
+  String url = String(BACKEND_BASE) + "/barcode/scan?trolley_id=" + TROLLEY_ID;
   http.begin(url);
   http.addHeader("Content-Type", "image/jpeg");
 
@@ -145,18 +147,29 @@ static bool decodeBarcodeOnServer(const uint8_t* imgBuf, size_t imgLen, String&
   bool found = doc["found"] | false;
   if (!found) return false;
 
+  // Same frame or same barcode as a moment ago: already in the cart.
+  bool duplicate = doc["duplicate"] | false;
+  if (duplicate) {
+    Serial.println("Duplicate scan skipped");
+    return false;
+  }
+
   const char* barcode = doc["barcode"];
   if (!barcode) return false;
 
   outBarcode = String(barcode);
+  outAdded = !doc["cart"].isNull();
   return true;
 }
 
+static const int CART_SCAN_ATTEMPTS = 3;
+static uint32_t scanCounter = 0;
+
+// Retries reuse the same Idempotency-Key, so a scan whose response was lost
+// on the way back is not added twice.
 static bool sendToCartScan(const String& barcode) {
-  HTTPClient http;
-  String url = String(BACKEND_BASE) + "/cart/scan";
-  http.begin(url);
-  http.addHeader("Content-Type", "application/json");
+  String key = String(TROLLEY_ID) + "-" + String((uint32_t)ESP.getEfuseMac(), HEX) + "-" +
+               String(millis()) + "-" + String(++scanCounter);
 
   StaticJsonDocument<128> doc;
   doc["trolley_id"] = TROLLEY_ID; // ESP32 path supported by backend
@@ -165,12 +178,22 @@ static bool sendToCartScan(const String& barcode) {
   String body;
   serializeJson(doc, body);
 
-  int code = http.POST(body);
-  String payload = http.getString();
-  http.end();
+  for (int attempt = 1; attempt <= CART_SCAN_ATTEMPTS; attempt++) {
+    HTTPClient http;
+    String url = String(BACKEND_BASE) + "/cart/scan";
+    http.begin(url);
+    http.addHeader("Content-Type", "application/json");
+    http.addHeader("Idempotency-Key", key);
+
+    int code = http.POST(body);
+    String payload = http.getString();
+    http.end();
 
-  Serial.printf("POST /cart/scan (%d): %s\n", code, payload.c_str());
-  return code == 200 || code == 201;
+    Serial.printf("POST /cart/scan (%d): %s\n", code, payload.c_str());
+    if (code > 0) return code == 200 || code == 201;
+    delay(300 * attempt);
+  }
+  return false;
 }
 
 void setup() {
@@ -211,12 +234,13 @@ void loop() {
   }
 
   String decoded;
-  bool ok = decodeBarcodeOnServer(fb->buf, fb->len, decoded);
+  bool added = false;
+  bool ok = decodeBarcodeOnServer(fb->buf, fb->len, decoded, added);
   esp_camera_fb_return(fb);
 
   if (ok) {
     Serial.printf("Decoded barcode: %s\n", decoded.c_str());
-    bool sent = sendToCartScan(decoded);
+    bool sent = added || sendToCartScan(decoded);
     Serial.printf("Cart scan sent: %s\n", sent ? "OK" : "FAIL");
   } else {
     Serial.println("No barcode decoded");